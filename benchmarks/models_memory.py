@@ -0,0 +1,57 @@
+"""
+Measure the memory footprint and construction time of configured tasks.
+
+Usage: python -m benchmarks.models_memory [NTASKS]
+"""
+import datetime
+import sys
+import time
+import tracemalloc
+
+from quartz import models
+
+def generate_tasks(ntasks):
+    start_date = datetime.date(2024, 1, 1)
+    for index in range(ntasks):
+        yield models.Task(
+            name = f'\\Generated\\task_{index}',
+            author = 'benchmark',
+            actions = [
+                models.Action.from_exec_pythonw(
+                    f'C:\\apps\\app_{index % 50}',
+                    'run.py',
+                ),
+            ],
+            triggers = [
+                models.EveryMinutes(
+                    start_boundary_date = start_date,
+                    interval_minutes = (5, 10, 15, 30)[index % 4],
+                ),
+            ],
+            security_options = models.SecurityOptions('svc_user', 'secret'),
+        )
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    ntasks = int(argv[0]) if argv else 50_000
+
+    start = time.perf_counter()
+    tasks = list(generate_tasks(ntasks))
+    elapsed = time.perf_counter() - start
+    del tasks
+
+    # Separate pass for memory, tracing slows construction down.
+    tracemalloc.start()
+    tasks = list(generate_tasks(ntasks))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'tasks:            {len(tasks)}')
+    print(f'construction:     {elapsed:.3f}s')
+    print(f'retained memory:  {current / 1024 / 1024:.1f} MiB')
+    print(f'peak memory:      {peak / 1024 / 1024:.1f} MiB')
+    print(f'bytes per task:   {current / ntasks:.0f}')
+
+if __name__ == '__main__':
+    main()
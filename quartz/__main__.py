@@ -1,3 +1,10 @@
+import cProfile
+import sys
+
+from . import client
+from . import executor
+from . import hosts
+from . import profiling
 from .argparser import argument_parser
 
 def main(argv=None):
@@ -6,6 +13,51 @@ def main(argv=None):
     """
     parser = argument_parser()
     args = parser.parse_args(argv)
-    return args.func(args)
+    executor.configure(
+        max_concurrency = args.max_subprocesses,
+        timeout = args.subprocess_timeout,
+        max_per_host = args.max_per_host,
+        adaptive = args.adaptive_concurrency,
+        min_concurrency = args.min_subprocesses,
+        retries = args.retries,
+    )
+    # One session for the command, shared by the hosts of a fan out. Each
+    # host iterates the configured tasks, a tuple, on its own.
+    args.client = client.Client()
+    remotes = hosts.remotes_from_args(args)
+    if remotes and not getattr(args, 'fan_out', False):
+        parser.error('--host and --hosts-file are not supported by this command')
+    if args.profile:
+        profiler = profiling.enable()
+    if args.cprofile:
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
+    try:
+        if not remotes:
+            return args.func(args)
+        results = hosts.fan_out(
+            lambda: args.func(args),
+            remotes,
+            workers = args.host_workers,
+            on_result = hosts.print_host_result,
+        )
+        failed = sum(1 for host_result in results if host_result.error is not None)
+        print(f'{len(results) - failed} hosts ok, {failed} failed', file=sys.stderr)
+        if failed:
+            return 1
+    finally:
+        if args.cprofile:
+            cprofiler.disable()
+            cprofiler.dump_stats(args.cprofile)
+        if args.profile:
+            profiler.stop()
+            command = ' '.join(sys.argv[1:] if argv is None else argv)
+            profiling.write_report(profiler.report(command), args.profile)
+        if args.subprocess_stats:
+            for line in executor.format_metrics(executor.metrics_summary()):
+                print(line, file=sys.stderr)
+            concurrency = executor.concurrency_summary()
+            if concurrency is not None:
+                print(executor.format_concurrency(concurrency), file=sys.stderr)
 
-main()
+sys.exit(main())
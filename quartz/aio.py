@@ -0,0 +1,246 @@
+"""
+Async scheduled task operations for asyncio programs, on
+asyncio.create_subprocess_exec.
+
+Commands and output parsing are shared with the schtasks module, whose
+functions run the same commands through the executor. Like the executor,
+commands wait for a semaphore, are killed on timeout, and are counted in
+metrics. A cancelled call kills its child process.
+"""
+import asyncio
+import collections
+import csv
+import inspect
+import subprocess
+import time
+
+from . import executor
+from . import hosts
+from . import schtasks
+
+class AsyncExecutor:
+    """
+    Run commands from coroutines, limiting how many run at the same time.
+    """
+
+    def __init__(
+        self,
+        max_concurrency = executor.default_max_concurrency,
+        timeouts = None,
+        timeout = executor.default_timeout,
+        runner = None,
+    ):
+        """
+        :param max_concurrency:
+            Most subprocesses running at the same time.
+        :param timeouts:
+            Dict of command kind to timeout seconds, updating
+            executor.default_timeouts.
+        :param timeout:
+            Timeout for kinds not in timeouts.
+        :param runner:
+            Callable used instead of a subprocess, for emulated commands,
+            like fake.FakeFleet. Takes the command and a timeout keyword and
+            returns a CompletedProcess, or an awaitable of one.
+        """
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.timeouts = dict(executor.default_timeouts)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.timeout = timeout
+        self.runner = runner
+        self.metrics = {}
+
+    def timeout_for(self, kind):
+        return self.timeouts.get(kind, self.timeout)
+
+    def observe(self, kind, seconds, failed=False, timed_out=False):
+        try:
+            command_metrics = self.metrics[kind]
+        except KeyError:
+            command_metrics = self.metrics[kind] = executor.CommandMetrics()
+        command_metrics.observe(seconds, failed=failed, timed_out=timed_out)
+
+    def metrics_summary(self):
+        return {
+            kind: command_metrics.to_dict()
+            for kind, command_metrics in sorted(self.metrics.items())
+        }
+
+    async def _communicate(self, command, timeout):
+        if self.runner is not None:
+            result = self.runner(
+                command,
+                timeout = timeout,
+                stdout = subprocess.PIPE,
+                stderr = subprocess.PIPE,
+            )
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout = subprocess.PIPE,
+            stderr = subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(command, timeout) from None
+        finally:
+            # Timed out or cancelled.
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+    async def run(self, command, kind=None, check=True, text=False, timeout=None):
+        """
+        Run command and return the CompletedProcess, like executor.run.
+        """
+        if kind is None:
+            kind = executor.command_kind(command)
+        if timeout is None:
+            timeout = self.timeout_for(kind)
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                result = await self._communicate(command, timeout)
+            except subprocess.TimeoutExpired as e:
+                self.observe(kind, time.perf_counter() - start, failed=True, timed_out=True)
+                raise hosts.redact_error(e)
+            except OSError:
+                self.observe(kind, time.perf_counter() - start, failed=True)
+                raise
+            except asyncio.CancelledError:
+                self.observe(kind, time.perf_counter() - start)
+                raise
+        self.observe(kind, time.perf_counter() - start, failed=result.returncode != 0)
+        if text:
+            result.stdout = executor.decode(result.stdout)
+            result.stderr = executor.decode(result.stderr)
+        if check and result.returncode:
+            raise subprocess.CalledProcessError(
+                result.returncode,
+                hosts.redact(command),
+                result.stdout,
+                result.stderr,
+            )
+        return result
+
+    async def stream(self, command, kind=None, check=True, timeout=None):
+        """
+        Async generator of decoded stdout lines, while command runs. The
+        command is killed if it is still running after timeout seconds, or
+        if the generator is closed early.
+        """
+        if self.runner is not None:
+            # Emulated commands complete at once, stream their whole output.
+            result = await self.run(command, kind=kind, check=check, text=True, timeout=timeout)
+            for line in result.stdout.splitlines(keepends=True):
+                yield line
+            return
+        if kind is None:
+            kind = executor.command_kind(command)
+        if timeout is None:
+            timeout = self.timeout_for(kind)
+        async with self.semaphore:
+            start = time.perf_counter()
+            deadline = None if timeout is None else asyncio.get_running_loop().time() + timeout
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout = subprocess.PIPE,
+                stderr = subprocess.PIPE,
+            )
+            # Read stderr alongside, so a full pipe cannot block the command.
+            stderr_task = asyncio.ensure_future(process.stderr.read())
+            failed = True
+            try:
+                while True:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - asyncio.get_running_loop().time()
+                    try:
+                        line = await asyncio.wait_for(process.stdout.readline(), remaining)
+                    except asyncio.TimeoutError:
+                        self.observe(kind, time.perf_counter() - start, failed=True, timed_out=True)
+                        raise subprocess.TimeoutExpired(hosts.redact(command), timeout) from None
+                    if not line:
+                        break
+                    yield executor.decode(line)
+                stderr = await stderr_task
+                await process.wait()
+                failed = False
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                if failed:
+                    stderr_task.cancel()
+        self.observe(kind, time.perf_counter() - start, failed=process.returncode != 0)
+        if check and process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, hosts.redact(command), stderr=stderr)
+
+
+default_executor = None
+
+def configure(**kwargs):
+    """
+    Replace the default async executor with one created from kwargs.
+    """
+    global default_executor
+    default_executor = AsyncExecutor(**kwargs)
+    return default_executor
+
+def get_executor():
+    if default_executor is None:
+        configure()
+    return default_executor
+
+async def get_tasks(verbose=False):
+    """
+    Async generator of TaskRow mappings of scheduled tasks, like
+    schtasks.get_tasks.
+    """
+    parser = schtasks.CsvListingParser()
+    # One reader for the whole listing, like schtasks.parse_csv_listing,
+    # given the lines of a row once its quoted fields are closed.
+    lines = collections.deque()
+    reader = csv.reader(iter(lines.popleft, None))
+    quotes = 0
+    async for line in get_executor().stream(schtasks.get_tasks_command(verbose)):
+        lines.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            # A quoted field goes on to the next line.
+            continue
+        quotes = 0
+        while lines:
+            task_row = parser.add(next(reader))
+            if task_row is not None:
+                yield task_row
+
+async def get_xml(task_name, as_string=False):
+    result = await get_executor().run(schtasks.get_xml_command(task_name))
+    if as_string:
+        return result.stdout
+    return schtasks.parse_xml(result.stdout)
+
+async def exists(task_name):
+    try:
+        await get_executor().run(schtasks.exists_command(task_name))
+    except subprocess.CalledProcessError:
+        return False
+    return True
+
+async def delete(task_name, confirm=False):
+    return await get_executor().run(schtasks.delete_command(task_name, confirm))
+
+async def task_create_from_xml(task_name, xml_path, force=False):
+    command = schtasks.create_from_xml_command(task_name, xml_path, force)
+    return await get_executor().run(command)
+
+async def task_run_as(task_name, user, password):
+    command = schtasks.run_as_command(task_name, user, password)
+    return await get_executor().run(command)
@@ -0,0 +1,257 @@
+"""
+Dumped task XML: canonical content hashes, content-addressed archives and
+directory dumps that only rewrite changed files.
+
+An archive holds each distinct canonical document once, under
+objects/<sha256>.xml, and a manifest.json mapping task names to hashes. The
+documents are written as tasks arrive and the manifest last, so tar archives
+are read in two passes, one to the manifest and one yielding the documents,
+without holding them.
+"""
+import collections
+import hashlib
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+
+from lxml import etree
+
+from . import executor
+
+manifest_name = 'manifest.json'
+
+manifest_version = 1
+
+objects_directory = 'objects'
+
+zip_suffixes = ('.zip', )
+
+tar_suffixes = ('.tar.gz', '.tgz')
+
+# Entry of a dump. error is the XMLSyntaxError of a damaged document, whose
+# canonical is None.
+DumpEntry = collections.namedtuple('DumpEntry', ['task_name', 'canonical', 'error'])
+DumpEntry.__new__.__defaults__ = (None, )
+
+def is_archive_path(path):
+    return path.lower().endswith(zip_suffixes + tar_suffixes)
+
+def canonical_xml(data):
+    """
+    Canonical (C14N) UTF-8 bytes of XML document data, without insignificant
+    whitespace, so that documents differing only in encoding or layout
+    compare equal.
+    """
+    # the xml doc says utf-16 but it's usually really utf-8
+    parser = etree.XMLParser(
+        encoding = executor.xml_encoding(data),
+        remove_blank_text = True,
+        remove_comments = True,
+    )
+    root = etree.fromstring(data, parser)
+    return etree.tostring(root, method='c14n')
+
+def content_hash(canonical):
+    return hashlib.sha256(canonical).hexdigest()
+
+def object_name(digest):
+    return f'{objects_directory}/{digest}.xml'
+
+def manifest_dict(tasks):
+    return dict(
+        version = manifest_version,
+        hash = 'sha256',
+        tasks = tasks,
+    )
+
+
+class ArchiveWriter:
+    """
+    Base for writing a content-addressed archive as tasks arrive. Subclasses
+    implement write_member and close_archive.
+    """
+
+    def __init__(self):
+        # Task name to content hash.
+        self.tasks = {}
+        self.digests = set()
+
+    def add(self, task_name, data):
+        """
+        Add XML document data for task_name. Return True if its content was
+        new to the archive.
+        """
+        canonical = canonical_xml(data)
+        digest = content_hash(canonical)
+        self.tasks[task_name] = digest
+        if digest in self.digests:
+            return False
+        self.digests.add(digest)
+        self.write_member(object_name(digest), canonical)
+        return True
+
+    def close(self):
+        manifest = json.dumps(manifest_dict(self.tasks), indent=2, sort_keys=True)
+        self.write_member(manifest_name, manifest.encode('utf-8'))
+        self.close_archive()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.close_archive()
+
+
+class ZipArchiveWriter(ArchiveWriter):
+
+    def __init__(self, file):
+        super().__init__()
+        self.archive = zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def write_member(self, name, data):
+        self.archive.writestr(name, data)
+
+    def close_archive(self):
+        self.archive.close()
+
+
+class TarArchiveWriter(ArchiveWriter):
+    """
+    Each document is written to the compressed stream as it is added.
+    """
+
+    def __init__(self, file):
+        super().__init__()
+        self.archive = tarfile.open(file, 'w:gz')
+        self.mtime = time.time()
+
+    def write_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self.mtime
+        self.archive.addfile(info, io.BytesIO(data))
+
+    def close_archive(self):
+        self.archive.close()
+
+
+def open_archive_writer(path):
+    """
+    ArchiveWriter for path, by its suffix.
+    """
+    if path.lower().endswith(zip_suffixes):
+        return ZipArchiveWriter(path)
+    return TarArchiveWriter(path)
+
+def read_archive(path):
+    """
+    Generate DumpEntry from an archive written by ArchiveWriter, in manifest
+    order for zip archives and in document order for tar archives.
+    """
+    if path.lower().endswith(zip_suffixes):
+        # Members are read on demand, the archive is never loaded whole.
+        with zipfile.ZipFile(path) as archive:
+            manifest = json.loads(archive.read(manifest_name))
+            for task_name, digest in manifest['tasks'].items():
+                yield DumpEntry(task_name, archive.read(object_name(digest)))
+    else:
+        # Sequential passes, as seeking back in gzip decompresses again.
+        task_names = tar_task_names(path)
+        with tarfile.open(path, 'r|gz') as archive:
+            for member in archive:
+                if member.name not in task_names:
+                    continue
+                data = archive.extractfile(member).read()
+                for task_name in task_names[member.name]:
+                    yield DumpEntry(task_name, data)
+
+def tar_task_names(path):
+    """
+    Dict of object name to the task names with it, from the manifest of a
+    tar archive, read without extracting the documents before it.
+    """
+    with tarfile.open(path, 'r|gz') as archive:
+        for member in archive:
+            if member.name == manifest_name:
+                manifest = json.loads(archive.extractfile(member).read())
+                break
+        else:
+            raise ValueError(f'{path} has no {manifest_name}, it was not completely written')
+    task_names = collections.defaultdict(list)
+    for task_name, digest in manifest['tasks'].items():
+        task_names[object_name(digest)].append(task_name)
+    return task_names
+
+def document_task_name(data):
+    """
+    Task name from the RegistrationInfo URI of an XML document, or None.
+    """
+    root = etree.fromstring(data)
+    uri = root.findtext('{*}RegistrationInfo/{*}URI')
+    if uri:
+        return uri.strip()
+
+def read_directory(path):
+    """
+    Generate DumpEntry from the .xml files of a dump directory. Task names
+    are from the documents' URI, falling back to the filename, which damaged
+    documents are named by.
+    """
+    with os.scandir(path) as entries:
+        filenames = sorted(entry.name for entry in entries if entry.is_file())
+    for filename in filenames:
+        stem, extension = os.path.splitext(filename)
+        if extension.lower() != '.xml':
+            continue
+        with open(os.path.join(path, filename), 'rb') as xml_file:
+            data = xml_file.read()
+        try:
+            canonical = canonical_xml(data)
+        except etree.XMLSyntaxError as e:
+            yield DumpEntry('\\' + stem, None, e)
+            continue
+        task_name = document_task_name(canonical) or '\\' + stem
+        yield DumpEntry(task_name, canonical)
+
+def read_dump(path):
+    """
+    Generate DumpEntry from a dump directory or archive.
+    """
+    if os.path.isdir(path):
+        return read_directory(path)
+    return read_archive(path)
+
+def write_if_changed(path, data):
+    """
+    Write data to path, through a temp file, unless path already has the
+    same canonical content. Return True if written.
+    """
+    try:
+        with open(path, 'rb') as existing_file:
+            existing = existing_file.read()
+    except FileNotFoundError:
+        pass
+    else:
+        try:
+            if canonical_xml(existing) == canonical_xml(data):
+                return False
+        except etree.XMLSyntaxError:
+            # Damaged file, replace it.
+            pass
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.xml.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return True
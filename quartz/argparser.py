@@ -1,10 +1,16 @@
 import argparse
 import collections
+import datetime
 import operator
 import re
 
+from . import bench
 from . import commands
 from . import const
+from . import executor
+from . import helper
+from . import lock
+from . import validate
 
 def match_operator(pattern):
     regex = re.compile(pattern)
@@ -15,6 +21,40 @@ filter_operators = {
     '~=': match_operator,
 }
 
+# Suffix of a duration argument to seconds.
+duration_units = {
+    's': 1,
+    'm': 60,
+    'h': 60 * 60,
+    'd': 24 * 60 * 60,
+}
+
+def duration_arg(value):
+    """
+    datetime.timedelta from a number with a unit suffix, like 15m, or an ISO
+    8601 duration.
+    """
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smhd])', value.strip().lower())
+    if match:
+        number, unit = match.groups()
+        return datetime.timedelta(seconds=float(number) * duration_units[unit])
+    try:
+        return validate.parse_iso8601_duration(value.strip().upper())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid duration {value!r}')
+
+def levels_arg(value):
+    """
+    List of positive ints from comma separated numbers, like 1,2,4.
+    """
+    try:
+        levels = [int(level) for level in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid levels {value!r}')
+    if not levels or min(levels) < 1:
+        raise argparse.ArgumentTypeError(f'invalid levels {value!r}')
+    return levels
+
 def add_subcommand(name, func, subparsers):
     """
     Add a sub-command to subparsers.
@@ -33,6 +73,42 @@ def dump_subcommand(args):
 def filter_eval(arg):
     return eval("lambda task: " + arg)
 
+def add_bench_subcommand(subparsers):
+    # bench
+    bench_command = add_subcommand(
+        'bench',
+        commands.bench_command,
+        subparsers,
+    )
+    bench_command.set_defaults(fan_out=True)
+    bench_command.add_argument(
+        '--count',
+        type = int,
+        default = bench.default_count,
+        help = 'Throwaway tasks per concurrency level. Default: %(default)s.',
+    )
+    bench_command.add_argument(
+        '--levels',
+        type = levels_arg,
+        help =
+            'Comma separated numbers of commands to run at the same time.'
+            ' Default: powers of two up to --max-subprocesses, or'
+            ' --max-per-host against a remote host.',
+    )
+    bench_command.add_argument(
+        '--folder',
+        default = bench.default_folder,
+        help =
+            'Scratch task folder of its own, deleted at the end. Default:'
+            ' %(default)s.',
+    )
+    bench_command.add_argument(
+        '--format',
+        choices = ['text', 'json'],
+        default = 'text',
+        help = 'Default: %(default)s.',
+    )
+
 def add_capture_subcommand(subparsers):
     # capture
     capture_command = add_subcommand(
@@ -40,6 +116,7 @@ def add_capture_subcommand(subparsers):
         commands.capture_tasks,
         subparsers,
     )
+    capture_command.set_defaults(fan_out=True)
     capture_command.add_argument(
         '--select',
         action = 'append',
@@ -74,10 +151,15 @@ def add_dump_subcommand(subparsers):
         commands.dump_xml,
         dump_subparsers,
     )
+    dump_xml_command.set_defaults(fan_out=True)
     dump_xml_command.add_argument(
         '-o',
         '--output',
-        help = 'Filename to output to. Default to stdout.',
+        help =
+            'Filename to output to, formatted with task and host. Files whose'
+            ' content is unchanged are not rewritten. A .zip, .tar.gz or .tgz'
+            ' filename, formatted with host, writes a single archive storing'
+            ' identical documents once. Default to stdout.',
     )
     dump_xml_command.add_argument(
         '--replace-backslashes',
@@ -85,6 +167,54 @@ def add_dump_subcommand(subparsers):
         help = 'Replacement character for backslashes in filenames.',
     )
 
+def add_history_subcommand(subparsers):
+    # history
+    history_command = add_subcommand(
+        'history',
+        commands.history_command,
+        subparsers,
+    )
+    history_command.add_argument(
+        'source',
+        nargs = '*',
+        help =
+            'Event log exports, from wevtutil qe /f:xml or saved as XML, or -'
+            ' for stdin. Default: query the operational log with wevtutil.',
+    )
+    history_command.add_argument(
+        '--store',
+        help =
+            'JSON file to keep the history in between runs. Only events newer'
+            ' than those already in it are added.',
+    )
+    history_command.add_argument(
+        '--count',
+        type = int,
+        help = 'Most events to query with wevtutil.',
+    )
+    history_command.add_argument(
+        '--tasks',
+        nargs = '+',
+        help = 'Only summarize tasks with these names or wildcards.',
+    )
+    history_command.add_argument(
+        '--sort',
+        choices = list(commands.history_sort_keys),
+        default = 'total',
+        help = 'Sort tasks by this, descending. Default: %(default)s.',
+    )
+    history_command.add_argument(
+        '--top',
+        type = int,
+        help = 'Only print this many tasks.',
+    )
+    history_command.add_argument(
+        '--format',
+        choices = ['text', 'json'],
+        default = 'text',
+        help = 'Output format. Default: %(default)s.',
+    )
+
 def add_ls_subcommand(subparsers):
     # ls (list_command)
     ls_command = add_subcommand(
@@ -92,6 +222,7 @@ def add_ls_subcommand(subparsers):
         commands.list_command,
         subparsers,
     )
+    ls_command.set_defaults(fan_out=True)
     ls_command.add_argument(
         'paths',
         nargs = '*',
@@ -99,8 +230,30 @@ def add_ls_subcommand(subparsers):
     )
     ls_command.add_argument(
         '--sort',
+        nargs = '?',
+        const = 'name',
+        choices = ['name', 'next-run', 'last-run'],
+        help =
+            'Sort by name, the default, by next run time, soonest first, or'
+            ' by last run time, most recent first.',
+    )
+    ls_command.add_argument(
+        '--due-within',
+        type = duration_arg,
+        help =
+            'Only tasks due to run within this time, like 15m, 2h or PT15M,'
+            ' including overdue ones.',
+    )
+    ls_command.add_argument(
+        '--last-result-nonzero',
         action = 'store_true',
-        help = 'Sort the names.',
+        help = 'Only tasks whose last run returned nonzero.',
+    )
+    ls_command.add_argument(
+        '--format',
+        choices = ['text', 'json'],
+        default = 'text',
+        help = 'Output format. JSON has parsed run times. Default: %(default)s.',
     )
 
 def add_lsconf_subcommand(subparsers):
@@ -110,6 +263,7 @@ def add_lsconf_subcommand(subparsers):
         commands.list_configured,
         subparsers,
     )
+    lsconf_command.set_defaults(fan_out=True)
     lsconf_command.add_argument(
         'paths',
         nargs = '*',
@@ -125,6 +279,89 @@ def add_lsconf_subcommand(subparsers):
         action = 'store_true',
         help = 'Check that task exists in Scheduled Tasks.',
     )
+    lsconf_command.add_argument(
+        '--metrics-file',
+        help =
+            'With --check, write Prometheus textfile metrics to this file,'
+            ' formatted with host, or with the host before the extension'
+            ' against a remote host.',
+    )
+
+def add_helper_subcommand(subparsers):
+    # helper
+    helper_command = add_subcommand(
+        'helper',
+        commands.run_helper,
+        subparsers,
+    )
+    helper_command.add_argument(
+        '--address',
+        help = 'Pipe or socket path to listen on.',
+    )
+    helper_command.add_argument(
+        '--authkey-file',
+        help = 'File with the key clients authenticate with.',
+    )
+    helper_command.add_argument(
+        '--workers',
+        type = int,
+        default = helper.default_workers,
+        help = 'Operations to run at once. Default: %(default)s.',
+    )
+    helper_command.add_argument(
+        '--idle-timeout',
+        type = float,
+        default = helper.default_idle_timeout,
+        help = 'Exit after this many seconds without operations.',
+    )
+    helper_command.add_argument(
+        '--once',
+        action = 'store_true',
+        help =
+            'Exit after serving one connection. Update launches the helper'
+            ' this way, as any process of the user can read the key.',
+    )
+
+def add_restore_subcommand(subparsers):
+    # restore
+    restore_command = add_subcommand(
+        'restore',
+        commands.restore,
+        subparsers,
+    )
+    restore_command.set_defaults(fan_out=True)
+    restore_command.add_argument(
+        'source',
+        help = 'Directory or .zip, .tar.gz or .tgz archive written by dump xml.',
+    )
+    restore_command.add_argument(
+        '--include',
+        action = 'append',
+        help = 'Restore only tasks matching this wildcard. Repeatable.',
+    )
+    restore_command.add_argument(
+        '--exclude',
+        action = 'append',
+        help = 'Skip tasks matching this wildcard. Repeatable.',
+    )
+    restore_command.add_argument(
+        '--workers',
+        type = int,
+        default = executor.default_max_concurrency,
+        help = 'Most tasks to register at the same time. Default: %(default)s.',
+    )
+    restore_command.add_argument(
+        '--no-validate',
+        dest = 'validate',
+        action = 'store_false',
+        help = 'Do not validate documents against the task schema.',
+    )
+    restore_command.add_argument(
+        '--elevation',
+        choices = ['batch', 'helper'],
+        default = 'batch',
+        help = 'How to run registrations that need admin, as for update.',
+    )
 
 def add_rm_subcommand(subparsers):
     # rm
@@ -133,11 +370,138 @@ def add_rm_subcommand(subparsers):
         commands.remove,
         subparsers,
     )
+    remove_command.set_defaults(fan_out=True)
     remove_command.add_argument(
         'name_or_wildcard',
         nargs = '+',
     )
 
+def add_schedule_subcommand(subparsers):
+    # schedule
+    schedule_command = add_subcommand(
+        'schedule',
+        commands.schedule_command,
+        subparsers,
+    )
+    schedule_command.add_argument(
+        '--from',
+        dest = 'from_',
+        type = datetime.datetime.fromisoformat,
+        help = 'Start of the window, ISO 8601. Default: now.',
+    )
+    schedule_command.add_argument(
+        '--to',
+        type = datetime.datetime.fromisoformat,
+        help = 'End of the window, ISO 8601. Default: a week after --from.',
+    )
+    schedule_command.add_argument(
+        '--bin',
+        type = int,
+        default = 60,
+        help = 'Seconds per histogram bin. Default: %(default)s.',
+    )
+    schedule_command.add_argument(
+        '--include-disabled',
+        action = 'store_true',
+        help = 'Count runs of disabled triggers.',
+    )
+    schedule_command.add_argument(
+        '--all-bins',
+        action = 'store_true',
+        help = 'Print histogram bins without runs too.',
+    )
+    schedule_command.add_argument(
+        '--format',
+        choices = ['text', 'json'],
+        default = 'text',
+        help = 'Output format. Default: %(default)s.',
+    )
+
+def add_serve_subcommand(subparsers):
+    # serve
+    serve_command = add_subcommand(
+        'serve',
+        commands.serve_api,
+        subparsers,
+    )
+    serve_command.add_argument(
+        '--host',
+        default = '127.0.0.1',
+        help = 'Address to listen on. Default: %(default)s.',
+    )
+    serve_command.add_argument(
+        '--port',
+        type = int,
+        default = 8765,
+        help = 'Port to listen on. Default: %(default)s.',
+    )
+    serve_command.add_argument(
+        '--socket',
+        help = 'Listen on this UNIX socket path instead of host and port.',
+    )
+    serve_command.add_argument(
+        '--refresh-interval',
+        type = float,
+        default = 30,
+        help =
+            'Seconds between background inventory refreshes.'
+            ' Default: %(default)s.',
+    )
+    serve_command.add_argument(
+        '--max-age',
+        type = float,
+        default = 60,
+        help =
+            'Seconds before a request refreshes the inventory itself.'
+            ' Default: %(default)s.',
+    )
+    serve_command.add_argument(
+        '--no-xml',
+        action = 'store_true',
+        help = 'Keep only the listing, not each task\'s XML.',
+    )
+    serve_command.add_argument(
+        '--allow-apply',
+        action = 'store_true',
+        help =
+            'Serve POST /apply, to requests with the token of --token-file'
+            ' as "Authorization: Bearer TOKEN".',
+    )
+    serve_command.add_argument(
+        '--token-file',
+        help =
+            'File of the /apply token, created readable only by the user if'
+            ' missing. Default: ~/.quartz/serve.token.',
+    )
+    serve_command.add_argument(
+        '--elevation',
+        choices = ['batch', 'helper'],
+        default = 'helper',
+        help = 'How apply runs operations that need admin. Default: %(default)s.',
+    )
+
+def add_spread_subcommand(subparsers):
+    # spread
+    spread_command = add_subcommand(
+        'spread',
+        commands.spread_command,
+        subparsers,
+    )
+    spread_command.add_argument(
+        '-o',
+        '--output',
+        help =
+            'Offsets JSON file to write, for QUARTZ_OFFSETS_FILE. Default to'
+            ' stdout.',
+    )
+    spread_command.add_argument(
+        '--pin',
+        action = 'append',
+        help =
+            'Leave tasks matching this wildcard where they are, in addition'
+            ' to QUARTZ_PINNED. Repeatable.',
+    )
+
 def add_update_subcommand(subparsers):
     # update
     update_command = add_subcommand(
@@ -145,6 +509,7 @@ def add_update_subcommand(subparsers):
         commands.update,
         subparsers,
     )
+    update_command.set_defaults(fan_out=True)
     update_command.add_argument(
         '--tasks',
         nargs = '+',
@@ -162,6 +527,130 @@ def add_update_subcommand(subparsers):
             'Pause after each command in admin batch script. No effect if'
             ' admin is not required.',
     )
+    update_command.add_argument(
+        '--prune',
+        action = 'store_true',
+        help =
+            'Delete registered tasks that are not configured, in folders'
+            ' owned by the config. The folders are QUARTZ_FOLDERS or the'
+            ' folders of the configured tasks, but the root folder only'
+            ' when listed in QUARTZ_FOLDERS.',
+    )
+    update_command.add_argument(
+        '--allow-empty-prune',
+        action = 'store_true',
+        help =
+            'With --prune, delete every owned task when the config has no'
+            ' tasks, instead of refusing.',
+    )
+    update_command.add_argument(
+        '--plan',
+        nargs = '?',
+        const = 'text',
+        choices = ['text', 'json'],
+        help =
+            'Print what would be created, overwritten, left unchanged and'
+            ' deleted, without doing it.',
+    )
+    update_command.add_argument(
+        '--elevation',
+        choices = ['batch', 'helper'],
+        default = 'batch',
+        help =
+            'How to run operations that need admin. batch runs an elevated'
+            ' batch script that stops at the first failure. helper sends them'
+            ' to the elevated helper, launching it if needed, and reports'
+            ' each result. Default: %(default)s.',
+    )
+    update_command.add_argument(
+        '--bulk',
+        action = 'store_true',
+        help =
+            'Apply every create, run as change and delete from one PowerShell'
+            ' script, run once, elevated if any task needs admin, instead of'
+            ' schtasks commands per task.',
+    )
+    update_command.add_argument(
+        '--metrics-file',
+        help =
+            'Write Prometheus textfile metrics of the run to this file,'
+            ' atomically. Formatted with host, or with the host before the'
+            ' extension against a remote host.',
+    )
+    update_command.add_argument(
+        '-v',
+        '--verbose',
+        action = 'store_true',
+        help = 'Print render cache statistics.',
+    )
+
+def add_validate_subcommand(subparsers):
+    # validate
+    validate_command = add_subcommand(
+        'validate',
+        commands.validate_config,
+        subparsers,
+    )
+    validate_command.add_argument(
+        '--file-exists',
+        action = 'store_true',
+        help = 'Validate that working directories and commands exist.',
+    )
+
+def add_watch_subcommand(subparsers):
+    # watch
+    watch_command = add_subcommand(
+        'watch',
+        commands.watch_config,
+        subparsers,
+    )
+    watch_command.add_argument(
+        '--path',
+        action = 'append',
+        default = [],
+        help =
+            'Also watch Python files in this directory. The config module\'s'
+            ' directory is always watched.',
+    )
+    watch_command.add_argument(
+        '--interval',
+        type = float,
+        default = 1.0,
+        help = 'Seconds between checking the files. Default: %(default)s.',
+    )
+    watch_command.add_argument(
+        '--debounce',
+        type = float,
+        default = 0.5,
+        help =
+            'Seconds files must stay unchanged before reloading.'
+            ' Default: %(default)s.',
+    )
+    watch_command.add_argument(
+        '--prune',
+        action = 'store_true',
+        help = 'Delete tasks removed from the config, in folders it owns.',
+    )
+    watch_command.add_argument(
+        '--allow-empty-prune',
+        action = 'store_true',
+        help =
+            'With --prune, delete every owned task when the config has no'
+            ' tasks, instead of refusing.',
+    )
+    watch_command.add_argument(
+        '--validate-file-exists',
+        action = 'store_true',
+        help = 'During validation, validate that paths to files exist.',
+    )
+    watch_command.add_argument(
+        '--elevation',
+        choices = ['batch', 'helper'],
+        default = 'helper',
+        help =
+            'How to run operations that need admin. The helper is launched'
+            ' for each change that needs it. Default: %(default)s.',
+    )
 
 def argument_parser():
     """
@@ -171,13 +660,134 @@ def argument_parser():
         prog = const.APPNAME,
     )
 
+    parser.add_argument(
+        '--max-subprocesses',
+        type = int,
+        default = executor.default_max_concurrency,
+        help = 'Most commands to run at the same time. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--subprocess-timeout',
+        type = float,
+        default = executor.default_timeout,
+        help =
+            'Seconds before killing a command, for kinds of commands without'
+            ' their own timeout. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--adaptive-concurrency',
+        action = 'store_true',
+        help =
+            'Adapt how many commands run at the same time, up to'
+            ' --max-subprocesses, to their latency and transient failures.',
+    )
+    parser.add_argument(
+        '--min-subprocesses',
+        type = int,
+        default = 1,
+        help =
+            'Fewest commands to run at the same time with'
+            ' --adaptive-concurrency. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--retries',
+        type = int,
+        default = executor.default_retries,
+        help =
+            'Times to retry queries, deletes and overwriting creates that time'
+            ' out or fail transiently. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--lock-dir',
+        help =
+            'Directory of the locks that commands changing tasks hold per'
+            f' host. Default: {lock.LOCKDIRVAR} or a quartz\\locks folder of'
+            ' ProgramData or the temporary directory.',
+    )
+    parser.add_argument(
+        '--lock-timeout',
+        type = float,
+        help =
+            'Seconds to wait for the lock of a host before failing. Default:'
+            ' wait until it is released.',
+    )
+    parser.add_argument(
+        '--no-lock',
+        action = 'store_true',
+        help = 'Change tasks without the lock of the host, nor coalescing updates.',
+    )
+    parser.add_argument(
+        '--subprocess-stats',
+        action = 'store_true',
+        help =
+            'Print counts and latency of commands run, by kind, and the'
+            ' adaptive concurrency, at exit.',
+    )
+
+    parser.add_argument(
+        '--profile',
+        nargs = '?',
+        const = '-',
+        metavar = 'FILE',
+        help =
+            'Write a JSON report of time per phase and task, commands run and'
+            ' peak memory to FILE, or stderr without FILE.',
+    )
+    parser.add_argument(
+        '--cprofile',
+        metavar = 'FILE',
+        help = 'Dump cProfile stats to FILE, for pstats.',
+    )
+
+    parser.add_argument(
+        '--host',
+        action = 'append',
+        help =
+            'Run against a remote host with schtasks /s. Repeat or separate'
+            ' with commas for several hosts.',
+    )
+    parser.add_argument(
+        '--hosts-file',
+        help =
+            'File of "HOST [USER [PASSWORD]]" lines of remote hosts to run'
+            ' against.',
+    )
+    parser.add_argument(
+        '--remote-user',
+        help = 'Account for remote hosts, schtasks /u.',
+    )
+    parser.add_argument(
+        '--remote-password',
+        help = 'Password for --remote-user, schtasks /p.',
+    )
+    parser.add_argument(
+        '--host-workers',
+        type = int,
+        default = 8,
+        help = 'Most hosts to run against at the same time. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--max-per-host',
+        type = int,
+        help = 'Most commands to run at the same time against one host.',
+    )
+
     subparsers = parser.add_subparsers()
 
+    add_bench_subcommand(subparsers)
     add_capture_subcommand(subparsers)
     add_dump_subcommand(subparsers)
+    add_helper_subcommand(subparsers)
+    add_history_subcommand(subparsers)
     add_ls_subcommand(subparsers)
     add_lsconf_subcommand(subparsers)
+    add_restore_subcommand(subparsers)
     add_rm_subcommand(subparsers)
+    add_schedule_subcommand(subparsers)
+    add_serve_subcommand(subparsers)
+    add_spread_subcommand(subparsers)
     add_update_subcommand(subparsers)
+    add_validate_subcommand(subparsers)
+    add_watch_subcommand(subparsers)
 
     return parser
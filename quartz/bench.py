@@ -0,0 +1,338 @@
+"""
+Live throughput probe of a host's Task Scheduler, for choosing how many
+commands to run at the same time against it.
+
+Throwaway tasks are registered, queried, changed and deleted in a scratch
+folder, at increasing concurrency, timing each operation. The scratch folder
+is emptied and deleted when the run ends, however it ends, and at the start
+of a run, for one that was killed.
+
+Commands are retried like any other, see executor.is_idempotent, configure
+the executor without retries to count transient failures as errors.
+"""
+import concurrent.futures
+import contextvars
+import math
+import re
+import subprocess
+import time
+
+from . import const
+from . import executor
+from . import hosts
+from . import powershell
+from . import schtasks
+from . import utils
+
+default_folder = '\\' + const.APPNAME + '-bench'
+
+default_count = 20
+
+# Levels within this fraction of the best throughput are as good, the
+# lowest is recommended.
+knee_fraction = 0.9
+
+# Most errors per operation of a level to recommend it.
+max_error_rate = 0.01
+
+# Disabled, without triggers, it never runs.
+task_xml = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<Task version="1.2" xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task">
+    <RegistrationInfo>
+        <Description>quartz bench scratch task, safe to delete.</Description>
+    </RegistrationInfo>
+    <Settings>
+        <Enabled>false</Enabled>
+    </Settings>
+    <Actions Context="Author">
+        <Exec>
+            <Command>cmd.exe</Command>
+            <Arguments>/c exit 0</Arguments>
+        </Exec>
+    </Actions>
+</Task>
+"""
+
+# Names of the tasks of a bench, in the scratch folder.
+task_name_regex = re.compile(r'L\d+-\d+')
+
+class ScratchFolderError(Exception):
+    pass
+
+
+def default_levels(max_level):
+    """
+    Powers of two up to max_level, and max_level.
+    """
+    levels = [2 ** exponent for exponent in range(int(math.log2(max_level)) + 1)]
+    if levels[-1] != max_level:
+        levels.append(max_level)
+    return levels
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest rank percentile of sorted values, None without values.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class OperationStats:
+    """
+    Latency and errors of one operation over the tasks of a level.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.wall_seconds = 0.0
+
+    def add(self, seconds, ok):
+        self.latencies.append(seconds)
+        self.errors += not ok
+
+    def to_dict(self):
+        latencies = sorted(self.latencies)
+        return dict(
+            count = len(latencies),
+            errors = self.errors,
+            ops_per_second = len(latencies) / self.wall_seconds if self.wall_seconds else 0.0,
+            p50_seconds = percentile(latencies, 0.5),
+            p99_seconds = percentile(latencies, 0.99),
+        )
+
+
+def recommend(levels):
+    """
+    The lowest level whose throughput is within knee_fraction of the best,
+    among those with an error rate up to max_error_rate, or None.
+
+    :param levels:
+        Level dicts of Bench.run_level.
+    """
+    eligible = [
+        level for level in levels
+        if level['operations'] and level['errors'] <= max_error_rate * level['count']
+    ]
+    if not eligible:
+        return None
+    best = max(level['ops_per_second'] for level in eligible)
+    return min(
+        level['level'] for level in eligible
+        if level['ops_per_second'] >= knee_fraction * best
+    )
+
+
+class Bench:
+    """
+    Register, query, change and delete count throwaway tasks at each level
+    of concurrency, with the schtasks functions, so against the targeted
+    host, see hosts.target.
+    """
+
+    # Methods of a task name, run in this order for each level.
+    operations = (
+        'create',
+        'exists',
+        'get_xml',
+        'change',
+        'delete',
+    )
+
+    def __init__(self, levels, count=default_count, folder=default_folder):
+        """
+        :param levels:
+            Numbers of operations to run at the same time, in order.
+        :param count:
+            Tasks per level.
+        :param folder:
+            Scratch task folder, deleted with every task in it.
+        """
+        folder = schtasks.normalize_task_name(folder).rstrip('\\')
+        if not folder:
+            raise ValueError('The scratch folder cannot be the root folder')
+        self.levels = levels
+        self.count = count
+        self.folder = folder
+        self.xml_path = None
+
+    def task_names(self, level):
+        return [
+            f'{self.folder}\\L{level:03}-{index:05}'
+            for index in range(self.count)
+        ]
+
+    def create(self, task_name):
+        schtasks.task_create_from_xml(task_name, self.xml_path, force=True)
+
+    def exists(self, task_name):
+        if not schtasks.exists(task_name):
+            raise subprocess.CalledProcessError(1, schtasks.exists_command(task_name))
+
+    def get_xml(self, task_name):
+        schtasks.get_xml(task_name)
+
+    def change(self, task_name):
+        schtasks.task_enable(task_name, enabled=False)
+
+    def delete(self, task_name):
+        schtasks.delete(task_name)
+
+    def timed(self, operation, task_name):
+        """
+        Return (seconds, ok) of an operation on a task.
+        """
+        start = time.perf_counter()
+        try:
+            getattr(self, operation)(task_name)
+            ok = True
+        except (subprocess.SubprocessError, OSError):
+            ok = False
+        return time.perf_counter() - start, ok
+
+    def run_operation(self, operation, task_names, level):
+        stats = OperationStats()
+        pool = concurrent.futures.ThreadPoolExecutor(level)
+        try:
+            start = time.perf_counter()
+            futures = [
+                # Copied for the targeted host.
+                pool.submit(contextvars.copy_context().run, self.timed, operation, task_name)
+                for task_name in task_names
+            ]
+            for future in futures:
+                stats.add(*future.result())
+            stats.wall_seconds = time.perf_counter() - start
+        finally:
+            pool.shutdown(cancel_futures=True)
+        return stats
+
+    def run_level(self, level):
+        """
+        Dict of the level's "count" of operations, "errors", overall
+        "ops_per_second" and "operations", operation name to
+        OperationStats.to_dict.
+        """
+        task_names = self.task_names(level)
+        operations = {}
+        for operation in self.operations:
+            operations[operation] = self.run_operation(operation, task_names, level)
+        count = sum(len(stats.latencies) for stats in operations.values())
+        wall_seconds = sum(stats.wall_seconds for stats in operations.values())
+        return dict(
+            level = level,
+            count = count,
+            errors = sum(stats.errors for stats in operations.values()),
+            ops_per_second = count / wall_seconds if wall_seconds else 0.0,
+            operations = {
+                operation: stats.to_dict() for operation, stats in operations.items()
+            },
+        )
+
+    def scratch_tasks(self):
+        """
+        Return (names of tasks of a bench, names of other tasks) in the
+        scratch folder.
+        """
+        prefix = (self.folder + '\\').casefold()
+        bench_names = []
+        other_names = []
+        for row in schtasks.get_tasks():
+            task_name = row['TaskName']
+            if task_name.casefold().startswith(prefix):
+                if task_name_regex.fullmatch(task_name[len(prefix):]):
+                    bench_names.append(task_name)
+                else:
+                    other_names.append(task_name)
+        return bench_names, other_names
+
+    def cleanup(self):
+        """
+        Delete the bench tasks in the scratch folder, then the folder. Return
+        the names of the tasks that could not be deleted.
+        """
+        task_names, other_names = self.scratch_tasks()
+        left = []
+        with concurrent.futures.ThreadPoolExecutor(max(self.levels)) as pool:
+            futures = {
+                pool.submit(contextvars.copy_context().run, schtasks.delete, task_name): task_name
+                for task_name in task_names
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except (subprocess.SubprocessError, OSError):
+                    left.append(futures[future])
+        if not left and not other_names:
+            command = powershell.delete_folder_command(self.folder, hosts.target.get())
+            # Fails without the folder, when it was already clean.
+            executor.run(command, check=False)
+        return sorted(left)
+
+    def run(self, on_level=None):
+        """
+        Run every level and return dict of "levels", list of run_level
+        dicts, the "recommended" level, and "left", the scratch tasks that
+        could not be deleted.
+
+        :param on_level:
+            Optional callable given each level dict as it completes.
+        """
+        levels = []
+        with utils.removed_tempfile(prefix='quartz_bench_', suffix='.xml') as xml_file:
+            xml_file.write(task_xml.encode('utf-8'))
+            xml_file.close()
+            self.xml_path = xml_file.name
+            _, other_names = self.scratch_tasks()
+            if other_names:
+                raise ScratchFolderError(
+                    f'{self.folder} has tasks not created by bench, like'
+                    f' {other_names[0]}, use a folder of its own'
+                )
+            # Left by a run that was killed.
+            self.cleanup()
+            try:
+                for level in self.levels:
+                    level_result = self.run_level(level)
+                    levels.append(level_result)
+                    if on_level is not None:
+                        on_level(level_result)
+            finally:
+                left = self.cleanup()
+        return dict(
+            levels = levels,
+            recommended = recommend(levels),
+            left = left,
+        )
+
+
+def worker_option(recommended, remote=False):
+    """
+    Command line option list setting the recommended level for update and
+    rm, per host against a remote host.
+    """
+    option = '--max-per-host' if remote else '--max-subprocesses'
+    return [option, str(recommended)]
+
+def format_seconds(seconds):
+    return '-' if seconds is None else f'{seconds:.3f}s'
+
+def format_level(level):
+    """
+    Lines of text of a level dict.
+    """
+    lines = [
+        f'concurrency {level["level"]}: {level["ops_per_second"]:.1f} ops/s,'
+        f' {level["errors"]} errors'
+    ]
+    for operation, data in level['operations'].items():
+        lines.append(
+            f'  {operation:<8} {data["ops_per_second"]:8.1f} ops/s'
+            f'  p50 {format_seconds(data["p50_seconds"])}'
+            f'  p99 {format_seconds(data["p99_seconds"])}'
+            f'  {data["errors"]} errors'
+        )
+    return lines
@@ -0,0 +1,154 @@
+"""
+Validation of a whole configuration, collecting every error instead of
+stopping at the first.
+"""
+import collections
+import weakref
+
+from . import models
+from . import schtasks
+from . import validate
+
+# path is like "triggers[0].repetition", empty for the task itself.
+ValidationError = collections.namedtuple(
+    'ValidationError',
+    ['task_name', 'path', 'message'],
+)
+
+class ConfigValidationError(ValueError):
+    """
+    The configuration has invalid tasks. errors is a list of
+    ValidationError.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(
+            f'{len(errors)} validation errors\n'
+            + '\n'.join(map(format_error, errors))
+        )
+
+def format_error(error):
+    location = error.task_name
+    if error.path:
+        location += ': ' + error.path
+    return f'{location}: {error.message}'
+
+# Type to whether it is a model class. isinstance with the ABC base is slow.
+_model_types = {}
+
+def is_model(value):
+    class_ = type(value)
+    try:
+        return _model_types[class_]
+    except KeyError:
+        _model_types[class_] = result = issubclass(class_, models.Base)
+        return result
+
+def children(instance):
+    """
+    Generate (path, model instance) of the model instances held by instance.
+    """
+    for field in instance._fields:
+        value = getattr(instance, field)
+        if type(value) is list:
+            for index, item in enumerate(value):
+                if is_model(item):
+                    yield (f'{field}[{index}]', item)
+        elif is_model(value):
+            yield (field, value)
+
+class Checker:
+    """
+    Validate tasks one at a time, remembering the shared objects already
+    validated and the names already seen, so tasks can be checked as they
+    are generated.
+    """
+
+    def __init__(self, file_exists=False):
+        self.kwargs = dict(
+            file_exists = file_exists,
+            stat_cache = validate.StatCache(),
+            recurse = False,
+        )
+        # Validated object to list of (path, message) of it and the objects
+        # it holds. Weak, for generated tasks that are gone.
+        self.results = weakref.WeakKeyDictionary()
+        # Scheduled task names are case insensitive. Normalized casefolded
+        # name to index and name of the first task with it.
+        self.first_by_name = {}
+        self.count = 0
+
+    def _validate(self, instance):
+        found = []
+        try:
+            instance.validate(**self.kwargs)
+        except (ValueError, TypeError) as e:
+            # TypeError for a value of the wrong type, like a command that
+            # is not a string.
+            found.append(('', str(e)))
+        for child_path, child in children(instance):
+            for path, message in self._walk(child):
+                found.append((f'{child_path}.{path}' if path else child_path, message))
+        return found
+
+    def _walk(self, instance):
+        try:
+            return self.results[instance]
+        except KeyError:
+            found = self._validate(instance)
+            self.results[instance] = found
+            return found
+
+    def check(self, task, validate_task=True):
+        """
+        Return list of ValidationError for task, and for its name if an
+        earlier task has it.
+
+        :param validate_task:
+            False to only look for a duplicate name.
+        """
+        index = self.count
+        self.count += 1
+        errors = []
+        name = task.name
+        if isinstance(name, str):
+            key = schtasks.normalize_task_name(name).casefold()
+            first_index, first = self.first_by_name.setdefault(key, (index, name))
+            if first_index != index:
+                errors.append(ValidationError(
+                    name,
+                    '',
+                    f'Duplicate task name of {first}, task {first_index}.',
+                ))
+        if validate_task:
+            # Tasks are not shared, only what they hold is remembered.
+            for path, message in self._validate(task):
+                errors.append(ValidationError(name, path, message))
+        return errors
+
+
+def check_tasks(tasks, file_exists=False, select=None):
+    """
+    Return list of ValidationError for tasks, and for tasks with the same
+    name. Objects shared between tasks are validated once, and path checks
+    go through one validate.StatCache.
+
+    :param select:
+        Optional callable taking a task name, true for the tasks to
+        validate. Duplicates are found among all tasks.
+    """
+    checker = Checker(file_exists=file_exists)
+    errors = []
+    for task in tasks:
+        validate_task = select is None or select(task.name)
+        errors.extend(checker.check(task, validate_task=validate_task))
+    return errors
+
+def raise_for_errors(tasks, **kwargs):
+    """
+    Raise ConfigValidationError with every error of check_tasks, if any.
+    """
+    errors = check_tasks(tasks, **kwargs)
+    if errors:
+        raise ConfigValidationError(errors)
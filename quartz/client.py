@@ -0,0 +1,468 @@
+"""
+Programmatic access to quartz. A Client is a session that returns results
+instead of printing them, and keeps what is costly to get again between
+calls: the registered task listing per host, the configuration module, the
+Jinja environment and render cache, the compiled task schema, account
+lookups and compiled name matchers.
+
+    client = Client()
+    counts = client.update(prune=True)
+    missing = client.missing()
+
+Operations that register or delete tasks invalidate the listing of the
+targeted host. Call invalidate after changing tasks by other means.
+"""
+import collections
+import datetime
+import logging
+import threading
+
+from . import check
+from . import commands
+from . import const
+from . import hosts
+from . import inventory
+from . import profiling
+from . import render
+from . import schedule
+from . import schtasks
+from . import spread
+from . import utils
+
+class Client:
+
+    def __init__(self, config_module=None, jinja_env=None, logger=None):
+        """
+        :param config_module:
+            Configuration module with QUARTZ_TASKS, made a tuple, see
+            utils.materialize_tasks. Default the module named by the
+            environment variable, imported on first use.
+        :param jinja_env:
+            Jinja environment with the task templates. Default
+            utils.get_jinja_env.
+        :param logger:
+            Logger for failed commands. Default the application logger.
+        """
+        if config_module is not None:
+            utils.materialize_tasks(config_module)
+        self._config_module = config_module
+        self._jinja_env = jinja_env
+        self._renderer = None
+        if logger is None:
+            logger = logging.getLogger(const.APPNAME)
+        self.logger = logger
+        self.lock = threading.Lock()
+        # (host, verbose) to listing dict with "rows" and "names", the
+        # casefolded normalized names. The host is None for the local host.
+        self.listings = {}
+        self.coalescer = inventory.Coalescer()
+        # SID string to account info dict.
+        self.accounts = {}
+        # Tuple of patterns to name_matcher callable.
+        self.matchers = {}
+
+    @property
+    def config_module(self):
+        if self._config_module is None:
+            with profiling.span('config import'):
+                self._config_module = utils.get_config_module()
+        return self._config_module
+
+    @property
+    def jinja_env(self):
+        if self._jinja_env is None:
+            self._jinja_env = utils.get_jinja_env()
+        return self._jinja_env
+
+    @property
+    def renderer(self):
+        """
+        TaskRenderer whose fragment cache lasts the session.
+        """
+        if self._renderer is None:
+            self._renderer = render.TaskRenderer(self.jinja_env)
+        return self._renderer
+
+    @property
+    def schema(self):
+        return schtasks.ensure_schtasks_schema()
+
+    def matcher(self, patterns):
+        """
+        Cached utils.name_matcher for patterns.
+        """
+        key = tuple(patterns)
+        try:
+            return self.matchers[key]
+        except KeyError:
+            matches = self.matchers[key] = utils.name_matcher(key)
+            return matches
+
+    def account_info(self, string_sid):
+        """
+        Cached utils.account_info.
+        """
+        try:
+            return self.accounts[string_sid]
+        except KeyError:
+            info = self.accounts[string_sid] = utils.account_info(string_sid)
+            return info
+
+    def _stream_rows(self, verbose):
+        """
+        Generate TaskRow as schtasks outputs them.
+        """
+        rows = schtasks.get_tasks(verbose=verbose)
+        if not verbose:
+            yield from rows
+            return
+        # /v repeats a task for each of its triggers.
+        seen = set()
+        for row in rows:
+            if row['TaskName'] not in seen:
+                seen.add(row['TaskName'])
+                yield row
+
+    def _fetch_listing(self, key):
+        host, verbose = key
+        with profiling.span('listing'):
+            rows = list(self._stream_rows(verbose))
+        listing = dict(
+            rows = rows,
+            names = {
+                schtasks.normalize_task_name(row['TaskName']).casefold()
+                for row in rows
+            },
+        )
+        with self.lock:
+            self.listings[key] = listing
+        return listing
+
+    def _cached_listing(self, key):
+        host, verbose = key
+        with self.lock:
+            listing = self.listings.get(key)
+            if listing is None and not verbose:
+                # A verbose listing has every task too.
+                listing = self.listings.get((host, True))
+        return listing
+
+    def _listing(self, verbose=False):
+        key = (hosts.current_host(), verbose)
+        listing = self._cached_listing(key)
+        if listing is None:
+            # Callers of the same host, like threads of a fan out, share one
+            # schtasks query.
+            listing = self.coalescer.run(key, lambda: self._fetch_listing(key))
+        return listing
+
+    def listing(self, verbose=False):
+        """
+        List of TaskRow of the registered tasks of the targeted host, see
+        hosts.target, from the session snapshot.
+
+        :param verbose:
+            With the fields of `schtasks /query /v`, like Last Run Time and
+            Last Result.
+        """
+        return self._listing(verbose)['rows']
+
+    def task_names(self):
+        return [row['TaskName'] for row in self.listing()]
+
+    def is_registered(self, task_name):
+        names = self._listing()['names']
+        return schtasks.normalize_task_name(task_name).casefold() in names
+
+    def invalidate(self, all_hosts=False):
+        """
+        Drop the listing snapshot of the targeted host, or of every host.
+        """
+        with self.lock:
+            if all_hosts:
+                self.listings.clear()
+            else:
+                host = hosts.current_host()
+                self.listings.pop((host, False), None)
+                self.listings.pop((host, True), None)
+
+    def list_tasks(self, patterns=(), sort=False):
+        """
+        Registered task names matching any of patterns, names or wildcards,
+        in listing order or sorted.
+        """
+        matches = self.matcher(patterns or ('*', ))
+        task_names = [
+            task_name for task_name in self.task_names() if matches(task_name)
+        ]
+        if sort:
+            task_names.sort()
+        return task_names
+
+    def iter_rows(self, patterns=(), last_result_nonzero=False, verbose=False):
+        """
+        Generate TaskRow of registered tasks matching any of patterns, in
+        listing order. From the session snapshot if there is one, otherwise
+        as schtasks outputs them, without keeping them.
+
+        :param last_result_nonzero:
+            Only tasks whose last run returned nonzero.
+        :param verbose:
+            Rows of a verbose listing. Implied by last_result_nonzero.
+        """
+        verbose = verbose or last_result_nonzero
+        matches = self.matcher(patterns or ('*', ))
+        listing = self._cached_listing((hosts.current_host(), verbose))
+        rows = self._stream_rows(verbose) if listing is None else listing['rows']
+        for row in rows:
+            if matches(row['TaskName']) and (not last_result_nonzero or row.last_result):
+                yield row
+
+    def list_rows(
+        self,
+        patterns = (),
+        sort = None,
+        due_within = None,
+        last_result_nonzero = False,
+        verbose = False,
+        now = None,
+    ):
+        """
+        List of TaskRow of registered tasks matching any of patterns, see
+        iter_rows.
+
+        :param sort:
+            None for listing order, "name", "next-run", soonest first, or
+            "last-run", most recent first. Tasks without a time sort last.
+        :param due_within:
+            Only tasks whose next run is before now plus this
+            datetime.timedelta.
+        :param last_result_nonzero:
+            Only tasks whose last run returned nonzero.
+        :param verbose:
+            Rows of a verbose listing. Implied by last_result_nonzero and
+            sorting by last run.
+        :param now:
+            datetime for due_within. Default the current local time, the
+            listing's run times are in the targeted host's local time.
+        """
+        rows = list(self.iter_rows(
+            patterns,
+            last_result_nonzero = last_result_nonzero,
+            verbose = verbose or sort == 'last-run',
+        ))
+
+        if due_within is not None:
+            if now is None:
+                now = datetime.datetime.now()
+            deadline = now + due_within
+            next_run_times = schtasks.parse_run_times(rows, 'Next Run Time')
+            rows = [
+                row for row, next_run_time in zip(rows, next_run_times)
+                if next_run_time is not None and next_run_time <= deadline
+            ]
+
+        if sort == 'name':
+            rows.sort(key=lambda row: row['TaskName'])
+        elif sort in ('next-run', 'last-run'):
+            key = 'Next Run Time' if sort == 'next-run' else 'Last Run Time'
+            run_times = schtasks.parse_run_times(rows, key)
+            by_name = sorted(range(len(rows)), key=lambda index: rows[index]['TaskName'])
+            timed = [index for index in by_name if run_times[index] is not None]
+            # Last runs most recent first, stable for tasks with the same time.
+            timed.sort(key=run_times.__getitem__, reverse=sort == 'last-run')
+            untimed = [index for index in by_name if run_times[index] is None]
+            rows = [rows[index] for index in timed + untimed]
+        return rows
+
+    def configured(self, sort=False):
+        """
+        List of the configured tasks.
+        """
+        tasks = self.config_module.QUARTZ_TASKS
+        if sort:
+            return sorted(tasks, key=commands.by_name)
+        return list(tasks)
+
+    def missing(self, sort=False, task_counts=None):
+        """
+        Configured tasks that are not registered.
+
+        :param task_counts:
+            Optional Counter incremented for "configured" and "missing".
+        """
+        if task_counts is None:
+            task_counts = collections.Counter()
+        missing = []
+        for task in self.config_module.QUARTZ_TASKS:
+            task_counts['configured'] += 1
+            with profiling.span('check', task.name):
+                if not self.is_registered(task.name):
+                    missing.append(task)
+        task_counts['missing'] += len(missing)
+        if sort:
+            missing.sort(key=commands.by_name)
+        return missing
+
+    def iter_plan(
+        self,
+        task_names = None,
+        prune = False,
+        with_listing = True,
+        validate_file_exists = False,
+        task_counts = None,
+        allow_empty_prune = False,
+    ):
+        """
+        Generate plan.PlanItem for the configured tasks, see
+        commands.iter_plan_config.
+
+        :param with_listing:
+            Plan against the registered tasks. Without, every task is
+            planned as a create, which overwrites.
+        :param allow_empty_prune:
+            Prune even without configured tasks, see plan.check_prune.
+        """
+        listing = None
+        if with_listing or prune:
+            listing = self.task_names()
+        return commands.iter_plan_config(
+            self.config_module,
+            self.renderer,
+            task_names = task_names,
+            listing = listing,
+            prune = prune,
+            validate_file_exists = validate_file_exists,
+            task_counts = task_counts,
+            allow_empty_prune = allow_empty_prune,
+        )
+
+    def plan(self, **kwargs):
+        """
+        List of plan.PlanItem of iter_plan.
+        """
+        return list(self.iter_plan(**kwargs))
+
+    def apply(
+        self,
+        items,
+        elevation = 'batch',
+        pause_debug = False,
+        task_counts = None,
+        bulk = False,
+    ):
+        """
+        Apply plan.PlanItem from any iterable, see commands.apply_plan.
+        Return Counter of tasks by applied state.
+        """
+        try:
+            return commands.apply_plan(
+                items,
+                self.logger,
+                pause_debug = pause_debug,
+                elevation = elevation,
+                task_counts = task_counts,
+                bulk = bulk,
+            )
+        finally:
+            self.invalidate()
+
+    def update(
+        self,
+        task_names = None,
+        prune = False,
+        validate_file_exists = False,
+        elevation = 'batch',
+        pause_debug = False,
+        task_counts = None,
+        bulk = False,
+        allow_empty_prune = False,
+    ):
+        """
+        Register the configured tasks, or those named by task_names, and
+        with prune delete owned tasks no longer configured. Return Counter
+        of tasks by applied state.
+
+        :param bulk:
+            Apply everything from one PowerShell script, see powershell.
+        """
+        items = self.iter_plan(
+            task_names = task_names,
+            prune = prune,
+            # Only pruning needs the listing, creates overwrite.
+            with_listing = prune,
+            validate_file_exists = validate_file_exists,
+            task_counts = task_counts,
+            allow_empty_prune = allow_empty_prune,
+        )
+        return self.apply(
+            items,
+            elevation = elevation,
+            pause_debug = pause_debug,
+            task_counts = task_counts,
+            bulk = bulk,
+        )
+
+    def remove(self, patterns):
+        """
+        Delete registered tasks matching any of patterns. Return list of
+        (task name, CompletedProcess).
+        """
+        matches = self.matcher(patterns)
+        results = []
+        try:
+            for task_name in self.task_names():
+                if matches(task_name):
+                    with profiling.span('delete', task_name):
+                        results.append((task_name, schtasks.delete(task_name)))
+        finally:
+            if results:
+                self.invalidate()
+        return results
+
+    def get_xml(self, task_name, as_string=False):
+        return schtasks.get_xml(task_name, as_string=as_string)
+
+    def validate(self, file_exists=False):
+        """
+        List of check.ValidationError of the configured tasks.
+        """
+        with profiling.span('validate'):
+            return check.check_tasks(
+                self.config_module.QUARTZ_TASKS,
+                file_exists = file_exists,
+            )
+
+    def schedule(self, window_start, window_end, bin_seconds=60, include_disabled=False):
+        """
+        Dict of "tasks", task name to number of runs, and "histogram", runs
+        per bin_seconds bin, of the configured tasks over a window.
+        """
+        task_schedule = schedule.Schedule(
+            window_start,
+            window_end,
+            include_disabled = include_disabled,
+        )
+        with profiling.span('schedule'):
+            for task in self.config_module.QUARTZ_TASKS:
+                task_schedule.add(task)
+            return dict(
+                tasks = task_schedule.run_counts(),
+                histogram = task_schedule.histogram(bin_seconds),
+            )
+
+    def spread(self, pinned=()):
+        """
+        Dict of planned "offsets" and the launches per minute "before" and
+        "after" applying them, see spread.plan_offsets.
+        """
+        tasks = self.config_module.QUARTZ_TASKS
+        pinned = list(getattr(self.config_module, 'QUARTZ_PINNED', ())) + list(pinned)
+        date = spread.reference_date(tasks)
+        with profiling.span('spread'):
+            offsets = spread.plan_offsets(tasks, pinned=pinned, date=date)
+            return dict(
+                offsets = offsets,
+                before = spread.launch_profile(tasks, date, {}),
+                after = spread.launch_profile(tasks, date, offsets),
+            )
@@ -1,13 +1,40 @@
-import fnmatch
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import contextvars
+import datetime
+import json
 import logging
 import operator
-import re
+import os
 import subprocess
 import sys
+import threading
+import time
 
+from lxml import etree
+
+from . import archive
+from . import bench
+from . import check
 from . import const
+from . import executor
+from . import helper
+from . import history
+from . import hosts
+from . import inventory
+from . import lock
+from . import metrics
+from . import plan
+from . import powershell
+from . import profiling
+from . import render
 from . import schtasks
+from . import serve
+from . import spread
 from . import utils
+from . import watch
 
 class AuthorFilter:
 
@@ -94,146 +121,613 @@ def capture_tasks(args):
 
 def capture_tasks(args):
     from pprint import pprint
-    pprint(list(schtasks.get_tasks_xml()))
+    with profiling.span('listing'):
+        tasks = list(schtasks.get_tasks_xml())
+    pprint(tasks)
+
+def host_lock(args):
+    """
+    lock.HostLock of the targeted host, or a null context with --no-lock.
+    """
+    if args.no_lock:
+        return contextlib.nullcontext()
+    return lock.HostLock(
+        lock.lock_name(hosts.current_host()),
+        directory = args.lock_dir,
+        timeout = args.lock_timeout,
+    )
 
 def remove(args):
     """
     Remove the configured scheduled tasks. Like `rm` for scheduled tasks.
     """
-    regexes = list(map(shell_pattern_regex, args.name_or_wildcard))
-    found_any = False
-    for task_name in schtasks.get_tasks_list():
-        if any(regex.match(task_name) for regex in regexes):
-            found_any = True
-            result = schtasks.delete(task_name)
-            if result.stdout:
-                print(result.stdout)
-            if result.stderr:
-                print(result.stderr)
-    if not found_any:
+    with host_lock(args):
+        results = args.client.remove(args.name_or_wildcard)
+    for task_name, result in results:
+        if result.stdout:
+            print(result.stdout)
+        if result.stderr:
+            print(result.stderr)
+    if not results:
         print('No tasks found')
 
-def update(args):
+def run_as_operation(task):
     """
-    Update scheduled tsaks from configuration.
+    The run_as part of an elevated operation, or None.
     """
-    config_module = utils.get_config_module()
+    if task.security_options:
+        return dict(
+            user = task.security_options.run_as_user,
+            password = task.security_options.run_as_password,
+        )
 
-    logging.basicConfig()
-    logger = logging.getLogger(const.APPNAME)
+def write_admin_batch(operations, tempfile_creator, pause_debug=False):
+    """
+    Write elevated operations, in the helper's operation format, to a batch
+    script and return it closed.
+    """
+    admin_batch = tempfile_creator(
+        encoding = 'utf-8',
+        mode = 'w',
+        prefix = 'schtasks_',
+        suffix = '.bat',
+    )
+    admin_batch.write('@echo off\n\n')
+    for operation in operations:
+        task_name = operation['task_name']
+        if operation['op'] == 'delete':
+            schtasks_delete = schtasks.delete_command(task_name)
+            lines = utils.batch_lines(schtasks_delete, pause_debug=pause_debug)
+            admin_batch.writelines(lines)
+            continue
+
+        xml_file = tempfile_creator(
+            prefix = task_name.split('\\')[-1] + '_',
+            suffix = '.xml',
+        )
+        xml_file.write(operation['xml'].encode('utf-8'))
+        xml_file.close()
+
+        schtasks_create = schtasks.create_from_xml_command(
+            task_name,
+            xml_file.name,
+            force = True,
+        )
+        # Add schtasks create command to batch file.
+        lines = utils.batch_lines(schtasks_create, pause_debug=pause_debug)
+        admin_batch.writelines(lines)
+        # If present, add schtasks command to update run as user.
+        run_as = operation.get('run_as')
+        if run_as:
+            # Note: `for_batch` puts quotes around some options, then
+            # we have to avoid escaping the quotes when creating the
+            # batch lines and just join them with spaces.
+            schtasks_run_as = schtasks.run_as_command(
+                task_name,
+                run_as['user'],
+                run_as['password'],
+                for_batch = True,
+            )
+            lines = utils.batch_lines(
+                schtasks_run_as,
+                # Avoid escaping quoting from `for_batch` option.
+                list2cmdline = ' '.join,
+                pause_debug = pause_debug,
+            )
+            admin_batch.writelines(lines)
+    admin_batch.close()
+    return admin_batch
+
+def run_admin_batch(operations, tempfile_creator, logger, pause_debug=False):
+    """
+    Run elevated operations from a batch script, prompting for admin once.
+    """
+    with profiling.span('tempfile write'):
+        admin_batch = write_admin_batch(
+            operations,
+            tempfile_creator,
+            pause_debug = pause_debug,
+        )
+    # Prompt for admin and execute batch file. Start-Process does not pass
+    # on the exit code of the batch, which stops at the first failure.
+    run_admin_batch_command = [
+        'PowerShell',
+        #'-NoExit',
+        '-Command',
+        "$ErrorActionPreference = 'Stop';"
+        f' $Process = Start-Process -FilePath {powershell.quote(admin_batch.name)}'
+        ' -Wait -PassThru -Verb RunAs;'
+        ' exit $Process.ExitCode',
+    ]
+    with profiling.span('elevated'):
+        utils.run_with_logger(
+            logger,
+            run_admin_batch_command,
+            capture_with_pipe = False,
+        )
+
+def run_admin_helper(operations, logger):
+    """
+    Run elevated operations with the helper, launching it if needed. Return
+    list of result dicts, logging the failed ones.
+    """
+    results = []
+    with profiling.span('elevated'), helper.connect() as helper_client:
+        for result in helper_client.run(operations):
+            if not result['ok']:
+                logger.error(
+                    '%s %s failed: %s',
+                    result['op'],
+                    result['task_name'],
+                    result.get('stderr') or result.get('error'),
+                )
+            results.append(result)
+    return results
+
+def start_bulk_script(tempfile_creator):
+    """
+    powershell.ScriptWriter to temp files, for the targeted host.
+    """
+    results_file = tempfile_creator(prefix='quartz_results_', suffix='.jsonl')
+    results_file.close()
+    script_file = tempfile_creator(
+        # With a byte order mark, for Windows PowerShell to read it as UTF-8.
+        encoding = 'utf-8-sig',
+        mode = 'w',
+        prefix = 'quartz_',
+        suffix = '.ps1',
+    )
+    return powershell.ScriptWriter(script_file, results_file.name, remote=hosts.target.get())
+
+# Task state counted after applying a plan item.
+applied_states = {
+    plan.CREATE: 'created',
+    plan.OVERWRITE: 'overwritten',
+    plan.UNCHANGED: 'unchanged',
+    plan.DELETE: 'deleted',
+}
+
+def until_validation_error(items, errors):
+    """
+    Generate items, appending the check.ConfigValidationError that ends them,
+    if any, to errors instead of raising it.
+    """
+    try:
+        yield from items
+    except check.ConfigValidationError as e:
+        errors.append(e)
 
-    jinja_env = utils.get_jinja_env()
-    task_template = jinja_env.get_template('task.xml')
+def apply_plan(
+    items,
+    logger,
+    pause_debug = False,
+    elevation = 'batch',
+    task_counts = None,
+    bulk = False,
+):
+    """
+    Apply plan.PlanItem from any iterable, as they arrive. Each task's temp
+    file is removed once it is registered. Operations needing admin, or
+    deletes that fail without it, are collected and run elevated once, either from a batch
+    script or by the helper. Against a remote host, see hosts.target, the
+    /u account is used for everything, as local elevation does not apply.
 
-    validate_file_exists = args.validate_file_exists
+    :param task_counts:
+        Optional Counter, incremented by applied_states values and "failed"
+        as items are applied.
+    :param bulk:
+        Write every operation to one PowerShell script, see powershell,
+        run once at the end, elevated if any task needs admin.
+
+    A check.ConfigValidationError ending items, see plan_config, is raised
+    after the collected operations have run.
+    """
+    if task_counts is None:
+        task_counts = collections.Counter()
+    remote = hosts.is_remote()
 
     with utils.managed_tempfiles(delete=False) as tempfile_creator:
         # tempfile_creator accumulates the created temp files and deletes them
         # on context manager exit.
 
-        admin_batch = None
-        for task in config_module.QUARTZ_TASKS:
-            # If given, filter tasks by name
-            if args.tasks and task.name not in args.tasks:
+        admin_operations = []
+        # applied_states value for each admin operation.
+        admin_states = []
+        script = None
+        # applied_states value for each script operation.
+        script_states = []
+        script_elevated = False
+        validation_errors = []
+        for item in until_validation_error(items, validation_errors):
+            state = applied_states[item.action]
+            if item.action == plan.UNCHANGED:
+                task_counts[state] += 1
                 continue
 
-            task.validate(file_exists=validate_file_exists)
+            if bulk:
+                if script is None:
+                    script = start_bulk_script(tempfile_creator)
+                if item.action == plan.DELETE:
+                    operation = dict(op='delete', task_name=item.task_name)
+                else:
+                    operation = dict(
+                        op = 'create',
+                        task_name = item.task.name,
+                        xml = item.task_xml,
+                        run_as = run_as_operation(item.task),
+                    )
+                    if item.task.needs_admin() and not remote:
+                        script_elevated = True
+                with profiling.span('tempfile write', item.task_name):
+                    script.add(operation)
+                script_states.append(state)
+                continue
 
-            context = dict(
-                task = task,
-            )
-            task_xml = task_template.render(**context)
+            if item.action == plan.DELETE:
+                try:
+                    with profiling.span('delete', item.task_name):
+                        schtasks.delete(item.task_name)
+                except subprocess.CalledProcessError:
+                    if remote:
+                        task_counts['failed'] += 1
+                        raise
+                    # Possibly registered by an admin, retry elevated.
+                    admin_operations.append(dict(
+                        op = 'delete',
+                        task_name = item.task_name,
+                    ))
+                    admin_states.append(state)
+                else:
+                    task_counts[state] += 1
+                continue
+
+            task = item.task
+            if task.needs_admin() and not remote:
+                # Task requires admin, accumulate for elevation.
+                admin_operations.append(dict(
+                    op = 'create',
+                    task_name = task.name,
+                    xml = item.task_xml,
+                    run_as = run_as_operation(task),
+                ))
+                admin_states.append(state)
+                continue
 
-            xml_file = tempfile_creator(
+            xml_file_context = utils.removed_tempfile(
                 prefix = task.name.split('\\')[-1] + '_',
                 suffix = '.xml',
             )
+            # The file is removed as soon as the task is registered.
+            with xml_file_context as xml_file:
+                with profiling.span('tempfile write', task.name):
+                    xml_file.write(item.task_xml.encode('utf-8'))
+                    xml_file.close()
 
-            xml_file.write(task_xml.encode('utf-8'))
-            xml_file.close()
+                schtasks_create = schtasks.create_from_xml_command(
+                    task.name,
+                    xml_file.name,
+                    force = True,
+                )
+                try:
+                    # Run commands as the user we already are.
+                    with profiling.span('schtasks create', task.name):
+                        result = utils.run_with_logger(logger, schtasks_create)
 
-            schtasks_create = schtasks.create_from_xml_command(
-                task.name,
-                xml_file.name,
-                force = True,
-            )
-            if task.needs_admin():
-                # Task requires admin, accumulate for elevated batch script.
-                if admin_batch is None:
-                    # Create admin batch file.
-                    admin_batch = tempfile_creator(
-                        encoding = 'utf-8',
-                        mode = 'w',
-                        prefix = 'schtasks_',
-                        suffix = '.bat',
-                    )
-                    admin_batch.write('@echo off\n\n')
-                # Add schtasks create command to batch file.
-                lines = utils.batch_lines(schtasks_create, pause_debug=args.pause_debug)
-                admin_batch.writelines(lines)
-                # If present, add schtasks command to update run as user.
-                if task.security_options:
-                    # Note: `for_batch` puts quotes around some options, then
-                    # we have to avoid escaping the quotes when creating the
-                    # batch lines and just join them with spaces.
-                    schtasks_run_as = schtasks.run_as_command(
-                        task.name,
-                        task.security_options.run_as_user,
-                        task.security_options.run_as_password,
-                        for_batch = True,
-                    )
-                    lines = utils.batch_lines(
-                        schtasks_run_as,
-                        # Avoid escaping quoting from `for_batch` option.
-                        list2cmdline = ' '.join,
-                        pause_debug = args.pause_debug,
-                    )
-                    admin_batch.writelines(lines)
+                    # Run as: if given, update the account to run under.
+                    if task.security_options:
+                        schtasks_run_as = schtasks.run_as_command(
+                            task.name,
+                            task.security_options.run_as_user,
+                            task.security_options.run_as_password,
+                        )
+                        with profiling.span('run as', task.name):
+                            result = utils.run_with_logger(logger, schtasks_run_as)
+                except subprocess.SubprocessError:
+                    task_counts['failed'] += 1
+                    raise
+            task_counts[state] += 1
+
+        if script is not None:
+            results = powershell.run_script(script, logger, elevated=script_elevated)
+            for result, state in zip(results, script_states):
+                if result['ok']:
+                    task_counts[state] += 1
+                elif result['op'] == 'delete' and not script_elevated and not remote:
+                    # Possibly registered by an admin, retry elevated.
+                    admin_operations.append(dict(
+                        op = 'delete',
+                        task_name = result['task_name'],
+                    ))
+                    admin_states.append(state)
+                else:
+                    task_counts['failed'] += 1
+
+        if admin_operations:
+            if elevation == 'helper':
+                results = run_admin_helper(admin_operations, logger)
+                for result in results:
+                    if result['ok']:
+                        task_counts[admin_states[result['id']]] += 1
+                    else:
+                        task_counts['failed'] += 1
             else:
-                # Run commands as the user we already are.
-                result = utils.run_with_logger(logger, schtasks_create)
-
-                # Run as: if given, update the account to run under.
-                if task.security_options:
-                    schtasks_run_as = schtasks.run_as_command(
-                        task.name,
-                        task.security_options.run_as_user,
-                        task.security_options.run_as_password,
+                try:
+                    run_admin_batch(
+                        admin_operations,
+                        tempfile_creator,
+                        logger,
+                        pause_debug = pause_debug,
                     )
-                    result = utils.run_with_logger(logger, schtasks_run_as)
-        if admin_batch:
-            admin_batch.close()
-            # Prompt for admin and execute batch file.
-            run_admin_batch_command = [
-                'PowerShell',
-                #'-NoExit',
-                '-Command', 'Start-Process', '-File', admin_batch.name, '-Wait',
-                '-Verb', 'RunAs',
-            ]
-            result = utils.run_with_logger(
-                logger,
-                run_admin_batch_command,
-                capture_with_pipe = False,
+                except subprocess.SubprocessError:
+                    task_counts['failed'] += len(admin_operations)
+                    raise
+                task_counts.update(admin_states)
+
+    if validation_errors:
+        raise validation_errors[0]
+    return task_counts
+
+def enable_run_metrics(args):
+    """
+    Time phases for the metrics file, if one was requested.
+    """
+    if args.metrics_file and not profiling.profiler.enabled:
+        profiling.enable(trace_memory=False)
+
+def write_run_metrics(args, command, task_counts, success, start_time):
+    """
+    Write the Prometheus metrics file, if one was requested.
+    """
+    if not args.metrics_file:
+        return
+    phases = {
+        phase: seconds
+        for phase, (seconds, count) in profiling.profiler.phases.items()
+    }
+    host = hosts.current_host()
+    metrics.write_textfile(
+        metrics.host_path(args.metrics_file, host),
+        config = os.environ.get(const.CONFIGVAR, ''),
+        command = command,
+        task_counts = task_counts,
+        phases = phases,
+        success = success,
+        duration = time.perf_counter() - start_time,
+        host = host,
+    )
+
+def update(args):
+    """
+    Update scheduled tsaks from configuration.
+    """
+    start_time = time.perf_counter()
+    enable_run_metrics(args)
+    task_counts = collections.Counter()
+    success = False
+    try:
+        update_tasks(args, task_counts)
+        success = not task_counts['failed']
+    finally:
+        write_run_metrics(args, 'update', task_counts, success, start_time)
+
+def plan_config(config_module, renderer, **kwargs):
+    """
+    List of the plan.PlanItem of iter_plan_config.
+    """
+    return list(iter_plan_config(config_module, renderer, **kwargs))
+
+def iter_plan_config(
+    config_module,
+    renderer,
+    task_names = None,
+    listing = None,
+    prune = False,
+    validate_file_exists = False,
+    task_counts = None,
+    allow_empty_prune = False,
+):
+    """
+    Validate and render the configured tasks and generate plan.PlanItem, one
+    task at a time. Raise check.ConfigValidationError with every error
+    found.
+
+    QUARTZ_TASKS may be any iterable. A sequence is validated whole before
+    the first item. Otherwise tasks are validated as they are generated,
+    invalid ones are skipped, and the error is raised after the last item.
+
+    :param task_names:
+        Optional names or wildcards of the tasks to plan, instead of all
+        tasks.
+    :param listing:
+        Names of registered tasks. Without it, every task is planned as a
+        create, which overwrites.
+    :param task_counts:
+        Optional Counter incremented for each configured task.
+    :param allow_empty_prune:
+        Prune even without configured tasks, see plan.check_prune.
+    """
+    tasks = config_module.QUARTZ_TASKS
+    selected = utils.name_matcher(task_names) if task_names else None
+    up_front = isinstance(tasks, collections.abc.Sequence)
+    if not up_front and getattr(config_module, 'QUARTZ_SPREAD', False):
+        # Planning offsets takes every task.
+        tasks = list(tasks)
+        up_front = True
+
+    if up_front:
+        with profiling.span('validate'):
+            check.raise_for_errors(
+                tasks,
+                file_exists = validate_file_exists,
+                select = selected,
             )
+        checker = None
+    else:
+        checker = check.Checker(file_exists=validate_file_exists)
 
-def list_command(args):
+    offsets = spread.configured_offsets(config_module, tasks)
+    errors = []
+    # Only names are kept of every task, for planning deletes.
+    configured_names = []
+
+    def render_tasks():
+        for task in tasks:
+            if prune:
+                configured_names.append(task.name)
+            if task_counts is not None:
+                task_counts['configured'] += 1
+
+            # If given, filter tasks by name
+            is_selected = selected is None or selected(task.name)
+            if checker is not None:
+                with profiling.span('validate', task.name):
+                    task_errors = checker.check(task, validate_task=is_selected)
+                if task_errors:
+                    errors.extend(task_errors)
+                    continue
+            if not is_selected:
+                continue
+
+            if offsets:
+                spread.apply_offset(task, offsets)
+            with profiling.span('render', task.name):
+                yield (task, renderer.render(task))
+
+    if listing is None:
+        for task, task_xml in render_tasks():
+            yield plan.PlanItem(plan.CREATE, task.name, task, task_xml)
+    else:
+        registered = plan.registered_index(listing)
+        yield from plan.plan_tasks(render_tasks(), registered)
+        if prune:
+            with profiling.span('plan'):
+                folders = plan.owned_folders(config_module, configured_names)
+                deletes = plan.plan_deletes(
+                    registered,
+                    configured_names,
+                    folders,
+                    allow_empty = allow_empty_prune,
+                )
+            yield from deletes
+
+    if errors:
+        raise check.ConfigValidationError(errors)
+
+def update_tasks(args, task_counts):
     """
-    List existing system scheduled tasks.
+    Apply the configuration, counting tasks by state in task_counts.
     """
-    filters = [re.compile(fnmatch.translate(pattern)) for pattern in args.paths]
-    if not filters:
-        filters.append(re.compile(fnmatch.translate('*')))
+    logging.basicConfig()
+    client = args.client
+
+    if args.plan:
+        # Plan everything from one listing snapshot.
+        items = client.iter_plan(
+            task_names = args.tasks,
+            prune = args.prune,
+            validate_file_exists = args.validate_file_exists,
+            task_counts = task_counts,
+            allow_empty_prune = args.allow_empty_prune,
+        )
+        plan.print_plan(items, format_=args.plan)
+    else:
+        apply_update(args, task_counts)
+
+    if args.verbose:
+        stats = client.renderer.cache.stats()
+        print(
+            'Render cache: {hits} hits, {misses} misses,'
+            ' {size}/{maxsize} fragments'.format(**stats)
+        )
+
+def apply_update(args, task_counts):
+    """
+    Apply the configuration under the targeted host's lock. An update
+    waiting for the lock is applied once with the other updates waiting
+    with the same options, by whichever process gets the lock.
+    """
+    # Every option of the update besides task names, only updates with the
+    # same options are applied together.
+    options = dict(
+        prune = args.prune,
+        validate_file_exists = args.validate_file_exists,
+        elevation = args.elevation,
+        pause_debug = args.pause_debug,
+        bulk = args.bulk,
+        allow_empty_prune = args.allow_empty_prune,
+    )
+
+    def apply(task_names):
+        # Items are applied as they are rendered, holding one task's XML at
+        # a time besides those deferred for elevation.
+        args.client.update(task_names=task_names, task_counts=task_counts, **options)
+        return task_counts
 
-    tasks = []
-    for task_data in schtasks.get_tasks():
-        if any(regex.match(task_data['TaskName']) for regex in filters):
-            tasks.append(task_data)
+    if args.no_lock:
+        apply(args.tasks)
+        return
+    key = dict(options, config=os.environ.get(const.CONFIGVAR))
+    result = lock.Coalescer(host_lock(args)).apply(key, args.tasks, apply)
+    if result['pid'] != os.getpid():
+        task_counts.update(result['counts'])
+    if result['requests'] > 1:
+        task_names = result['task_names']
+        print(
+            f'Applied {result["requests"]} queued updates at once by process'
+            f' {result["pid"]}, tasks:'
+            f' {"all" if task_names is None else " ".join(task_names)}',
+            file = sys.stderr,
+        )
+
+def listing_dict(row):
+    """
+    JSON ready dict of a listing TaskRow, with parsed run times.
+    """
+    data = dict(
+        task_name = row['TaskName'],
+        next_run_time = utils.isoformat_or_none(row.next_run_time),
+        status = row.get('Status'),
+    )
+    if 'Last Run Time' in row:
+        data.update(
+            last_run_time = utils.isoformat_or_none(row.last_run_time),
+            last_result = row.last_result,
+        )
+    return data
 
-    if args.sort:
-        tasks = sorted(tasks, key=lambda task_data: task_data['TaskName'])
+def list_command(args):
+    """
+    List existing system scheduled tasks.
+    """
+    streamed = args.due_within is None and args.sort is None
+    if streamed:
+        rows = args.client.iter_rows(
+            args.paths,
+            last_result_nonzero = args.last_result_nonzero,
+        )
+    else:
+        rows = args.client.list_rows(
+            args.paths,
+            sort = args.sort,
+            due_within = args.due_within,
+            last_result_nonzero = args.last_result_nonzero,
+        )
+    if args.format == 'json':
+        print(json.dumps([listing_dict(row) for row in rows], indent=2))
+        return
 
-    for task_data in tasks:
-        print(task_data['TaskName'])
+    if streamed or args.sort == 'name':
+        # Names only, unsorted they print as schtasks outputs them.
+        for row in rows:
+            print(row['TaskName'])
+        return
+    for row in rows:
+        if args.sort == 'last-run':
+            run_time = row.last_run_time
+        else:
+            run_time = row.next_run_time
+        run_time = run_time.isoformat(' ') if run_time else '-'
+        print(f'{run_time:19} {row["TaskName"]}')
 
 by_name = operator.attrgetter('name')
 
@@ -241,32 +735,211 @@ def list_configured(args):
     """
     List scheduled tasks from configuration.
     """
-    config_module = utils.get_config_module()
-
-    logging.basicConfig()
-    logger = logging.getLogger(const.APPNAME)
-
-    tasks = config_module.QUARTZ_TASKS
-    if args.sort:
-        tasks = sorted(tasks, key=by_name)
+    start_time = time.perf_counter()
+    if args.check:
+        enable_run_metrics(args)
 
+    client = args.client
     if not args.check:
-        for task in tasks:
+        for task in client.configured(sort=args.sort):
             print(task.name)
     else:
-        missing = [task for task in tasks if not schtasks.exists(task.name)]
+        task_counts = collections.Counter()
+        success = False
+        try:
+            missing = client.missing(sort=args.sort, task_counts=task_counts)
+            success = True
+        finally:
+            write_run_metrics(args, 'lsconf', task_counts, success, start_time)
         if missing:
-            if args.sort:
-                missing = sorted(missing, key=by_name)
             print('Missing scheduled tasks')
             for task in missing:
                 print(task.name)
 
+def schedule_command(args):
+    """
+    Count when configured tasks run over a window, per task and per minute.
+    """
+    window_start = args.from_
+    if window_start is None:
+        window_start = datetime.datetime.now().replace(second=0, microsecond=0)
+    window_end = args.to
+    if window_end is None:
+        window_end = window_start + datetime.timedelta(days=7)
+
+    result = args.client.schedule(
+        window_start,
+        window_end,
+        bin_seconds = args.bin,
+        include_disabled = args.include_disabled,
+    )
+    run_counts = result['tasks']
+
+    bin_delta = datetime.timedelta(seconds=args.bin)
+    bins = [
+        ((window_start + index * bin_delta).isoformat(timespec='minutes'), count)
+        for index, count in enumerate(result['histogram'])
+    ]
+    if args.format == 'json':
+        print(json.dumps(dict(
+            window_start = window_start.isoformat(),
+            window_end = window_end.isoformat(),
+            bin_seconds = args.bin,
+            tasks = run_counts,
+            histogram = bins,
+        ), indent=2))
+        return
+
+    width = max((len(str(count)) for count in run_counts.values()), default=1)
+    for task_name, count in sorted(run_counts.items()):
+        print(f'{count:>{width}} {task_name}')
+    print()
+    for bin_start, count in bins:
+        if count or args.all_bins:
+            print(f'{bin_start} {count}')
+
+def spread_command(args):
+    """
+    Suggest start offsets for EveryMinutes tasks that lower the most tasks
+    launching on one minute.
+    """
+    result = args.client.spread(pinned=args.pin or ())
+    offsets = result['offsets']
+    print(
+        f'{len(offsets)} tasks moved, peak launches per minute'
+        f' {max(result["before"], default=0)} -> {max(result["after"], default=0)}',
+        file = sys.stderr,
+    )
+    if args.output in (None, '-'):
+        spread.write_offsets(offsets, sys.stdout)
+    else:
+        with open(args.output, 'w') as offsets_file:
+            spread.write_offsets(offsets, offsets_file)
+
+def bench_command(args):
+    """
+    Measure the Task Scheduler throughput of the host at increasing
+    concurrency, with throwaway tasks in a scratch folder, and recommend how
+    many commands to run at the same time.
+    """
+    remote = hosts.is_remote()
+    max_level = args.max_subprocesses
+    if remote and args.max_per_host:
+        max_level = min(max_level, args.max_per_host)
+    levels = args.levels or bench.default_levels(max_level)
+    if max(levels) > max_level:
+        print(
+            f'Levels over {max_level} run at {max_level}, raise'
+            f' --max-subprocesses or --max-per-host to measure them',
+            file = sys.stderr,
+        )
+
+    def print_level(level):
+        if args.format == 'text':
+            for line in bench.format_level(level):
+                print(line)
+
+    task_bench = bench.Bench(levels, count=args.count, folder=args.folder)
+    result = task_bench.run(on_level=print_level)
+    recommended = result['recommended']
+    option = None
+    if recommended is not None:
+        option = bench.worker_option(recommended, remote=remote)
+    if args.format == 'json':
+        json.dump(dict(result, option=option), sys.stdout, indent=2)
+        print()
+    elif option is None:
+        print(f'No level with at most {bench.max_error_rate:.0%} errors to recommend')
+    else:
+        print('Recommended: ' + ' '.join(option))
+    if result['left']:
+        print(
+            f'{len(result["left"])} scratch tasks could not be deleted, like'
+            f' {result["left"][0]}',
+            file = sys.stderr,
+        )
+        return 1
+
+def validate_config(args):
+    """
+    Validate the configured tasks, printing every error.
+    """
+    errors = args.client.validate(file_exists=args.file_exists)
+    for error in errors:
+        print(check.format_error(error))
+    if errors:
+        print(f'{len(errors)} errors', file=sys.stderr)
+        return 1
+
+history_sort_keys = {
+    'total': 'total_seconds',
+    'p95': 'p95_seconds',
+    'max': 'max_seconds',
+    'runs': 'runs',
+    'failures': 'failure_rate',
+}
+
+def history_command(args):
+    """
+    Summarize task runs from Task Scheduler operational event log exports.
+    """
+    if args.store:
+        task_history = history.load(args.store)
+    else:
+        task_history = history.History()
+
+    added = 0
+    with profiling.span('ingest'):
+        if not args.source:
+            command = history.wevtutil_command(args.count)
+            with executor.stream(command) as process:
+                added += task_history.ingest(history.read_events(process.stdout))
+        for source in args.source:
+            if source == '-':
+                added += task_history.ingest(history.read_events(sys.stdin.buffer))
+                continue
+            with open(source, 'rb') as export_file:
+                added += task_history.ingest(history.read_events(export_file))
+    if args.store:
+        task_history.save(args.store)
+    print(f'{added} events ingested, {len(task_history.open)} runs open', file=sys.stderr)
+
+    summary = task_history.summary()
+    if args.tasks:
+        matches = utils.name_matcher(args.tasks)
+        summary = {
+            task_name: stats for task_name, stats in summary.items()
+            if matches(task_name)
+        }
+    sort_key = history_sort_keys[args.sort]
+    rows = sorted(
+        summary.items(),
+        key = lambda item: (-(item[1][sort_key] or 0), item[0]),
+    )
+    if args.top:
+        rows = rows[:args.top]
+
+    if args.format == 'json':
+        print(json.dumps(dict(rows), indent=2))
+        return
+
+    print(f'{"runs":>7} {"fail%":>6} {"p50":>7} {"p95":>7} {"max":>7} {"total":>7} {"skipped":>7} {"queued":>7}  task')
+    for task_name, stats in rows:
+        print(
+            f'{stats["runs"]:>7} {stats["failure_rate"] * 100:>6.1f}'
+            f' {history.format_seconds(stats["p50_seconds"]):>7}'
+            f' {history.format_seconds(stats["p95_seconds"]):>7}'
+            f' {history.format_seconds(stats["max_seconds"]):>7}'
+            f' {history.format_seconds(stats["total_seconds"]):>7}'
+            f' {stats["skipped"]:>7} {stats["queued"]:>7}  {task_name}'
+        )
+
 def dump_xml(args):
     """
     Dump configured scheduled tasks to xml.
     """
-    config_module = utils.get_config_module()
+    with profiling.span('config import'):
+        config_module = utils.get_config_module()
 
     logging.basicConfig()
     logger = logging.getLogger(const.APPNAME)
@@ -274,21 +947,315 @@ def dump_xml(args):
     output_arg = args.output
 
     if output_arg in (None, '-'):
-        output_stream = sys.stdout
+        dump_xml_stdout(config_module.QUARTZ_TASKS)
+    elif archive.is_archive_path(output_arg):
+        dump_xml_archive(config_module.QUARTZ_TASKS, output_arg.format(host=hosts.current_host()))
     else:
-        output_stream = None
+        dump_xml_files(config_module.QUARTZ_TASKS, output_arg, args.replace_backslashes)
+
+def dump_xml_stdout(tasks):
+    for task in tasks:
+        with profiling.span('get xml', task.name):
+            task_xml_string = schtasks.get_xml(task.name, as_string=True)
+        encoding = executor.xml_encoding(task_xml_string)
+        task_xml_string = task_xml_string.decode(encoding)
+        with profiling.span('write', task.name):
+            sys.stdout.write(task_xml_string)
+            # Separate the documents.
+            if not task_xml_string.endswith('\n'):
+                sys.stdout.write('\n')
 
-    for task in config_module.QUARTZ_TASKS:
-        task_xml_string = schtasks.get_xml(task.name, as_string=True)
+def dump_xml_archive(tasks, output_filename):
+    """
+    Write tasks to a content-addressed archive as they are fetched.
+    """
+    added = 0
+    with archive.open_archive_writer(output_filename) as writer:
+        for task in tasks:
+            with profiling.span('get xml', task.name):
+                task_xml_string = schtasks.get_xml(task.name, as_string=True)
+            with profiling.span('write', task.name):
+                added += writer.add(task.name, task_xml_string)
+    print(f'{output_filename}: {len(writer.tasks)} tasks, {added} distinct documents')
 
-        if output_stream is not sys.stdout:
-            output_filename = output_arg.format(task=task)
-            if args.replace_backslashes:
-                output_filename = output_filename.replace('\\', args.replace_backslashes)
-            output_stream = open(output_filename, 'wb')
+def dump_xml_files(tasks, output_arg, replace_backslashes):
+    """
+    Write a file per task, leaving files with unchanged content alone.
+    """
+    written = unchanged = 0
+    for task in tasks:
+        with profiling.span('get xml', task.name):
+            task_xml_string = schtasks.get_xml(task.name, as_string=True)
 
-        try:
-            output_stream.write(task_xml_string)
-        finally:
-            if output_stream is not sys.stdout:
-                output_stream.close()
+        output_filename = output_arg.format(task=task, host=hosts.current_host())
+        if replace_backslashes:
+            output_filename = output_filename.replace('\\', replace_backslashes)
+
+        with profiling.span('write', task.name):
+            if archive.write_if_changed(output_filename, task_xml_string):
+                written += 1
+            else:
+                unchanged += 1
+    print(f'{written} written, {unchanged} unchanged')
+
+def document_needs_admin(root):
+    """
+    Whether a task XML document needs admin to register, like
+    models.Task.needs_admin.
+    """
+    if root.find('{*}Triggers/{*}BootTrigger') is not None:
+        return True
+    for principal in root.iterfind('{*}Principals/{*}Principal'):
+        if principal.findtext('{*}RunLevel') == 'HighestAvailable':
+            return True
+        if principal.findtext('{*}UserId') in ('SYSTEM', 'S-1-5-18'):
+            return True
+    return False
+
+def restore_task(task_name, document, registered, tempfile_creator, logger, remote):
+    """
+    Register one dumped document. Return the applied_states value, or
+    "admin" for a document left for elevation.
+    """
+    state = applied_states[plan.CREATE]
+    if task_name.casefold() in registered:
+        with profiling.span('get xml', task_name):
+            registered_root = schtasks.get_xml(task_name)
+        if plan.is_unchanged(document, registered_root):
+            return applied_states[plan.UNCHANGED]
+        state = applied_states[plan.OVERWRITE]
+
+    if not remote and document_needs_admin(etree.fromstring(document.encode('utf-8'))):
+        return 'admin'
+
+    with profiling.span('tempfile write', task_name):
+        xml_file = tempfile_creator(
+            prefix = task_name.split('\\')[-1] + '_',
+            suffix = '.xml',
+        )
+        xml_file.write(document.encode('utf-8'))
+        xml_file.close()
+    schtasks_create = schtasks.create_from_xml_command(
+        task_name,
+        xml_file.name,
+        force = True,
+    )
+    with profiling.span('schtasks create', task_name):
+        utils.run_with_logger(logger, schtasks_create)
+    return state
+
+def restore(args):
+    """
+    Register scheduled tasks from a dump xml directory or archive.
+    """
+    logging.basicConfig()
+    logger = logging.getLogger(const.APPNAME)
+
+    includes = [utils.shell_pattern_regex(pattern) for pattern in args.include or ()]
+    excludes = [utils.shell_pattern_regex(pattern) for pattern in args.exclude or ()]
+    def selected(task_name):
+        if includes and not any(regex.match(task_name) for regex in includes):
+            return False
+        return not any(regex.match(task_name) for regex in excludes)
+
+    with host_lock(args):
+        return restore_tasks(args, logger, selected)
+
+def restore_tasks(args, logger, selected):
+    """
+    Register the selected tasks of the dump, holding the host's lock.
+    """
+    registered = {task_name.casefold() for task_name in args.client.task_names()}
+
+    remote = hosts.is_remote()
+    task_counts = collections.Counter()
+    admin_operations = []
+    admin_states = []
+
+    with utils.managed_tempfiles(delete=False) as tempfile_creator, \
+            concurrent.futures.ThreadPoolExecutor(args.workers) as pool:
+        pending = {}
+
+        def collect(futures):
+            for future in futures:
+                task_name, document = pending.pop(future)
+                try:
+                    state = future.result()
+                except (subprocess.SubprocessError, etree.XMLSyntaxError) as e:
+                    logger.error('Restoring %s failed: %s', task_name, e)
+                    task_counts['failed'] += 1
+                    continue
+                if state == 'admin':
+                    admin_operations.append(dict(
+                        op = 'create',
+                        task_name = task_name,
+                        xml = document,
+                        run_as = None,
+                    ))
+                    admin_states.append(
+                        applied_states[plan.OVERWRITE]
+                        if task_name.casefold() in registered
+                        else applied_states[plan.CREATE]
+                    )
+                else:
+                    task_counts[state] += 1
+
+        for task_name, canonical, error in archive.read_dump(args.source):
+            task_name = schtasks.normalize_task_name(task_name)
+            if not selected(task_name):
+                continue
+            if error is not None:
+                logger.error('%s: damaged document: %s', task_name, error)
+                task_counts['invalid'] += 1
+                continue
+            root = etree.fromstring(canonical)
+            if args.validate:
+                try:
+                    with profiling.span('validate', task_name):
+                        schtasks.raise_for_validation(root)
+                except schtasks.SchemaValidationError as e:
+                    logger.error('%s: %s', task_name, e)
+                    task_counts['invalid'] += 1
+                    continue
+            document = canonical.decode('utf-8')
+            future = pool.submit(
+                contextvars.copy_context().run,
+                restore_task,
+                task_name,
+                document,
+                registered,
+                tempfile_creator,
+                logger,
+                remote,
+            )
+            pending[future] = (task_name, document)
+            # Bound the documents held in memory.
+            if len(pending) >= args.workers * 2:
+                done, _ = concurrent.futures.wait(
+                    pending,
+                    return_when = concurrent.futures.FIRST_COMPLETED,
+                )
+                collect(done)
+        collect(list(pending))
+
+        if admin_operations:
+            if args.elevation == 'helper':
+                for result in run_admin_helper(admin_operations, logger):
+                    if result['ok']:
+                        task_counts[admin_states[result['id']]] += 1
+                    else:
+                        task_counts['failed'] += 1
+            else:
+                try:
+                    run_admin_batch(admin_operations, tempfile_creator, logger)
+                except subprocess.SubprocessError:
+                    logger.exception('Elevated restore failed.')
+                    task_counts['failed'] += len(admin_operations)
+                else:
+                    task_counts.update(admin_states)
+
+    args.client.invalidate()
+    print(', '.join(f'{count} {state}' for state, count in sorted(task_counts.items())))
+    if task_counts['failed'] or task_counts['invalid']:
+        return 1
+
+def run_helper(args):
+    """
+    Run the elevated helper that applies operations sent by update.
+    """
+    logging.basicConfig()
+    authkey = helper.load_authkey(args.authkey_file)
+    helper_server = helper.Helper(
+        args.address or helper.default_address(),
+        authkey,
+        workers = args.workers,
+        idle_timeout = args.idle_timeout,
+        once = args.once,
+    )
+    helper_server.serve_forever()
+
+def watch_config(args):
+    """
+    Watch the configuration files and apply changed tasks when they change.
+    """
+    logging.basicConfig()
+    logger = logging.getLogger(const.APPNAME)
+    logger.setLevel(logging.INFO)
+
+    def apply(items):
+        with host_lock(args):
+            apply_plan(items, logger, elevation=args.elevation)
+
+    watcher = watch.Watcher(
+        os.environ[const.CONFIGVAR],
+        apply,
+        logger,
+        directories = args.path,
+        interval = args.interval,
+        debounce = args.debounce,
+        prune = args.prune,
+        validate_file_exists = args.validate_file_exists,
+        allow_empty_prune = args.allow_empty_prune,
+    )
+    try:
+        watcher.watch()
+    except KeyboardInterrupt:
+        pass
+
+def serve_api(args):
+    """
+    Serve a local JSON API over a warm, background refreshed inventory.
+    """
+    logging.basicConfig()
+    logger = logging.getLogger(const.APPNAME)
+
+    renderer = render.TaskRenderer(utils.get_jinja_env())
+    # The renderer and scheduler are not for concurrent applies.
+    apply_lock = threading.Lock()
+    # Reloaded when its files change, to see edits, as watch does.
+    load_config = watch.ConfigCache(os.environ[const.CONFIGVAR]).get
+
+    def apply(task_names, prune, plan_only, listing):
+        with apply_lock:
+            config_module = load_config()
+            items = plan_config(
+                config_module,
+                renderer,
+                task_names = task_names,
+                listing = listing,
+                prune = prune,
+            )
+            result = dict(plan=plan.summary(items))
+            if not plan_only:
+                with host_lock(args):
+                    task_counts = apply_plan(items, logger, elevation=args.elevation)
+                result['counts'] = dict(task_counts)
+            return result
+
+    task_inventory = inventory.Inventory(
+        max_age = args.max_age,
+        with_xml = not args.no_xml,
+    )
+    token = None
+    if args.allow_apply:
+        token = serve.load_token(args.token_file, create=True)
+        logger.warning(
+            'Serving /apply to requests with the token of %s',
+            args.token_file or serve.default_token_path(),
+        )
+    api = serve.Api(
+        task_inventory,
+        load_config,
+        apply = apply if args.allow_apply else None,
+        token = token,
+    )
+    try:
+        serve.serve(
+            api,
+            refresh_interval = args.refresh_interval,
+            host = args.host,
+            port = args.port,
+            socket_path = args.socket,
+        )
+    except KeyboardInterrupt:
+        pass
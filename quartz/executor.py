@@ -0,0 +1,657 @@
+"""
+Every subprocess quartz starts goes through an Executor, which caps how many
+run at once, kills commands that exceed their timeout, retries idempotent
+commands that fail transiently and records per-kind metrics. The cap is
+fixed, or adapted to how the Task Scheduler copes, see AdaptiveLimit.
+"""
+import bisect
+import contextlib
+import io
+import locale
+import os
+import random
+import subprocess
+import threading
+import time
+import types
+
+from . import hosts
+
+# Upper bounds in seconds of the latency histogram buckets.
+latency_buckets = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+default_max_concurrency = 8
+
+# Seconds before a command of a kind is killed. None waits forever.
+default_timeouts = {
+    'query': 120,
+    'create': 120,
+    'change': 120,
+    'delete': 60,
+    'icacls': 60,
+    'wmic': 60,
+    # Waits on the UAC prompt and the elevated commands.
+    'powershell': None,
+}
+
+default_timeout = 300
+
+# Retries of an idempotent command that failed transiently.
+default_retries = 2
+
+# Seconds of the first retry's backoff, doubling for each retry, and the
+# most it grows to. The delay is a random fraction of it.
+retry_base_delay = 0.25
+
+retry_max_delay = 5
+
+# Errors of an overloaded or briefly unavailable Task Scheduler service.
+transient_errors = (
+    'The remote procedure call failed',
+    'The RPC server is too busy',
+    'The service cannot accept control messages at this time',
+    'The device is not ready',
+)
+
+missing_error = 'The system cannot find the file specified'
+
+def command_kind(command):
+    """
+    Short name for the kind of a command, like "query" for `schtasks /query`
+    or "icacls".
+    """
+    if isinstance(command, str):
+        command = command.split()
+    program = os.path.basename(command[0]).lower()
+    program, _ = os.path.splitext(program)
+    if program == 'schtasks' and len(command) > 1:
+        return command[1].lstrip('/').lower()
+    return program
+
+def decode(output):
+    """
+    Decode console output of Windows commands.
+    """
+    if output is None or isinstance(output, str):
+        return output
+    return output.decode(locale.getpreferredencoding(False), errors='replace')
+
+def is_idempotent(command):
+    """
+    Whether running command again has the same effect as running it once:
+    queries, deletes, and creates with /f that replace the task.
+    """
+    if isinstance(command, str):
+        return False
+    kind = command_kind(command)
+    if kind == 'create':
+        return any(arg.lower() == '/f' for arg in command)
+    return kind in ('query', 'delete')
+
+def is_transient(stderr):
+    """
+    Whether the error output of a failed command is from an overloaded or
+    briefly unavailable service, worth retrying.
+    """
+    stderr = decode(stderr) or ''
+    return any(error in stderr for error in transient_errors)
+
+def retry_delay(attempt):
+    """
+    Seconds to wait before retry number attempt, from 0, with full jitter
+    so that concurrent retries spread out.
+    """
+    return random.uniform(0, min(retry_max_delay, retry_base_delay * 2 ** attempt))
+
+def xml_encoding(data):
+    """
+    Actual encoding of XML output from schtasks. The document declares UTF-16
+    but the bytes are UTF-8 unless there is a UTF-16 byte order mark.
+    """
+    if data.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return 'utf-16'
+    return 'utf-8'
+
+
+class CommandMetrics:
+
+    __slots__ = (
+        'count',
+        'failures',
+        'timeouts',
+        'retries',
+        'total_seconds',
+        'max_seconds',
+        'buckets',
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        # One more than latency_buckets, for +Inf.
+        self.buckets = [0] * (len(latency_buckets) + 1)
+
+    def observe(self, seconds, failed=False, timed_out=False):
+        self.count += 1
+        self.failures += failed
+        self.timeouts += timed_out
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.buckets[bisect.bisect_left(latency_buckets, seconds)] += 1
+
+    def to_dict(self):
+        return dict(
+            count = self.count,
+            failures = self.failures,
+            timeouts = self.timeouts,
+            retries = self.retries,
+            total_seconds = self.total_seconds,
+            max_seconds = self.max_seconds,
+            buckets = dict(zip(latency_buckets + ['+Inf'], self.buckets)),
+        )
+
+
+class Permit:
+    """
+    A slot of an AdaptiveLimit, held while one command runs.
+    """
+
+    __slots__ = (
+        'limit',
+        'kind',
+        'host',
+        'generation',
+    )
+
+    def __init__(self, limit, kind, host, generation):
+        self.limit = limit
+        self.kind = kind
+        self.host = host
+        self.generation = generation
+
+    def complete(self, seconds, overloaded=False):
+        """
+        Report how the command went: its latency, and whether it failed in a
+        way showing the service is overloaded, like a timeout.
+        """
+        self.limit.feedback(self, seconds, overloaded)
+
+
+class AdaptiveLimit:
+    """
+    Concurrency cap adapted by additive increase, multiplicative decrease.
+
+    Starting from min_limit, the limit grows by one for each healthy command
+    until the first back off, then by one per limit healthy commands, about
+    one per round of commands. A command is healthy when its latency is
+    within latency_tolerance times the baseline, the lowest latency of its
+    kind against its host, as hosts answer at their own pace. A slow or
+    overloaded command multiplies the limit by backoff, once for the
+    commands that started under the limit it lowers.
+    """
+
+    def __init__(
+        self,
+        max_limit,
+        min_limit = 1,
+        latency_tolerance = 2.0,
+        backoff = 0.7,
+        baseline_drift = 0.02,
+    ):
+        """
+        :param max_limit:
+            Highest limit.
+        :param min_limit:
+            Lowest, and first, limit.
+        :param latency_tolerance:
+            Latency, as a multiple of the baseline, above which a command is
+            a sign of overload.
+        :param backoff:
+            Factor the limit is multiplied by on overload.
+        :param baseline_drift:
+            Fraction of the way the baseline moves towards latencies above
+            it at min_limit, so it follows a service that became slower for
+            good.
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.baseline_drift = baseline_drift
+        self.limit = float(min_limit)
+        self.slow_start = True
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        # Incremented on each back off.
+        self.generation = 0
+        # (host, command kind) to baseline latency, None for the local host.
+        self.baselines = {}
+        self.peak = min_limit
+        self.backoffs = 0
+        self.completed = 0
+        # Moving average of the limit over completed commands.
+        self.average = float(min_limit)
+
+    @contextlib.contextmanager
+    def permit(self, kind, host=None):
+        """
+        Wait for the number of commands running to be under the limit.
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            permit = Permit(self, kind, host, self.generation)
+        try:
+            yield permit
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify()
+
+    def feedback(self, permit, seconds, overloaded):
+        with self.condition:
+            key = (permit.host, permit.kind)
+            baseline = self.baselines.get(key)
+            if baseline is None or seconds < baseline:
+                baseline = seconds
+            elif self.limit <= self.min_limit:
+                # Only at the lowest limit, latencies creeping up as the
+                # limit grows are a sign of overload.
+                baseline += (seconds - baseline) * self.baseline_drift
+            self.baselines[key] = baseline
+            slow = seconds > baseline * self.latency_tolerance
+
+            if overloaded or slow:
+                # Commands started before the last back off saw the old
+                # limit, they do not lower it again.
+                if permit.generation == self.generation:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self.generation += 1
+                    self.backoffs += 1
+                    self.slow_start = False
+            else:
+                previous = int(self.limit)
+                if self.slow_start:
+                    self.limit += 1
+                else:
+                    self.limit += 1 / self.limit
+                self.limit = min(self.max_limit, self.limit)
+                if int(self.limit) > previous:
+                    self.condition.notify(int(self.limit) - previous)
+                self.peak = max(self.peak, int(self.limit))
+
+            self.completed += 1
+            self.average += (self.limit - self.average) / min(self.completed, 100)
+
+    def summary(self):
+        """
+        Dict of the current, average and peak limit, and number of back
+        offs.
+        """
+        with self.condition:
+            return dict(
+                limit = int(self.limit),
+                average = round(self.average, 2),
+                peak = self.peak,
+                min_limit = self.min_limit,
+                max_limit = self.max_limit,
+                backoffs = self.backoffs,
+            )
+
+
+class Executor:
+    """
+    Run subprocesses with a global concurrency cap and per-kind timeouts.
+    """
+
+    def __init__(
+        self,
+        max_concurrency = default_max_concurrency,
+        timeouts = None,
+        timeout = default_timeout,
+        max_per_host = None,
+        runner = None,
+        adaptive = False,
+        min_concurrency = 1,
+        retries = default_retries,
+    ):
+        """
+        :param max_concurrency:
+            Most subprocesses running at the same time.
+        :param timeouts:
+            Dict of command kind to timeout seconds, updating
+            default_timeouts.
+        :param timeout:
+            Timeout for kinds not in timeouts.
+        :param max_per_host:
+            Most subprocesses running at the same time against one remote
+            host, see hosts.target. None for no limit besides
+            max_concurrency.
+        :param runner:
+            Callable used instead of subprocess.run, for emulated commands.
+            Takes the command and subprocess.run keyword arguments.
+        :param adaptive:
+            Adapt the cap between min_concurrency and max_concurrency to
+            command latency and transient failures, see AdaptiveLimit.
+        :param retries:
+            Times to retry an idempotent command that fails transiently, see
+            is_idempotent and is_transient.
+        """
+        self.max_concurrency = max_concurrency
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.adaptive_limit = None
+        if adaptive:
+            self.adaptive_limit = AdaptiveLimit(
+                max_concurrency,
+                min_limit = min(min_concurrency, max_concurrency),
+            )
+        self.retries = retries
+        self.max_per_host = max_per_host
+        self.host_semaphores = {}
+        self.runner = runner
+        self.timeouts = dict(default_timeouts)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.timeout = timeout
+        self.metrics_lock = threading.Lock()
+        self.metrics = {}
+
+    @contextlib.contextmanager
+    def slot(self, kind):
+        """
+        Wait for a free slot for the targeted host, then a global one.
+        Yields the Permit to report the command's outcome to, or None without
+        an adaptive limit.
+        """
+        with contextlib.ExitStack() as stack:
+            host = hosts.current_host()
+            if host is not None and self.max_per_host:
+                with self.metrics_lock:
+                    try:
+                        host_semaphore = self.host_semaphores[host]
+                    except KeyError:
+                        host_semaphore = threading.BoundedSemaphore(self.max_per_host)
+                        self.host_semaphores[host] = host_semaphore
+                stack.enter_context(host_semaphore)
+            if self.adaptive_limit is None:
+                stack.enter_context(self.semaphore)
+                yield None
+            else:
+                yield stack.enter_context(self.adaptive_limit.permit(kind, host))
+
+    def timeout_for(self, kind):
+        return self.timeouts.get(kind, self.timeout)
+
+    def command_metrics(self, kind):
+        # Under metrics_lock.
+        try:
+            return self.metrics[kind]
+        except KeyError:
+            command_metrics = self.metrics[kind] = CommandMetrics()
+            return command_metrics
+
+    def observe(self, kind, seconds, failed=False, timed_out=False):
+        with self.metrics_lock:
+            self.command_metrics(kind).observe(seconds, failed=failed, timed_out=timed_out)
+
+    def observe_retry(self, kind):
+        with self.metrics_lock:
+            self.command_metrics(kind).retries += 1
+
+    def run(
+        self,
+        command,
+        kind = None,
+        check = True,
+        capture = True,
+        text = False,
+        timeout = None,
+        retries = None,
+        **kwargs
+    ):
+        """
+        Run command like subprocess.run and return the CompletedProcess.
+
+        :param kind:
+            Name for metrics and timeouts. Defaults to command_kind.
+        :param capture:
+            Capture stdout and stderr.
+        :param text:
+            Decode stdout and stderr with decode.
+        :param timeout:
+            Seconds before killing the command. Defaults by kind.
+        :param retries:
+            Times to retry a command that times out or fails transiently.
+            Defaults to the executor's retries for idempotent commands, and
+            0 for others.
+        """
+        if kind is None:
+            kind = command_kind(command)
+        if timeout is None:
+            timeout = self.timeout_for(kind)
+        if retries is None:
+            retries = self.retries if is_idempotent(command) else 0
+        if capture:
+            kwargs['stdout'] = subprocess.PIPE
+            kwargs['stderr'] = subprocess.PIPE
+        for attempt in range(retries + 1):
+            try:
+                result = self.run_once(command, kind, timeout, kwargs)
+            except subprocess.TimeoutExpired as e:
+                if attempt == retries:
+                    raise hosts.redact_error(e)
+            else:
+                if attempt == retries or not (result.returncode and is_transient(result.stderr)):
+                    break
+            self.observe_retry(kind)
+            time.sleep(retry_delay(attempt))
+        if attempt and kind == 'delete' and result.returncode and missing_error in decode(result.stderr):
+            # An attempt that failed transiently deleted it after all.
+            result.returncode = 0
+        if text:
+            result.stdout = decode(result.stdout)
+            result.stderr = decode(result.stderr)
+        if check and result.returncode:
+            raise subprocess.CalledProcessError(
+                result.returncode,
+                hosts.redact(command),
+                result.stdout,
+                result.stderr,
+            )
+        return result
+
+    def run_once(self, command, kind, timeout, kwargs):
+        """
+        Run command once in a slot, recording metrics and reporting its
+        outcome to the adaptive limit.
+        """
+        failed = timed_out = False
+        runner = self.runner or subprocess.run
+        with self.slot(kind) as permit:
+            start = time.perf_counter()
+            try:
+                # run kills the child if the timeout expires.
+                result = runner(command, timeout=timeout, **kwargs)
+            except subprocess.TimeoutExpired:
+                failed = timed_out = True
+                raise
+            except OSError:
+                failed = True
+                raise
+            finally:
+                seconds = time.perf_counter() - start
+                if failed:
+                    self.observe(kind, seconds, failed=True, timed_out=timed_out)
+                    if permit is not None:
+                        permit.complete(seconds, overloaded=timed_out)
+            failed = result.returncode != 0
+            if permit is not None:
+                permit.complete(seconds, overloaded=failed and is_transient(result.stderr))
+        self.observe(kind, seconds, failed=failed)
+        return result
+
+    @contextlib.contextmanager
+    def stream(self, command, kind=None, check=True, timeout=None, **kwargs):
+        """
+        Context manager yielding a Popen with a text stdout pipe, for reading
+        output while the command runs. The command is killed if it is still
+        running after timeout seconds.
+        """
+        if self.runner is not None:
+            # Emulated commands complete at once, stream their whole output.
+            result = self.run(command, kind=kind, check=check, text=True, timeout=timeout, **kwargs)
+            yield types.SimpleNamespace(
+                stdout = io.StringIO(result.stdout),
+                returncode = result.returncode,
+            )
+            return
+        if kind is None:
+            kind = command_kind(command)
+        if timeout is None:
+            timeout = self.timeout_for(kind)
+        with self.slot(kind) as permit:
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                command,
+                stdout = subprocess.PIPE,
+                stderr = subprocess.PIPE,
+                encoding = locale.getpreferredencoding(False),
+                errors = 'replace',
+                **kwargs
+            )
+            # Read stderr alongside, so a full pipe cannot block the command
+            # while stdout is read.
+            stderr_chunks = []
+            stderr_reader = threading.Thread(
+                target = lambda: stderr_chunks.append(process.stderr.read()),
+                daemon = True,
+            )
+            stderr_reader.start()
+            timed_out = threading.Event()
+            def kill():
+                timed_out.set()
+                process.kill()
+            timer = None
+            if timeout is not None:
+                timer = threading.Timer(timeout, kill)
+                timer.daemon = True
+                timer.start()
+            try:
+                with process:
+                    try:
+                        yield process
+                    except BaseException:
+                        # Reader stopped early or failed.
+                        process.kill()
+                        stderr_reader.join()
+                        raise
+                    # Drain, so the process can exit, and wait.
+                    process.stdout.read()
+                    stderr_reader.join()
+                    stderr = ''.join(stderr_chunks)
+            except GeneratorExit:
+                self.observe(kind, time.perf_counter() - start)
+                raise
+            except BaseException:
+                self.observe(kind, time.perf_counter() - start, failed=True)
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            seconds = time.perf_counter() - start
+            overloaded = timed_out.is_set() or (
+                process.returncode != 0 and is_transient(stderr)
+            )
+            if permit is not None and overloaded:
+                # Only overload is fed back, the latency includes the reader.
+                permit.complete(seconds, overloaded=True)
+        if timed_out.is_set():
+            self.observe(kind, seconds, failed=True, timed_out=True)
+            raise subprocess.TimeoutExpired(hosts.redact(command), timeout, stderr=stderr)
+        failed = process.returncode != 0
+        self.observe(kind, seconds, failed=failed)
+        if check and failed:
+            raise subprocess.CalledProcessError(
+                process.returncode,
+                hosts.redact(command),
+                stderr = stderr,
+            )
+
+    def metrics_summary(self):
+        """
+        Dict of command kind to metrics dict.
+        """
+        with self.metrics_lock:
+            return {
+                kind: command_metrics.to_dict()
+                for kind, command_metrics in sorted(self.metrics.items())
+            }
+
+    def concurrency_summary(self):
+        """
+        Dict of the adaptive limit's summary, see AdaptiveLimit.summary, or
+        None with a fixed cap.
+        """
+        if self.adaptive_limit is not None:
+            return self.adaptive_limit.summary()
+
+    def reset_metrics(self):
+        with self.metrics_lock:
+            self.metrics.clear()
+
+
+default_executor = Executor()
+
+def configure(**kwargs):
+    """
+    Replace the default executor with one created from kwargs.
+    """
+    global default_executor
+    default_executor = Executor(**kwargs)
+    return default_executor
+
+def run(command, **kwargs):
+    """
+    Run command with the default executor.
+    """
+    return default_executor.run(command, **kwargs)
+
+def stream(command, **kwargs):
+    """
+    Stream command output with the default executor.
+    """
+    return default_executor.stream(command, **kwargs)
+
+def metrics_summary():
+    return default_executor.metrics_summary()
+
+def concurrency_summary():
+    return default_executor.concurrency_summary()
+
+def format_metrics(summary):
+    """
+    Lines of text for a metrics summary.
+    """
+    lines = []
+    for kind, data in summary.items():
+        mean = data['total_seconds'] / data['count'] if data['count'] else 0
+        lines.append(
+            f'{kind}: {data["count"]} calls, {data["failures"]} failed,'
+            f' {data["timeouts"]} timed out, {data["retries"]} retried,'
+            f' mean {mean:.3f}s,'
+            f' max {data["max_seconds"]:.3f}s'
+        )
+    return lines
+
+def format_concurrency(summary):
+    return (
+        f'concurrency: converged on {summary["limit"]}'
+        f' (average {summary["average"]}, peak {summary["peak"]},'
+        f' range {summary["min_limit"]}-{summary["max_limit"]}),'
+        f' {summary["backoffs"]} backoffs'
+    )
@@ -0,0 +1,371 @@
+"""
+In-memory stand-in for the Task Scheduler, for exercising quartz without
+Windows. Methods mirror the schtasks module and raise
+subprocess.CalledProcessError like a failing schtasks command.
+"""
+import base64
+import csv
+import io
+import json
+import random
+import re
+import subprocess
+import threading
+import time
+
+from lxml import etree
+
+from . import schtasks
+
+class FakeScheduler:
+
+    def __init__(self, tasks=None, latency=0):
+        """
+        :param tasks:
+            Optional dict of task name to XML string of registered tasks.
+        :param latency:
+            Seconds each operation takes.
+        """
+        self.latency = latency
+        self.lock = threading.Lock()
+        # Casefolded normalized name to dict of task data.
+        self.tasks = {}
+        self.calls = []
+        for task_name, xml in (tasks or {}).items():
+            self._register(task_name, xml)
+
+    def _key(self, task_name):
+        return schtasks.normalize_task_name(task_name).casefold()
+
+    def _register(self, task_name, xml):
+        self.tasks[self._key(task_name)] = dict(
+            name = schtasks.normalize_task_name(task_name),
+            xml = xml,
+            run_as = None,
+            enabled = True,
+            next_run_time = 'N/A',
+            last_run_time = '11/30/1999 12:00:00 AM',
+            last_result = '267011',
+        )
+
+    def set_run_times(self, task_name, next_run_time=None, last_run_time=None, last_result=None):
+        """
+        Set the listed run time values, as schtasks formats them, and last
+        result of a task.
+        """
+        with self.lock:
+            data = self.tasks[self._key(task_name)]
+            if next_run_time is not None:
+                data['next_run_time'] = next_run_time
+            if last_run_time is not None:
+                data['last_run_time'] = last_run_time
+            if last_result is not None:
+                data['last_result'] = str(last_result)
+
+    def _call(self, name, command):
+        self.calls.append(name)
+        if self.latency:
+            time.sleep(self.latency)
+        return subprocess.CompletedProcess(command, 0, stdout=b'SUCCESS', stderr=b'')
+
+    def _missing(self, command, task_name):
+        stderr = f'ERROR: The system cannot find the file specified. {task_name}'
+        raise subprocess.CalledProcessError(1, command, b'', stderr.encode())
+
+    def create(self, task_name, xml_path, force=True):
+        command = schtasks.create_from_xml_command(task_name, xml_path, force)
+        with open(xml_path, 'rb') as xml_file:
+            xml = xml_file.read().decode('utf-8')
+        with self.lock:
+            if not force and self._key(task_name) in self.tasks:
+                stderr = b'ERROR: Cannot create a file when that file already exists.'
+                raise subprocess.CalledProcessError(1, command, b'', stderr)
+            self._register(task_name, xml)
+        return self._call('create', command)
+
+    def run_as(self, task_name, user, password):
+        command = schtasks.run_as_command(task_name, user, password)
+        with self.lock:
+            try:
+                self.tasks[self._key(task_name)]['run_as'] = user
+            except KeyError:
+                self._missing(command, task_name)
+        return self._call('run_as', command)
+
+    def enable(self, task_name, enabled=True):
+        command = schtasks.enable_command(task_name, enabled)
+        with self.lock:
+            try:
+                self.tasks[self._key(task_name)]['enabled'] = enabled
+            except KeyError:
+                self._missing(command, task_name)
+        return self._call('change', command)
+
+    def delete(self, task_name):
+        command = schtasks.delete_command(task_name)
+        with self.lock:
+            if self.tasks.pop(self._key(task_name), None) is None:
+                self._missing(command, task_name)
+        return self._call('delete', command)
+
+    def exists(self, task_name):
+        self._call('exists', ['schtasks', '/query', '/tn', task_name])
+        return self._key(task_name) in self.tasks
+
+    def task_names(self):
+        with self.lock:
+            return [data['name'] for data in self.tasks.values()]
+
+    def get_tasks(self, verbose=False):
+        """
+        Rows like schtasks.get_tasks.
+        """
+        self._call('query', ['schtasks', '/query', '/fo', 'CSV'])
+        with self.lock:
+            tasks = list(self.tasks.values())
+        for data in tasks:
+            row = {
+                'TaskName': data['name'],
+                'Next Run Time': data['next_run_time'],
+                'Status': 'Ready',
+            }
+            if verbose:
+                row.update({
+                    'Last Run Time': data['last_run_time'],
+                    'Last Result': data['last_result'],
+                })
+            yield row
+
+    def get_xml(self, task_name, as_string=False):
+        command = ['schtasks', '/query', '/xml', '/tn', task_name]
+        self._call('query', command)
+        with self.lock:
+            try:
+                xml = self.tasks[self._key(task_name)]['xml']
+            except KeyError:
+                self._missing(command, task_name)
+        if as_string:
+            return xml.encode('utf-8')
+        return etree.fromstring(xml.encode('utf-8'))
+
+
+class FakeFleet:
+    """
+    Subprocess runner emulating schtasks commands on several hosts, for
+    executor.Executor(runner=...). Commands without /s target "localhost".
+    Hosts not in the fleet fail like an unreachable machine.
+    """
+
+    # Options followed by a value. /xml takes a path only for /create.
+    value_options = {'/s', '/u', '/p', '/tn', '/fo', '/ru', '/rp'}
+
+    def __init__(self, hosts=('localhost', ), latency=0):
+        self.schedulers = {
+            host.casefold(): FakeScheduler(latency=latency) for host in hosts
+        }
+
+    def scheduler(self, host='localhost'):
+        return self.schedulers[host.casefold()]
+
+    # A PowerShell single quoted literal.
+    quoted = r"'((?:[^']|'')*)'"
+
+    script_operation = re.compile(
+        r'(Register|Unregister)-ScheduledTask @Session'
+        rf' -TaskPath {quoted} -TaskName {quoted}'
+        rf'(?: -Xml \(Read-Base64 {quoted}\) -Force)?'
+        rf'(?: -User {quoted})?'
+        rf'(?: -Password {quoted})?'
+        r'.*?Write-Result (\d+)',
+        re.DOTALL,
+    )
+
+    def parse(self, verb, args):
+        options = {}
+        args = iter(args)
+        for arg in args:
+            option = arg.lower()
+            if option in self.value_options or (verb == '/create' and option == '/xml'):
+                options[option] = next(args)
+            else:
+                options[option] = True
+        return options
+
+    def run_script(self, script_path):
+        """
+        Run a script of powershell.ScriptWriter, appending to its results file.
+        """
+        def unquote(value):
+            return None if value is None else value.replace("''", "'")
+
+        with open(script_path, encoding='utf-8-sig') as script_file:
+            script = script_file.read()
+        results_path = unquote(re.search(r'\$Results = ' + self.quoted, script).group(1))
+        host = re.search(r'-ComputerName ' + self.quoted, script)
+        host = 'localhost' if host is None else unquote(host.group(1))
+        scheduler = self.schedulers.get(host.casefold())
+        with open(results_path, 'a', encoding='utf-8') as results_file:
+            if scheduler is None:
+                # New-CimSession failed, stopping the script.
+                return subprocess.CompletedProcess(script_path, 1, b'', b'New-CimSession failed')
+            for match in self.script_operation.finditer(script):
+                verb, path, name, xml, user, password, operation_id = match.groups()
+                task_name = unquote(path) + unquote(name)
+                result = dict(id=int(operation_id), ok=True)
+                with scheduler.lock:
+                    if verb == 'Register':
+                        scheduler._register(task_name, base64.b64decode(xml).decode('utf-8'))
+                        scheduler.tasks[scheduler._key(task_name)]['run_as'] = unquote(user)
+                    elif scheduler.tasks.pop(scheduler._key(task_name), None) is None:
+                        result.update(ok=False, error=f'No task {task_name}')
+                scheduler.calls.append(verb.lower())
+                results_file.write(json.dumps(result) + '\n')
+        return subprocess.CompletedProcess(script_path, 0, b'', b'')
+
+    def __call__(self, command, timeout=None, **kwargs):
+        if command[0].lower() == 'powershell':
+            script = re.search(r'-File "?([^"\']+\.ps1)', ' '.join(command))
+            if script is not None:
+                # powershell.script_command, elevated or not.
+                return self.run_script(script.group(1))
+            # Folders only exist through task names here, deleting one is a
+            # no-op, see powershell.delete_folder_command.
+            return subprocess.CompletedProcess(command, 0, b'', b'')
+        _, verb, *args = command
+        verb = verb.lower()
+        options = self.parse(verb, args)
+        host = options.get('/s', 'localhost')
+        scheduler = self.schedulers.get(host.casefold())
+        if scheduler is None:
+            stderr = b'ERROR: The RPC server is unavailable.\r\n'
+            return subprocess.CompletedProcess(command, 1, b'', stderr)
+        handler = getattr(self, 'do_' + verb.lstrip('/'))
+        try:
+            stdout = handler(scheduler, host, options)
+        except subprocess.CalledProcessError as error:
+            return subprocess.CompletedProcess(
+                command,
+                error.returncode,
+                b'',
+                error.stderr,
+            )
+        return subprocess.CompletedProcess(command, 0, stdout.encode(), b'')
+
+    def do_create(self, scheduler, host, options):
+        scheduler.create(options['/tn'], options['/xml'], force=options.get('/f', False))
+        return f'SUCCESS: The scheduled task "{options["/tn"]}" has successfully been created.\r\n'
+
+    def do_change(self, scheduler, host, options):
+        if '/ru' not in options:
+            scheduler.enable(options['/tn'], enabled='/disable' not in options)
+            return f'SUCCESS: The parameters of scheduled task "{options["/tn"]}" have been changed.\r\n'
+        scheduler.run_as(options['/tn'], options['/ru'], options['/rp'])
+        return f'SUCCESS: The parameters of scheduled task "{options["/tn"]}" have been changed.\r\n'
+
+    def do_delete(self, scheduler, host, options):
+        scheduler.delete(options['/tn'])
+        return f'SUCCESS: The scheduled task "{options["/tn"]}" was successfully deleted.\r\n'
+
+    def do_query(self, scheduler, host, options):
+        task_name = options.get('/tn')
+        if options.get('/xml'):
+            if task_name is not None:
+                return scheduler.get_xml(task_name, as_string=True).decode('utf-8')
+            root = etree.Element('Tasks')
+            for name in scheduler.task_names():
+                root.append(etree.Comment(f' {name} '))
+                root.append(scheduler.get_xml(name))
+            return etree.tostring(root, encoding='unicode')
+        if task_name is not None:
+            # Existence check.
+            if not scheduler.exists(task_name):
+                scheduler._missing(['schtasks', '/query', '/tn', task_name], task_name)
+            return f'{schtasks.normalize_task_name(task_name)}\r\n'
+        verbose = options.get('/v', False)
+        rows = list(scheduler.get_tasks(verbose=verbose))
+        fields = list(schtasks.csv_fields)
+        if verbose:
+            fields.extend(['Last Run Time', 'Last Result'])
+        if options.get('/fo', '').upper() == 'CSV':
+            output = io.StringIO()
+            writer = csv.writer(output, quoting=csv.QUOTE_ALL, lineterminator='\r\n')
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow([row[key] for key in fields])
+            return output.getvalue()
+        lines = []
+        for row in rows:
+            lines.append(f'HostName:      {host}')
+            for key in fields:
+                lines.append(f'{key}:'.ljust(15) + row[key])
+            lines.append('')
+        return '\r\n'.join(lines)
+
+
+class SaturatedRunner:
+    """
+    Runner wrapping another, like FakeFleet, that behaves like a service
+    with limited capacity: commands beyond capacity running at the same time
+    slow down and may fail transiently. Override curve for other shapes.
+    """
+
+    busy_stderr = b'ERROR: The RPC server is too busy to complete this operation.\r\n'
+
+    def __init__(
+        self,
+        runner,
+        capacity = 4,
+        latency = 0.01,
+        slowdown = 0.5,
+        error_rate = 0.05,
+        seed = 0,
+    ):
+        """
+        :param capacity:
+            Commands that run at the same time without slowing down.
+        :param latency:
+            Seconds a command takes within capacity.
+        :param slowdown:
+            Extra latency, as a fraction of latency, per command over
+            capacity.
+        :param error_rate:
+            Chance of a transient failure per command over capacity.
+        """
+        self.runner = runner
+        self.capacity = capacity
+        self.latency = latency
+        self.slowdown = slowdown
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+
+    def curve(self, in_flight):
+        """
+        Return (seconds, chance of transient failure) of a command started
+        with in_flight commands running, itself included.
+        """
+        over = max(0, in_flight - self.capacity)
+        return (
+            self.latency * (1 + self.slowdown * over),
+            min(1, self.error_rate * over),
+        )
+
+    def __call__(self, command, timeout=None, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            seconds, error_chance = self.curve(self.in_flight)
+            failed = self.random.random() < error_chance
+        try:
+            if timeout is not None and seconds > timeout:
+                time.sleep(timeout)
+                raise subprocess.TimeoutExpired(command, timeout)
+            time.sleep(seconds)
+            if failed:
+                return subprocess.CompletedProcess(command, 1, b'', self.busy_stderr)
+            return self.runner(command, timeout=timeout, **kwargs)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
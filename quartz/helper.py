@@ -0,0 +1,389 @@
+"""
+Elevated helper. Operations are sent over a local connection and results are
+streamed back one per operation as they complete.
+
+Clients authenticate with a key in ~/.quartz/helper.key. Any process running
+as the user can read that file, mode 0600 restricts nothing on Windows, and
+with it drive the elevated helper. So connect launches the helper for one
+connection: it exits when the run that launched it ends, and the key is
+replaced on every launch. A helper started by hand without --once stays up
+until idle_timeout, exposed for that long.
+
+Operations are dicts with an "op" key:
+
+- {"op": "create", "task_name": ..., "xml": ..., "run_as": {"user": ..., "password": ...}}
+  "run_as" is optional.
+- {"op": "run_as", "task_name": ..., "user": ..., "password": ...}
+- {"op": "delete", "task_name": ...}
+- {"op": "end"} ends the operations of a connection. The helper answers it
+  when every result has been sent.
+- {"op": "shutdown"} stops the helper.
+
+Every operation except "end" and "shutdown" gets a result dict with the
+operation's "id", "op", "task_name", "ok" and, when a command ran,
+"returncode", "stdout", "stderr". Failed operations have an "error" string.
+"""
+import concurrent.futures
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from multiprocessing.connection import Listener
+
+from . import const
+from . import executor
+from . import powershell
+from . import schtasks
+
+default_workers = 4
+
+default_idle_timeout = 15 * 60
+
+def default_address():
+    """
+    Per-user address of the helper. A named pipe on Windows, a UNIX socket
+    otherwise.
+    """
+    user = os.environ.get('USERNAME') or os.environ.get('USER') or 'user'
+    if sys.platform == 'win32':
+        return rf'\\.\pipe\{const.APPNAME}-helper-{user}'
+    return os.path.join(tempfile.gettempdir(), f'{const.APPNAME}-helper-{user}.sock')
+
+def default_authkey_path():
+    return os.path.join(os.path.expanduser('~'), '.' + const.APPNAME, 'helper.key')
+
+def new_authkey(path=None):
+    """
+    Write a new shared secret for connecting to the helper, readable only by
+    the user where the mode applies, and return it.
+    """
+    if path is None:
+        path = default_authkey_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    authkey = secrets.token_bytes(32)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as key_file:
+        key_file.write(authkey)
+    os.replace(temp_path, path)
+    return authkey
+
+def load_authkey(path=None, create=False):
+    """
+    Read the shared secret for connecting to the helper, optionally creating
+    it if missing.
+    """
+    if path is None:
+        path = default_authkey_path()
+    if create and not os.path.exists(path):
+        return new_authkey(path)
+    with open(path, 'rb') as key_file:
+        return key_file.read()
+
+
+class SchtasksBackend:
+    """
+    Run operations with schtasks.
+    """
+
+    def create(self, task_name, xml_path, force=True):
+        return schtasks.task_create_from_xml(task_name, xml_path, force=force)
+
+    def run_as(self, task_name, user, password):
+        return schtasks.task_run_as(task_name, user, password)
+
+    def delete(self, task_name):
+        return schtasks.delete(task_name)
+
+
+def _text(output):
+    if isinstance(output, bytes):
+        return output.decode('utf-8', errors='replace')
+    return output
+
+def _add_process_result(result, process_result):
+    result['returncode'] = process_result.returncode
+    result['stdout'] = _text(process_result.stdout)
+    result['stderr'] = _text(process_result.stderr)
+
+def _create(backend, operation):
+    xml_file = tempfile.NamedTemporaryFile(
+        prefix = operation['task_name'].split('\\')[-1] + '_',
+        suffix = '.xml',
+        delete = False,
+    )
+    try:
+        with xml_file:
+            xml_file.write(operation['xml'].encode('utf-8'))
+        process_result = backend.create(operation['task_name'], xml_file.name)
+    finally:
+        os.remove(xml_file.name)
+    run_as = operation.get('run_as')
+    if run_as:
+        process_result = backend.run_as(
+            operation['task_name'],
+            run_as['user'],
+            run_as['password'],
+        )
+    return process_result
+
+def _run_as(backend, operation):
+    return backend.run_as(
+        operation['task_name'],
+        operation['user'],
+        operation['password'],
+    )
+
+def _delete(backend, operation):
+    return backend.delete(operation['task_name'])
+
+operation_handlers = {
+    'create': _create,
+    'run_as': _run_as,
+    'delete': _delete,
+}
+
+def execute(backend, operation):
+    """
+    Run one operation with the backend and return its result dict.
+    """
+    result = dict(
+        id = operation.get('id'),
+        op = operation.get('op'),
+        task_name = operation.get('task_name'),
+        ok = False,
+    )
+    try:
+        handler = operation_handlers[operation['op']]
+        process_result = handler(backend, operation)
+    except subprocess.CalledProcessError as e:
+        _add_process_result(result, e)
+        result['error'] = str(e)
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    else:
+        if process_result is not None:
+            _add_process_result(result, process_result)
+        result['ok'] = True
+    return result
+
+
+class Helper:
+    """
+    Serve operations from clients, running them with bounded concurrency.
+    """
+
+    def __init__(
+        self,
+        address,
+        authkey,
+        backend = None,
+        workers = default_workers,
+        idle_timeout = default_idle_timeout,
+        once = False,
+    ):
+        if backend is None:
+            backend = SchtasksBackend()
+        self.address = address
+        self.authkey = authkey
+        self.backend = backend
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self.once = once
+        self.listener = None
+        self.stopping = threading.Event()
+        self.ready = threading.Event()
+        self.last_activity = time.monotonic()
+
+    def stop(self):
+        """
+        Stop serving. Connects to the listener to wake up its accept.
+        """
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        try:
+            Client(self.listener.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+
+    def _watch_idle(self):
+        while not self.stopping.wait(1):
+            if time.monotonic() - self.last_activity > self.idle_timeout:
+                self.stop()
+
+    def handle(self, conn, pool):
+        # Results are sent by done callbacks, which run after waiters on
+        # the futures wake up, so the results sent are counted instead.
+        sent = threading.Condition()
+        submitted = 0
+        sent_count = 0
+
+        def send_result(future):
+            nonlocal sent_count
+            with sent:
+                try:
+                    conn.send(future.result())
+                finally:
+                    sent_count += 1
+                    sent.notify_all()
+
+        def wait_sent():
+            sent.wait_for(lambda: sent_count == submitted)
+
+        with conn:
+            while True:
+                try:
+                    operation = conn.recv()
+                except EOFError:
+                    break
+                self.last_activity = time.monotonic()
+                if operation.get('op') == 'shutdown':
+                    self.stop()
+                    break
+                if operation.get('op') == 'end':
+                    with sent:
+                        wait_sent()
+                        conn.send({'op': 'end'})
+                    continue
+                future = pool.submit(execute, self.backend, operation)
+                submitted += 1
+                future.add_done_callback(send_result)
+            with sent:
+                wait_sent()
+
+    def serve_forever(self):
+        """
+        Accept connections until stopped or idle for idle_timeout seconds.
+        With once, serve the first connection and stop when it closes.
+        """
+        if sys.platform != 'win32' and isinstance(self.address, str):
+            # Stale socket file from a helper that did not exit cleanly.
+            if os.path.exists(self.address):
+                os.remove(self.address)
+        self.listener = Listener(self.address, authkey=self.authkey)
+        with self.listener, concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            if self.idle_timeout:
+                threading.Thread(target=self._watch_idle, daemon=True).start()
+            self.ready.set()
+            while not self.stopping.is_set():
+                try:
+                    conn = self.listener.accept()
+                except (OSError, AuthenticationError):
+                    continue
+                if self.stopping.is_set():
+                    conn.close()
+                    break
+                if self.once:
+                    self.handle(conn, pool)
+                    self.stopping.set()
+                    break
+                thread = threading.Thread(
+                    target = self.handle,
+                    args = (conn, pool),
+                    daemon = True,
+                )
+                thread.start()
+
+
+class HelperClient:
+    """
+    Connection to a running helper.
+    """
+
+    def __init__(self, address=None, authkey=None):
+        if address is None:
+            address = default_address()
+        if authkey is None:
+            authkey = load_authkey()
+        self.conn = Client(address, authkey=authkey)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self, operations):
+        """
+        Send operations and yield result dicts as they complete, in
+        completion order.
+        """
+        # Send from a thread so that results are read while sending.
+        def send_all():
+            for index, operation in enumerate(operations):
+                operation = dict(operation)
+                operation.setdefault('id', index)
+                self.conn.send(operation)
+            self.conn.send({'op': 'end'})
+
+        sender = threading.Thread(target=send_all, daemon=True)
+        sender.start()
+        while True:
+            result = self.conn.recv()
+            if result.get('op') == 'end':
+                break
+            yield result
+        sender.join()
+
+    def shutdown(self):
+        self.conn.send({'op': 'shutdown'})
+
+
+def launch_elevated(address, authkey_path, workers=default_workers, once=True):
+    """
+    Start the helper as admin, prompting with UAC. Does not wait for it. With
+    once, the helper exits after its first connection.
+    """
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    helper_args = subprocess.list2cmdline([
+        '-m', const.APPNAME, 'helper',
+        '--address', address,
+        '--authkey-file', authkey_path,
+        '--workers', str(workers),
+    ] + (['--once'] if once else []))
+    command = [
+        'PowerShell',
+        '-Command', 'Start-Process',
+        '-FilePath', powershell.quote(sys.executable),
+        '-ArgumentList', powershell.quote(helper_args),
+        '-WorkingDirectory', powershell.quote(package_parent),
+        '-WindowStyle', 'Hidden',
+        '-Verb', 'RunAs',
+    ]
+    executor.run(command, capture=False)
+
+def connect(address=None, authkey_path=None, launch=True, timeout=60, workers=default_workers):
+    """
+    Return a HelperClient, launching the elevated helper if none is running.
+    A launched helper serves only the returned client, with a new key.
+    """
+    if address is None:
+        address = default_address()
+    if authkey_path is None:
+        authkey_path = default_authkey_path()
+    authkey = load_authkey(authkey_path, create=True)
+    try:
+        return HelperClient(address, authkey)
+    except OSError:
+        if not launch:
+            raise
+    authkey = new_authkey(authkey_path)
+    launch_elevated(address, authkey_path, workers=workers)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return HelperClient(address, authkey)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
@@ -0,0 +1,460 @@
+"""
+How tasks actually ran, from Task Scheduler operational event log exports:
+`wevtutil qe Microsoft-Windows-TaskScheduler/Operational /f:xml` output, or
+event logs saved as XML.
+
+Exports are parsed incrementally, one event at a time, and events of the
+same run are correlated by task instance ID, in any order. Per task, a
+History counts runs, failures and launches skipped or queued by the
+MultipleInstancesPolicy, and keeps durations in a histogram of log spaced
+buckets, so that percentiles need no list of every run. A History saved to
+a JSON store remembers the last event record ingested per computer, so
+ingesting an export again only adds newer events.
+"""
+import bisect
+import codecs
+import collections
+import datetime
+import json
+import math
+import os
+import time
+
+from lxml import etree
+
+from . import executor
+from . import metrics
+
+event_namespace = '{http://schemas.microsoft.com/win/2004/08/events/event}'
+
+log_name = 'Microsoft-Windows-TaskScheduler/Operational'
+
+store_version = 1
+
+# Event IDs of the operational log.
+TASK_STARTED = 100
+TASK_START_FAILED = 101
+TASK_COMPLETED = 102
+ACTION_START_FAILED = 103
+TASK_TERMINATED = 111
+ACTION_COMPLETED = 201
+# MultipleInstancesPolicy IgnoreNew.
+LAUNCH_SKIPPED = 322
+# MultipleInstancesPolicy StopExisting.
+INSTANCE_REPLACED = 323
+# MultipleInstancesPolicy Queue.
+LAUNCH_QUEUED = (324, 325)
+
+# Each duration bucket is this factor wider than the one before, bounding
+# the error of percentiles to about half of it.
+bucket_factor = 1.05
+
+# Instances still waiting for their start or completion this many seconds
+# after an event of theirs was last ingested are dropped on save, like runs
+# whose start event rotated out of the log.
+default_max_open_seconds = 7 * 24 * 60 * 60
+
+# Completed instances remembered, for failure events that come after the
+# completion event.
+max_closed_instances = 10000
+
+def bucket_index(seconds):
+    """
+    Histogram bucket of a duration, 0 for under a millisecond.
+    """
+    milliseconds = seconds * 1000
+    if milliseconds < 1:
+        return 0
+    return int(math.log(milliseconds, bucket_factor)) + 1
+
+def bucket_seconds(index):
+    """
+    Representative duration of a bucket, its geometric middle.
+    """
+    if index == 0:
+        return 0.0
+    return bucket_factor ** (index - 0.5) / 1000
+
+def parse_system_time(value):
+    """
+    Seconds since epoch of an event SystemTime, like
+    "2024-05-01T10:00:00.1234567Z", which has more fractional digits than
+    datetime takes.
+    """
+    value = value.rstrip('Z')
+    whole, _, fraction = value.partition('.')
+    parsed = datetime.datetime.fromisoformat(whole).replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp() + float('0.' + (fraction or '0'))
+
+
+class TaskStats:
+    """
+    Runs of one task.
+    """
+
+    __slots__ = (
+        'runs',
+        'failures',
+        'start_failures',
+        'terminated',
+        'skipped',
+        'queued',
+        'replaced',
+        'total_seconds',
+        'max_seconds',
+        'buckets',
+    )
+
+    counters = __slots__[:7]
+
+    def __init__(self):
+        for counter in self.counters:
+            setattr(self, counter, 0)
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        # Bucket index to number of runs.
+        self.buckets = {}
+
+    def add_run(self, seconds, failed):
+        self.runs += 1
+        self.failures += failed
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        index = bucket_index(seconds)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def percentile(self, fraction):
+        """
+        Approximate duration under which fraction of the runs completed, or
+        None without runs.
+        """
+        if not self.runs:
+            return None
+        rank = max(1, math.ceil(fraction * self.runs))
+        indexes = sorted(self.buckets)
+        cumulative = []
+        total = 0
+        for index in indexes:
+            total += self.buckets[index]
+            cumulative.append(total)
+        index = indexes[bisect.bisect_left(cumulative, rank)]
+        return min(bucket_seconds(index), self.max_seconds)
+
+    def failure_rate(self):
+        attempts = self.runs + self.start_failures
+        if not attempts:
+            return 0.0
+        return (self.failures + self.start_failures) / attempts
+
+    def summary(self):
+        return dict(
+            {counter: getattr(self, counter) for counter in self.counters},
+            failure_rate = self.failure_rate(),
+            p50_seconds = self.percentile(0.5),
+            p95_seconds = self.percentile(0.95),
+            max_seconds = self.max_seconds,
+            total_seconds = self.total_seconds,
+        )
+
+    def to_dict(self):
+        data = {counter: getattr(self, counter) for counter in self.counters}
+        data.update(
+            total_seconds = self.total_seconds,
+            max_seconds = self.max_seconds,
+            buckets = {str(index): count for index, count in self.buckets.items()},
+        )
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for counter in cls.counters:
+            setattr(stats, counter, data.get(counter, 0))
+        stats.total_seconds = data['total_seconds']
+        stats.max_seconds = data['max_seconds']
+        stats.buckets = {int(index): count for index, count in data['buckets'].items()}
+        return stats
+
+
+def strip_declaration(text):
+    """
+    Text without a leading byte order mark and XML declaration.
+    """
+    text = text.lstrip('\ufeff \t\r\n')
+    if text.startswith('<?xml'):
+        text = text[text.index('?>') + 2:]
+    return text
+
+def iter_events(file, chunk_size=1 << 16):
+    """
+    Generate each Event element of an export as it is parsed from file,
+    binary or text. Elements are cleared once the generator resumes, so
+    memory does not grow with the file.
+
+    Exports from wevtutil are a sequence of Event elements without a root
+    element, saved logs have an Events root. Both are parsed inside a root
+    element of our own.
+    """
+    parser = etree.XMLPullParser(events=('end', ), tag=event_namespace + 'Event')
+    parser.feed('<quartz-events>')
+    decoder = None
+    first = True
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        if isinstance(chunk, bytes):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(executor.xml_encoding(chunk))()
+            chunk = decoder.decode(chunk)
+        if first:
+            chunk = strip_declaration(chunk)
+            # A declaration split over chunks is not worth handling.
+            first = not chunk
+        parser.feed(chunk)
+        for _, element in parser.read_events():
+            yield element
+            element.clear()
+            # Drop the cleared events before it from the root.
+            parent = element.getparent()
+            while element.getprevious() is not None:
+                del parent[0]
+    parser.feed('</quartz-events>')
+    for _, element in parser.read_events():
+        yield element
+    parser.close()
+
+def event_record(element):
+    """
+    Dict of the parts of an Event element used here: "id", "record",
+    "computer", "time" in seconds since epoch, and "data", the EventData
+    values by name.
+    """
+    # Children are looked up by tag in one pass, find parses its path each
+    # call.
+    parts = {child.tag: child for child in element}
+    system = {child.tag: child for child in parts[event_namespace + 'System']}
+    data = {}
+    event_data = parts.get(event_namespace + 'EventData')
+    if event_data is not None:
+        for item in event_data:
+            data[item.get('Name')] = (item.text or '').strip()
+    record = system.get(event_namespace + 'EventRecordID')
+    computer = system.get(event_namespace + 'Computer')
+    return dict(
+        id = int(system[event_namespace + 'EventID'].text),
+        record = int(record.text) if record is not None else None,
+        computer = computer.text or '' if computer is not None else '',
+        time = parse_system_time(system[event_namespace + 'TimeCreated'].get('SystemTime')),
+        data = data,
+    )
+
+def read_events(file):
+    """
+    Generate event_record dicts from an export.
+    """
+    for element in iter_events(file):
+        yield event_record(element)
+
+def wevtutil_command(count=None):
+    """
+    Command exporting the operational log, oldest events first.
+    """
+    command = ['wevtutil', 'qe', log_name, '/f:xml']
+    if count is not None:
+        command.append(f'/c:{count}')
+    return command
+
+
+class History:
+    """
+    Run statistics per task, built up from events over any number of
+    ingests.
+    """
+
+    def __init__(self, max_open_seconds=default_max_open_seconds):
+        # Task name to TaskStats.
+        self.tasks = {}
+        # Computer to the highest event record ingested, in earlier
+        # ingests.
+        self.high_water = {}
+        # Instance ID to dict of "task", "start", "end", "failed" and "seen",
+        # the time an event of theirs was last ingested, of runs with only
+        # some of their events ingested.
+        self.open = {}
+        # Instance ID to dict of "task" and "failed" of the latest completed
+        # runs, oldest first.
+        self.closed = collections.OrderedDict()
+        self.max_open_seconds = max_open_seconds
+        self.newest = None
+
+    def task_stats(self, task_name):
+        try:
+            return self.tasks[task_name]
+        except KeyError:
+            stats = self.tasks[task_name] = TaskStats()
+            return stats
+
+    def instance(self, instance_id, task_name):
+        try:
+            instance = self.open[instance_id]
+        except KeyError:
+            instance = self.open[instance_id] = dict(
+                task = task_name,
+                start = None,
+                end = None,
+                failed = False,
+            )
+        instance['seen'] = time.time()
+        return instance
+
+    def close_if_complete(self, instance_id):
+        instance = self.open[instance_id]
+        if instance['start'] is None or instance['end'] is None:
+            return
+        del self.open[instance_id]
+        seconds = max(0.0, instance['end'] - instance['start'])
+        self.task_stats(instance['task']).add_run(seconds, instance['failed'])
+        self.closed[instance_id] = dict(task=instance['task'], failed=instance['failed'])
+        while len(self.closed) > max_closed_instances:
+            self.closed.popitem(last=False)
+
+    def mark_failed(self, instance_id, task_name):
+        closed = self.closed.get(instance_id)
+        if closed is None:
+            self.instance(instance_id, task_name)['failed'] = True
+        elif not closed['failed']:
+            # After the completion event, the run is already counted.
+            closed['failed'] = True
+            self.task_stats(closed['task']).failures += 1
+
+    def add(self, event):
+        """
+        Add an event_record dict. Events of other IDs are ignored.
+        """
+        data = event['data']
+        task_name = data.get('TaskName')
+        if not task_name:
+            return
+        event_id = event['id']
+        instance_id = data.get('InstanceId') or data.get('TaskInstanceId')
+        if self.newest is None or event['time'] > self.newest:
+            self.newest = event['time']
+
+        if event_id == TASK_START_FAILED:
+            self.task_stats(task_name).start_failures += 1
+        elif event_id == LAUNCH_SKIPPED:
+            self.task_stats(task_name).skipped += 1
+        elif event_id in LAUNCH_QUEUED:
+            self.task_stats(task_name).queued += 1
+        elif event_id == INSTANCE_REPLACED:
+            self.task_stats(task_name).replaced += 1
+        elif instance_id and event_id in (TASK_STARTED, TASK_COMPLETED):
+            if instance_id in self.closed:
+                # Ingested again, from an export without record numbers.
+                return
+            instance = self.instance(instance_id, task_name)
+            instance['start' if event_id == TASK_STARTED else 'end'] = event['time']
+            self.close_if_complete(instance_id)
+        elif instance_id and event_id == ACTION_COMPLETED:
+            if data.get('ResultCode', '0') not in ('0', '0x0'):
+                self.mark_failed(instance_id, task_name)
+        elif instance_id and event_id == ACTION_START_FAILED:
+            self.mark_failed(instance_id, task_name)
+        elif instance_id and event_id == TASK_TERMINATED:
+            self.mark_failed(instance_id, task_name)
+            self.task_stats(task_name).terminated += 1
+
+    def ingest(self, events):
+        """
+        Add events newer than those of earlier ingests, by record number per
+        computer. Return the number of events added.
+        """
+        high_water = dict(self.high_water)
+        added = 0
+        for event in events:
+            record = event['record']
+            computer = event['computer']
+            if record is not None:
+                if record <= self.high_water.get(computer, -1):
+                    continue
+                if record > high_water.get(computer, -1):
+                    high_water[computer] = record
+            self.add(event)
+            added += 1
+        # Only raised after the whole export, its events may be in any
+        # order.
+        self.high_water = high_water
+        return added
+
+    def drop_stale(self):
+        """
+        Drop open instances with no event ingested for max_open_seconds.
+        Return how many were dropped.
+        """
+        cutoff = time.time() - self.max_open_seconds
+        stale = [
+            instance_id for instance_id, instance in self.open.items()
+            if instance['seen'] < cutoff
+        ]
+        for instance_id in stale:
+            del self.open[instance_id]
+        return len(stale)
+
+    def summary(self):
+        """
+        Dict of task name to TaskStats.summary.
+        """
+        return {task_name: stats.summary() for task_name, stats in self.tasks.items()}
+
+    def to_dict(self):
+        return dict(
+            version = store_version,
+            high_water = self.high_water,
+            newest = self.newest,
+            open = self.open,
+            closed = self.closed,
+            tasks = {task_name: stats.to_dict() for task_name, stats in self.tasks.items()},
+        )
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        if data.get('version') != store_version:
+            raise ValueError(f'Unsupported history store version {data.get("version")!r}.')
+        history = cls(**kwargs)
+        history.high_water = data['high_water']
+        history.newest = data['newest']
+        history.open = data['open']
+        for instance in history.open.values():
+            # Stores written before ingest times were kept.
+            instance.setdefault('seen', time.time())
+        history.closed = collections.OrderedDict(data.get('closed', {}))
+        history.tasks = {
+            task_name: TaskStats.from_dict(stats)
+            for task_name, stats in data['tasks'].items()
+        }
+        return history
+
+    def save(self, path):
+        self.drop_stale()
+        metrics.write_atomic(path, json.dumps(self.to_dict()), suffix='.json.tmp')
+
+
+def load(path, **kwargs):
+    """
+    History from a store written by History.save, or a new one if path
+    does not exist.
+    """
+    if not os.path.exists(path):
+        return History(**kwargs)
+    with open(path, encoding='utf-8') as store_file:
+        return History.from_dict(json.load(store_file), **kwargs)
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 60:
+        return f'{seconds:.1f}s'
+    if seconds < 3600:
+        return f'{seconds / 60:.1f}m'
+    return f'{seconds / 3600:.1f}h'
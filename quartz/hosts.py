@@ -0,0 +1,206 @@
+"""
+Running commands against remote hosts with `schtasks /s HOST [/u /p]`.
+
+The host a thread or task targets is held in a context variable, so that
+schtasks commands built under `targeting` go to that host.
+"""
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import io
+import sys
+import threading
+
+Remote = collections.namedtuple('Remote', ['host', 'user', 'password'])
+Remote.__new__.__defaults__ = (None, None)
+
+target = contextvars.ContextVar('target', default=None)
+
+def remote_args():
+    """
+    schtasks arguments for the targeted host, empty for the local machine.
+    """
+    remote = target.get()
+    if remote is None:
+        return []
+    args = ['/s', remote.host]
+    if remote.user:
+        args.extend(['/u', remote.user])
+        if remote.password:
+            args.extend(['/p', remote.password])
+    return args
+
+# Options whose value is a password.
+password_options = ('/p', '/rp')
+
+redacted_password = '********'
+
+def redact(command):
+    """
+    Copy of a command, list or string, with passwords replaced, for output
+    and logs: the values of password_options and the targeted host's
+    password.
+    """
+    remote = target.get()
+    password = remote.password if remote is not None else None
+
+    def redact_arg(arg):
+        if password and isinstance(arg, str):
+            return arg.replace(password, redacted_password)
+        return arg
+
+    if isinstance(command, str):
+        return redact_arg(command)
+    redacted = []
+    after_option = False
+    for arg in command:
+        redacted.append(redacted_password if after_option else redact_arg(arg))
+        after_option = isinstance(arg, str) and arg.lower() in password_options
+    return redacted
+
+def redact_error(error):
+    """
+    Redact the command of a CalledProcessError or TimeoutExpired in place,
+    as their messages show it. Return the error.
+    """
+    if getattr(error, 'cmd', None) is not None:
+        error.cmd = redact(error.cmd)
+    return error
+
+def current_host():
+    remote = target.get()
+    if remote is not None:
+        return remote.host
+
+def is_remote():
+    return target.get() is not None
+
+@contextlib.contextmanager
+def targeting(remote):
+    """
+    Context manager targeting schtasks commands at remote, a Remote or None.
+    """
+    token = target.set(remote)
+    try:
+        yield remote
+    finally:
+        target.reset(token)
+
+def parse_hosts_file(lines, user=None, password=None):
+    """
+    Remote for each "HOST [USER [PASSWORD]]" line, skipping blank lines and
+    # comments. user and password are defaults for lines without them.
+    """
+    remotes = []
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        host, *credentials = line.split()
+        credentials += [None] * (2 - len(credentials))
+        remotes.append(Remote(host, credentials[0] or user, credentials[1] or password))
+    return remotes
+
+def remotes_from_args(args):
+    """
+    List of Remote from --host and --hosts-file arguments.
+    """
+    remotes = []
+    for host_arg in args.host or ():
+        for host in host_arg.split(','):
+            if host.strip():
+                remotes.append(Remote(host.strip(), args.remote_user, args.remote_password))
+    if args.hosts_file:
+        with open(args.hosts_file) as hosts_file:
+            remotes.extend(parse_hosts_file(hosts_file, args.remote_user, args.remote_password))
+    return remotes
+
+
+class ThreadOutput(io.TextIOBase):
+    """
+    Stand-in for sys.stdout that writes to the current thread's buffer, if it
+    has one, so concurrent hosts' output can be printed per host.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    @contextlib.contextmanager
+    def capture(self):
+        self.local.buffer = io.StringIO()
+        try:
+            yield self.local.buffer
+        finally:
+            self.local.buffer = None
+
+
+HostResult = collections.namedtuple(
+    'HostResult',
+    ['remote', 'output', 'result', 'error'],
+)
+
+def fan_out(func, remotes, workers=8, on_result=None):
+    """
+    Call func() once per remote, concurrently on up to `workers` hosts, with
+    schtasks commands targeted at that host. Return list of HostResult in
+    completion order. An exception fails only its host.
+
+    :param on_result:
+        Optional callable given each HostResult as it completes.
+    """
+    stdout = sys.stdout
+    thread_output = ThreadOutput(stdout)
+    sys.stdout = thread_output
+
+    def run(remote):
+        with thread_output.capture() as buffer, targeting(remote):
+            try:
+                result = func()
+            except Exception as e:
+                return HostResult(remote, buffer.getvalue(), None, e)
+            return HostResult(remote, buffer.getvalue(), result, None)
+
+    results = []
+    try:
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            futures = [
+                pool.submit(contextvars.copy_context().run, run, remote)
+                for remote in remotes
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                host_result = future.result()
+                results.append(host_result)
+                if on_result is not None:
+                    on_result(host_result)
+    finally:
+        sys.stdout = stdout
+    return results
+
+def print_host_result(host_result, file=None):
+    """
+    Print one host's output under a header.
+    """
+    if file is None:
+        file = sys.stdout
+    host = host_result.remote.host
+    if host_result.error is None:
+        print(f'== {host}', file=file)
+    else:
+        with targeting(host_result.remote):
+            error = redact_error(host_result.error)
+        print(f'== {host}: failed: {type(error).__name__}: {error}', file=file)
+    if host_result.output:
+        file.write(host_result.output)
+        if not host_result.output.endswith('\n'):
+            file.write('\n')
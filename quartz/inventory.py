@@ -0,0 +1,173 @@
+"""
+In-memory inventory of registered tasks, kept warm for repeated queries.
+"""
+import concurrent.futures
+import logging
+import threading
+import time
+
+from . import const
+from . import schtasks
+from . import utils
+
+task_namespace = '{http://schemas.microsoft.com/windows/2004/02/mit/task}'
+
+class Coalescer:
+    """
+    Run a call once for concurrent callers with the same key. Callers that
+    arrive while it runs wait for, and share, its result.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def run(self, key, func):
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = concurrent.futures.Future()
+        if not owner:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+
+class Inventory:
+    """
+    Registered tasks from a listing plus their parsed XML, refreshed on
+    demand or in the background.
+    """
+
+    def __init__(
+        self,
+        backend = schtasks,
+        max_age = 30,
+        with_xml = True,
+        xml_max_age = 300,
+        xml_workers = 4,
+    ):
+        """
+        :param backend:
+            Object with get_tasks and get_xml like the schtasks module, or a
+            fake.FakeScheduler.
+        :param max_age:
+            Seconds a listing is used before refreshing it.
+        :param with_xml:
+            Fetch and parse each task's XML when refreshing.
+        :param xml_max_age:
+            Seconds before fetching a task's XML again.
+        """
+        self.backend = backend
+        self.max_age = max_age
+        self.with_xml = with_xml
+        self.xml_max_age = xml_max_age
+        self.xml_workers = xml_workers
+        self.logger = logging.getLogger(const.APPNAME)
+        # Casefolded task name to entry dict with "row", "xml" and "xml_at".
+        self.tasks = {}
+        self.refreshed_at = None
+        self.refreshes = 0
+        self.coalescer = Coalescer()
+
+    def age(self):
+        if self.refreshed_at is None:
+            return None
+        return time.monotonic() - self.refreshed_at
+
+    def fetch_xml(self, task_name):
+        root = self.backend.get_xml(task_name)
+        return utils.xml_to_dict(root, unprefix=task_namespace)
+
+    def _refresh(self):
+        tasks = {}
+        for row in self.backend.get_tasks():
+            key = schtasks.normalize_task_name(row['TaskName']).casefold()
+            previous = self.tasks.get(key)
+            entry = dict(row=dict(row), xml=None, xml_at=None)
+            if previous is not None:
+                entry['xml'] = previous['xml']
+                entry['xml_at'] = previous['xml_at']
+            tasks[key] = entry
+
+        if self.with_xml:
+            now = time.monotonic()
+            stale = [
+                entry for entry in tasks.values()
+                if entry['xml_at'] is None or now - entry['xml_at'] > self.xml_max_age
+            ]
+            with concurrent.futures.ThreadPoolExecutor(self.xml_workers) as pool:
+                futures = {
+                    pool.submit(self.fetch_xml, entry['row']['TaskName']): entry
+                    for entry in stale
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    entry = futures[future]
+                    try:
+                        entry['xml'] = future.result()
+                    except Exception:
+                        # Deleted since listing, or not readable.
+                        continue
+                    entry['xml_at'] = now
+
+        # Swap in whole, readers never see a partial inventory.
+        self.tasks = tasks
+        self.refreshed_at = time.monotonic()
+        self.refreshes += 1
+        return tasks
+
+    def refresh(self):
+        """
+        Refresh now, or wait for the refresh already running.
+        """
+        return self.coalescer.run('refresh', self._refresh)
+
+    def snapshot(self, max_age=None):
+        """
+        Dict of casefolded name to entry, refreshed if older than max_age.
+        """
+        if max_age is None:
+            max_age = self.max_age
+        age = self.age()
+        if age is None or age > max_age:
+            return self.refresh()
+        return self.tasks
+
+    def get(self, task_name, max_age=None):
+        """
+        Entry for a task name, or None.
+        """
+        key = schtasks.normalize_task_name(task_name).casefold()
+        return self.snapshot(max_age).get(key)
+
+    def invalidate(self, task_names=None):
+        """
+        Mark the listing stale, and the XML of task_names.
+        """
+        self.refreshed_at = None
+        for task_name in task_names or ():
+            key = schtasks.normalize_task_name(task_name).casefold()
+            entry = self.tasks.get(key)
+            if entry is not None:
+                entry['xml_at'] = None
+
+    def refresh_forever(self, interval, stop_event):
+        """
+        Refresh every interval seconds until stop_event is set.
+        """
+        while not stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                self.logger.exception('Inventory refresh failed')
+            stop_event.wait(interval)
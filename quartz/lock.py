@@ -0,0 +1,407 @@
+"""
+Inter-process lock of the commands that change the tasks of a host, and
+coalescing of queued updates.
+
+A lock is a file created exclusively in the lock directory, holding the
+PID of its owner. A lock whose owner is no longer running is stale, and is
+broken by the next process that wants it.
+
+Updates waiting for a lock queue a request file next to it. Whoever gets the
+lock applies every compatible queued request at once, with the union of
+their task names, and leaves each waiting process the result instead of it
+applying again.
+"""
+import contextlib
+import json
+import os
+import re
+import socket
+import tempfile
+import time
+import uuid
+
+from . import const
+
+LOCKDIRVAR = const.APPNAME.upper() + '_LOCK_DIR'
+
+default_poll_interval = 0.2
+
+# Seconds after which a lock file without an owner, left by a process that
+# stopped between creating and writing it, is stale.
+unwritten_stale_seconds = 10
+
+class LockTimeout(Exception):
+    pass
+
+
+class CoalescedApplyError(Exception):
+    """
+    The process that applied a queued request failed.
+    """
+
+
+def lock_directory():
+    """
+    The lock directory from the environment variable, or a quartz\\locks
+    folder of ProgramData, or else of the temporary directory.
+    """
+    directory = os.environ.get(LOCKDIRVAR)
+    if not directory:
+        base = os.environ.get('ProgramData') or tempfile.gettempdir()
+        directory = os.path.join(base, const.APPNAME, 'locks')
+    return directory
+
+def lock_name(host=None):
+    """
+    File name safe lock name of a host, None for the local host.
+    """
+    return re.sub(r'[^\w.-]', '_', (host or 'localhost').casefold())
+
+def pid_alive(pid):
+    """
+    Whether a process with pid is running on this machine.
+    """
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        ERROR_ACCESS_DENIED = 5
+        STILL_ACTIVE = 259
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            # Running as another user.
+            return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return True
+            return exit_code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def read_json(path):
+    """
+    Data of a JSON file, or None if it is missing or not written yet.
+    """
+    try:
+        with open(path, encoding='utf-8') as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+def write_json(path, data):
+    """
+    Write a JSON file atomically, readers never see it partly written.
+    """
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as json_file:
+        json.dump(data, json_file)
+    os.replace(temp_path, path)
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class HostLock:
+    """
+    Exclusive lock, across processes, named for a host.
+
+        with HostLock(lock_name(hosts.current_host())):
+            ...
+    """
+
+    def __init__(
+        self,
+        name,
+        directory = None,
+        timeout = None,
+        poll_interval = default_poll_interval,
+    ):
+        """
+        :param directory:
+            Lock directory, default lock_directory().
+        :param timeout:
+            Seconds to wait for the lock before raising LockTimeout, default
+            forever.
+        """
+        if directory is None:
+            directory = lock_directory()
+        self.name = name
+        self.directory = directory
+        self.path = os.path.join(directory, name + '.lock')
+        self.breaking_path = self.path + '.breaking'
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.token = None
+
+    def owner(self):
+        """
+        Dict of pid, machine and token of the lock's owner, or None.
+        """
+        return read_json(self.path)
+
+    def try_acquire(self):
+        """
+        Take the lock if it is free or stale. Return whether it was taken.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        token = uuid.uuid4().hex
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            if self.break_stale():
+                return self.try_acquire()
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as lock_file:
+            json.dump(
+                dict(
+                    pid = os.getpid(),
+                    machine = socket.gethostname(),
+                    token = token,
+                    acquired = time.time(),
+                ),
+                lock_file,
+            )
+        self.token = token
+        return True
+
+    def is_stale(self, owner):
+        """
+        Whether the lock with owner, its data or None if unwritten, is left
+        by a process that is no longer running.
+        """
+        if owner is None:
+            try:
+                age = time.time() - os.path.getmtime(self.path)
+            except OSError:
+                return False
+            return age >= unwritten_stale_seconds
+        # Processes of another machine sharing the directory cannot be
+        # checked.
+        return owner.get('machine') == socket.gethostname() and not pid_alive(owner['pid'])
+
+    def take_breaking(self):
+        """
+        Create the lock's .breaking file, held while breaking it, so that a
+        process cannot move away the lock another took after breaking it.
+        Return whether it was created.
+        """
+        try:
+            fd = os.open(self.breaking_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            try:
+                age = time.time() - os.path.getmtime(self.breaking_path)
+            except OSError:
+                return False
+            if age >= unwritten_stale_seconds:
+                # Left by a process that stopped while breaking, which takes
+                # an instant.
+                remove_file(self.breaking_path)
+            return False
+        os.close(fd)
+        return True
+
+    def break_stale(self):
+        """
+        Remove the lock if its owner is not running. Return whether it was
+        removed.
+
+        The lock is moved to a unique name, and only removed if the moved
+        file's owner is still not running. The caller then creates the lock
+        anew, exclusively.
+        """
+        if not self.is_stale(self.owner()):
+            return False
+        if not self.take_breaking():
+            return False
+        try:
+            # Checked again, it may have been broken and taken before the
+            # .breaking file was.
+            owner = self.owner()
+            if not self.is_stale(owner):
+                return False
+            stale_path = f'{self.path}.{uuid.uuid4().hex}.stale'
+            try:
+                os.replace(self.path, stale_path)
+            except OSError:
+                return False
+            moved = read_json(stale_path)
+            if moved is not None and not self.is_stale(moved):
+                # An unwritten lock whose owner wrote it since, give it back.
+                with contextlib.suppress(OSError):
+                    os.link(stale_path, self.path)
+                os.remove(stale_path)
+                return False
+            os.remove(stale_path)
+            return True
+        finally:
+            remove_file(self.breaking_path)
+
+    def acquire(self):
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+        while not self.try_acquire():
+            if deadline is not None and time.monotonic() >= deadline:
+                owner = self.owner() or {}
+                raise LockTimeout(
+                    f'Lock {self.path} held by process {owner.get("pid")}'
+                    f' for more than {self.timeout} seconds'
+                )
+            time.sleep(self.poll_interval)
+
+    def release(self):
+        owner = self.owner()
+        if owner is not None and owner.get('token') == self.token:
+            remove_file(self.path)
+        self.token = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def union_task_names(requests):
+    """
+    Union of the task_names of requests, None if any is None, for all tasks.
+    """
+    names = set()
+    for request in requests:
+        if request['task_names'] is None:
+            return None
+        names.update(request['task_names'])
+    return sorted(names)
+
+
+class Coalescer:
+    """
+    Apply requests under a HostLock, together with the compatible requests
+    queued by other processes.
+    """
+
+    def __init__(self, host_lock):
+        self.lock = host_lock
+        self.queue_directory = host_lock.path + '.queue'
+
+    def _claim(self, key):
+        """
+        Claim the queued requests with key. Return list of (path stem,
+        request).
+        """
+        claimed = []
+        for filename in sorted(os.listdir(self.queue_directory)):
+            stem, extension = os.path.splitext(filename)
+            path = os.path.join(self.queue_directory, filename)
+            if extension == '.done':
+                # Results of processes that stopped waiting.
+                pid = int(stem.split('-', 1)[0])
+                if not pid_alive(pid):
+                    remove_file(path)
+                continue
+            # Claimed but not done is left by a holder that failed.
+            if extension not in ('.json', '.claimed'):
+                continue
+            request = read_json(path)
+            if request is None or request['key'] != key:
+                continue
+            stem = os.path.join(self.queue_directory, stem)
+            if not pid_alive(request['pid']):
+                remove_file(path)
+                continue
+            if extension == '.json':
+                os.replace(path, stem + '.claimed')
+            claimed.append((stem, request))
+        return claimed
+
+    def _apply_queued(self, key, own_stem, apply):
+        claimed = self._claim(key)
+        requests = [request for _, request in claimed]
+        task_names = union_task_names(requests)
+        result = dict(pid=os.getpid(), requests=len(requests), task_names=task_names)
+        try:
+            counts = apply(task_names)
+        except BaseException as error:
+            result.update(ok=False, error=f'{type(error).__name__}: {error}')
+            raise
+        else:
+            result.update(ok=True, counts=dict(counts))
+            return result
+        finally:
+            for stem, _ in claimed:
+                if stem != own_stem:
+                    write_json(stem + '.done', result)
+                remove_file(stem + '.claimed')
+
+    def apply(self, key, task_names, apply):
+        """
+        Queue a request and wait for it to be applied, by this process if it
+        gets the lock first. Return the result dict of the process that
+        applied it, with its "pid", "ok", "counts", the number of
+        "requests" applied at once and the union of their "task_names".
+
+        :param key:
+            JSON data of the options besides task names, only requests with
+            equal keys are applied together.
+        :param task_names:
+            List of task names or wildcards, or None for all tasks.
+        :param apply:
+            Callable taking task names, or None, applying them and returning
+            a mapping of counts.
+        """
+        os.makedirs(self.queue_directory, exist_ok=True)
+        key = json.loads(json.dumps(key))
+        pid = os.getpid()
+        own_stem = os.path.join(self.queue_directory, f'{pid}-{uuid.uuid4().hex}')
+        write_json(own_stem + '.json', dict(pid=pid, key=key, task_names=task_names))
+        deadline = None
+        if self.lock.timeout is not None:
+            deadline = time.monotonic() + self.lock.timeout
+        try:
+            while True:
+                result = self._done(own_stem)
+                if result is not None:
+                    return result
+                if self.lock.try_acquire():
+                    try:
+                        # Applied by the holder that just released.
+                        result = self._done(own_stem)
+                        if result is not None:
+                            return result
+                        return self._apply_queued(key, own_stem, apply)
+                    finally:
+                        self.lock.release()
+                if deadline is not None and time.monotonic() >= deadline:
+                    owner = self.lock.owner() or {}
+                    raise LockTimeout(
+                        f'Lock {self.lock.path} held by process'
+                        f' {owner.get("pid")} for more than'
+                        f' {self.lock.timeout} seconds'
+                    )
+                time.sleep(self.lock.poll_interval)
+        finally:
+            remove_file(own_stem + '.json')
+
+    def _done(self, stem):
+        result = read_json(stem + '.done')
+        if result is None:
+            return None
+        remove_file(stem + '.done')
+        if not result['ok']:
+            raise CoalescedApplyError(
+                f'Process {result["pid"]} applying this request failed:'
+                f' {result["error"]}'
+            )
+        return result
@@ -0,0 +1,189 @@
+"""
+Prometheus textfile collector output for update and lsconf --check runs.
+"""
+import os
+import re
+import tempfile
+import time
+
+from . import executor
+
+prefix = 'quartz'
+
+def escape_label(value):
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\n', '\\n')
+        .replace('"', '\\"')
+    )
+
+def format_labels(labels):
+    return ','.join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+
+class TextfileWriter:
+    """
+    Accumulate metric lines with their HELP and TYPE headers.
+    """
+
+    def __init__(self, base_labels):
+        self.base_labels = base_labels
+        self.lines = []
+        self.declared = set()
+
+    def declare(self, name, type_, help_):
+        if name not in self.declared:
+            self.declared.add(name)
+            self.lines.append(f'# HELP {prefix}_{name} {help_}')
+            self.lines.append(f'# TYPE {prefix}_{name} {type_}')
+
+    def add(self, name, value, suffix='', **labels):
+        labels = {**self.base_labels, **labels}
+        self.lines.append(f'{prefix}_{name}{suffix}{{{format_labels(labels)}}} {value}')
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+def previous_last_success(path, labels):
+    """
+    Last success timestamp for labels from an existing metrics file, so that
+    a failed run keeps it.
+    """
+    pattern = re.compile(
+        rf'^{prefix}_last_success_timestamp_seconds\{{{re.escape(format_labels(labels))}\}} (\S+)$'
+    )
+    try:
+        with open(path) as metrics_file:
+            for line in metrics_file:
+                match = pattern.match(line)
+                if match:
+                    return float(match.group(1))
+    except (OSError, ValueError):
+        pass
+
+def host_path(path, host):
+    """
+    Metrics file of a host: path formatted with host, or against a remote
+    host with the host before the extension, so that the hosts of a fan out
+    do not overwrite one file.
+
+    :param host:
+        Targeted host, None for the local host.
+    """
+    if '{host}' in path:
+        return path.format(host=host or 'localhost')
+    if host is None:
+        return path
+    root, extension = os.path.splitext(path)
+    host = re.sub(r'[^\w.-]', '_', host)
+    return f'{root}.{host}{extension}'
+
+def write_atomic(path, text, suffix='.prom.tmp'):
+    """
+    Write text to path through a temp file in the same directory, so that the
+    collector never reads a partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix=suffix)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as temp_file:
+            temp_file.write(text)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def write_textfile(
+    path,
+    config,
+    command,
+    task_counts,
+    phases,
+    success,
+    duration,
+    subprocesses = None,
+    concurrency = None,
+    host = None,
+):
+    """
+    Write the metrics of a run to path.
+
+    :param config:
+        Config module name, a label on every metric.
+    :param command:
+        Subcommand name, a label on every metric.
+    :param task_counts:
+        Dict of state, like "configured" or "failed", to number of tasks.
+    :param phases:
+        Dict of phase name to seconds.
+    :param success:
+        Whether the run succeeded, updating the last success timestamp.
+    :param duration:
+        Seconds the run took.
+    :param subprocesses:
+        executor metrics summary. Defaults to the default executor's.
+    :param concurrency:
+        executor concurrency summary. Defaults to the default executor's,
+        None without adaptive concurrency.
+    :param host:
+        Targeted host, a label on every metric, None for the local host.
+    """
+    if subprocesses is None:
+        subprocesses = executor.metrics_summary()
+    if concurrency is None:
+        concurrency = executor.concurrency_summary()
+    base_labels = dict(config=config, command=command, host=host or 'localhost')
+    writer = TextfileWriter(base_labels)
+
+    writer.declare('tasks', 'gauge', 'Number of tasks by state in the last run.')
+    for state, count in sorted(task_counts.items()):
+        writer.add('tasks', count, state=state)
+
+    writer.declare('phase_duration_seconds', 'gauge', 'Seconds spent in each phase of the last run.')
+    for phase, seconds in sorted(phases.items()):
+        writer.add('phase_duration_seconds', f'{seconds:.6f}', phase=phase)
+
+    writer.declare('run_duration_seconds', 'gauge', 'Seconds the last run took.')
+    writer.add('run_duration_seconds', f'{duration:.6f}')
+
+    # Each metric family's samples must be together.
+    counters = [
+        ('subprocess_calls', 'count', 'Commands run in the last run by kind.'),
+        ('subprocess_failures', 'failures', 'Failed commands in the last run by kind.'),
+        ('subprocess_timeouts', 'timeouts', 'Commands killed on timeout in the last run by kind.'),
+        ('subprocess_retries', 'retries', 'Retries of failed commands in the last run by kind.'),
+    ]
+    for name, key, help_ in counters:
+        writer.declare(name, 'gauge', help_)
+        for kind, data in subprocesses.items():
+            writer.add(name, data[key], kind=kind)
+
+    writer.declare('subprocess_duration_seconds', 'histogram', 'Latency of commands in the last run by kind.')
+    for kind, data in subprocesses.items():
+        cumulative = 0
+        for bound, count in data['buckets'].items():
+            cumulative += count
+            writer.add('subprocess_duration_seconds', cumulative, '_bucket', kind=kind, le=bound)
+        writer.add('subprocess_duration_seconds', f'{data["total_seconds"]:.6f}', '_sum', kind=kind)
+        writer.add('subprocess_duration_seconds', data['count'], '_count', kind=kind)
+
+    if concurrency is not None:
+        writer.declare('subprocess_concurrency_limit', 'gauge', 'Adaptive limit of concurrent commands at the end of the last run.')
+        writer.add('subprocess_concurrency_limit', concurrency['limit'])
+        writer.declare('subprocess_concurrency_backoffs', 'gauge', 'Times the adaptive limit backed off in the last run.')
+        writer.add('subprocess_concurrency_backoffs', concurrency['backoffs'])
+
+    now = time.time()
+    writer.declare('last_run_timestamp_seconds', 'gauge', 'Unix time of the last run.')
+    writer.add('last_run_timestamp_seconds', f'{now:.3f}')
+    writer.declare('last_run_success', 'gauge', 'Whether the last run succeeded.')
+    writer.add('last_run_success', int(success))
+    if success:
+        last_success = now
+    else:
+        last_success = previous_last_success(path, base_labels)
+    if last_success is not None:
+        writer.declare('last_success_timestamp_seconds', 'gauge', 'Unix time of the last successful run.')
+        writer.add('last_success_timestamp_seconds', f'{last_success:.3f}')
+
+    write_atomic(path, writer.text())
@@ -1,35 +1,229 @@
 import abc
 import datetime
+import functools
+import hashlib
 import os
+import types
+import weakref
 
 from . import const
 from . import validate
 
+# Attribute value types that are already hashable and immutable.
+_atomic_types = frozenset([
+    type(None),
+    bool,
+    int,
+    float,
+    str,
+    datetime.date,
+    datetime.datetime,
+    datetime.time,
+    datetime.timedelta,
+])
+
+def _freeze(val):
+    """
+    Hashable stand-in for an attribute value. Model instances are expected to
+    have been interned already, so they compare by identity.
+    """
+    class_ = type(val)
+    if class_ in _atomic_types or isinstance(val, Base):
+        return val
+    if class_ is list or class_ is tuple:
+        return tuple(map(_freeze, val))
+    if class_ is dict or class_ is types.MappingProxyType:
+        return tuple(sorted((key, _freeze(item)) for key, item in val.items()))
+    if class_ is set:
+        return frozenset(val)
+    return val
+
+def _stable(val):
+    """
+    Representation of a structural key that does not depend on object
+    identity or the process, for hashing.
+    """
+    if isinstance(val, type):
+        return f'{val.__module__}.{val.__qualname__}'
+    if isinstance(val, Base):
+        return val.structural_hash()
+    if isinstance(val, (tuple, frozenset)):
+        if isinstance(val, frozenset):
+            val = sorted(val)
+        return tuple(map(_stable, val))
+    return val
+
+def _plain(val):
+    if isinstance(val, Base):
+        return val.to_dict()
+    if isinstance(val, list):
+        return [_plain(item) for item in val]
+    if isinstance(val, types.MappingProxyType):
+        return {key: _plain(item) for key, item in val.items()}
+    return val
+
+def _generate_method(name, fields, body_template, joiner, wrap):
+    """
+    Generate a method over a fixed list of slot names, instead of walking the
+    instance's attributes at call time.
+    """
+    items = joiner.join(body_template.format(field=field) for field in fields)
+    source = f'def {name}(self):\n    return {wrap.format(items=items)}\n'
+    namespace = {'_freeze': _freeze, '_plain': _plain}
+    exec(source, namespace)
+    return namespace[name]
+
+# Shared instances by structural key. See `intern`. Weak, so that objects
+# of tasks that are gone, from a generated configuration, are not kept.
+_interned = weakref.WeakValueDictionary()
+
+def intern(instance):
+    """
+    Return the shared instance that is structurally identical to `instance`,
+    registering `instance` as that shared instance if there is none yet.
+    Interned objects are shared between tasks, they are frozen: setting an
+    attribute raises AttributeError, use `Base.replace` for a changed copy.
+    Dict attributes, like `Trigger.schedule_by_day`, become read-only views
+    of a copy, so the caller's dict can change without changing them.
+    """
+    try:
+        shared = _interned.setdefault(instance.structural_key(), instance)
+    except TypeError:
+        # Unhashable attribute value, keep the instance to itself.
+        return instance
+    if shared.__class__ is shared._model_class:
+        for field in shared._fields:
+            value = getattr(shared, field)
+            if type(value) is dict:
+                object.__setattr__(shared, field, types.MappingProxyType(dict(value)))
+        shared.__class__ = shared._frozen_class
+    return shared
+
+def clear_interned():
+    """
+    Forget all shared instances.
+    """
+    _interned.clear()
+    default.cache_clear()
+
+@functools.cache
+def default(class_):
+    """
+    Shared instance of `class_` constructed with its default arguments.
+    """
+    return intern(class_())
+
+
+def _frozen_setattr(self, name, value):
+    raise AttributeError(f'{type(self).__name__} is interned and cannot be changed')
+
+def _frozen_delattr(self, name):
+    raise AttributeError(f'{type(self).__name__} is interned and cannot be changed')
+
+
 class Base(abc.ABC):
     """
     Base for all scheduled task objects.
+
+    Subclasses declare their attributes in `__slots__`. The `to_dict` and
+    `structural_key` methods are generated from those names when the subclass
+    is created.
     """
 
+    __slots__ = (
+        '_structural_hash',
+        '__weakref__',
+    )
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if '_frozen_twin' in cls.__dict__:
+            return
+        fields = []
+        for class_ in reversed(cls.__mro__):
+            for field in class_.__dict__.get('__slots__', ()):
+                if not field.startswith('_') and field not in fields:
+                    fields.append(field)
+        cls._fields = tuple(fields)
+        if 'to_dict' not in cls.__dict__:
+            cls.to_dict = _generate_method(
+                'to_dict',
+                fields,
+                body_template = '{field!r}: _plain(self.{field})',
+                joiner = ', ',
+                wrap = '{{{items}}}',
+            )
+        if 'structural_key' not in cls.__dict__:
+            cls.structural_key = _generate_method(
+                'structural_key',
+                fields,
+                body_template = '_freeze(self.{field})',
+                joiner = ', ',
+                wrap = '(self._model_class, {items})',
+            )
+        cls._model_class = cls
+        cls._frozen_class = type(cls)(cls.__name__, (cls, ), {
+            '__slots__': (),
+            '__module__': cls.__module__,
+            '__qualname__': cls.__qualname__,
+            '__setattr__': _frozen_setattr,
+            '__delattr__': _frozen_delattr,
+            '_frozen_twin': True,
+        })
+
     def to_dict(self):
         """
-        Return dict of all non-private, non-callable attributes.
+        Return dict of all non-private attributes.
         """
-        data = {}
-        for key, val in self.__dict__.items():
-            if key.startswith('_') or callable(val):
-                continue
+        return {}
 
-            if hasattr(val, 'to_dict'):
-                val = val.to_dict()
-
-            data[key] = val
+    def structural_key(self):
+        """
+        Return a hashable key of the type and attribute values.
+        """
+        return (self._model_class, )
 
-        return data
+    def replace(self, **changes):
+        """
+        Return a copy of the same class with changed attribute values. The
+        copy is made without calling __init__, whose arguments differ in
+        subclasses like EveryMinutes.
+        """
+        unknown = set(changes).difference(self._fields)
+        if unknown:
+            raise TypeError(f'{type(self).__name__} has no attributes {sorted(unknown)}')
+        copy = object.__new__(self._model_class)
+        for field in self._fields:
+            object.__setattr__(copy, field, changes.get(field, getattr(self, field)))
+        return copy
+
+    def structural_hash(self):
+        """
+        Return a hex digest of `structural_key` that is stable between runs.
+        Computed once, instances are treated as immutable after their first
+        use.
+        """
+        try:
+            return self._structural_hash
+        except AttributeError:
+            key = _stable(self.structural_key())
+            digest = hashlib.sha1(repr(key).encode()).hexdigest()
+            # Also cached on frozen instances.
+            object.__setattr__(self, '_structural_hash', digest)
+            return digest
 
     @abc.abstractmethod
     def validate(self, **kwargs):
         """
-        Validate the values of this instance's attributes.
+        Validate the values of this instance's attributes, raising ValueError
+        for the first invalid one.
+
+        :param file_exists:
+            Check that paths exist.
+        :param stat_cache:
+            Optional validate.StatCache for the path checks.
+        :param recurse:
+            Validate the objects held by this one too. Default True.
         """
 
     @abc.abstractmethod
@@ -39,6 +233,17 @@ class Base(abc.ABC):
 
 class Task(Base):
 
+    __slots__ = (
+        'name',
+        'author',
+        'description',
+        'actions',
+        'triggers',
+        'settings',
+        'registration_date',
+        'security_options',
+    )
+
     def __init__(
         self,
         name,
@@ -67,22 +272,26 @@ class Task(Base):
             The created date.
         :param security_options:
             A SecurityOptions object. Defaults to that object's defaults.
+
+        Actions, triggers, settings and security options are interned, so
+        tasks configured alike share the same objects.
         """
         self.name = name
         self.author = author
         self.description = description
         if actions is None:
             actions = []
-        self.actions = actions
+        self.actions = [intern(action) for action in actions]
         if triggers is None:
             triggers = []
-        self.triggers = triggers
+        self.triggers = [intern(trigger) for trigger in triggers]
         if settings is None:
-            settings = Settings()
-        self.settings = settings
+            settings = default(Settings)
+        self.settings = intern(settings)
+        self.registration_date = registration_date
         if security_options is None:
-            security_options = SecurityOptions()
-        self.security_options = security_options
+            security_options = default(SecurityOptions)
+        self.security_options = intern(security_options)
 
     @property
     def uri(self):
@@ -99,6 +308,12 @@ class Task(Base):
         return self.registration_date
 
     def validate(self, **kwargs):
+        if not self.name or not isinstance(self.name, str):
+            raise ValueError('Task name must be a non-empty string.')
+
+        if not kwargs.get('recurse', True):
+            return
+
         for action in self.actions:
             action.validate(**kwargs)
 
@@ -121,6 +336,13 @@ class Action(Base):
     An action to do when a scheduled task is triggered.
     """
 
+    __slots__ = (
+        'type_',
+        'command',
+        'arguments',
+        'working_directory',
+    )
+
     windows_venv_pythonw_args = ['venv', 'Scripts', 'pythonw.exe']
 
     def __init__(
@@ -165,8 +387,13 @@ class Action(Base):
             raise ValueError('Invalid action type.')
         # TODO
         # - a way to test the command without actually running it?
-        if kwargs.get('file_exists') and not os.path.exists(self.working_directory):
-            raise ValueError('Working directory does not exist.')
+        if kwargs.get('file_exists'):
+            stat_cache = kwargs.get('stat_cache') or validate.StatCache()
+            if not stat_cache.isdir(self.working_directory):
+                raise ValueError('Working directory does not exist.')
+            # Commands without a directory are found on PATH when run.
+            if os.path.isabs(self.command) and not stat_cache.isfile(self.command):
+                raise ValueError('Command does not exist.')
 
     def needs_admin(self):
         return False
@@ -174,6 +401,11 @@ class Action(Base):
 
 class IdleSettings(Base):
 
+    __slots__ = (
+        'stop_on_idle_end',
+        'restart_on_idle',
+    )
+
     def __init__(
         self,
         stop_on_idle_end = True,
@@ -196,6 +428,23 @@ class Settings(Base):
     Scheduled task settings.
     """
 
+    __slots__ = (
+        'multiple_instances_policy',
+        'disallow_start_if_on_batteries',
+        'stop_if_going_on_batteries',
+        'allow_hard_terminate',
+        'start_when_available',
+        'run_only_if_network_available',
+        'idle_settings',
+        'allow_start_on_demand',
+        'enabled',
+        'hidden',
+        'run_only_if_idle',
+        'wake_to_run',
+        'execution_time_limit',
+        'priority',
+    )
+
     def __init__(
         self,
         multiple_instances_policy = None,
@@ -242,8 +491,8 @@ class Settings(Base):
         self.start_when_available = start_when_available
         self.run_only_if_network_available = run_only_if_network_available
         if idle_settings is None:
-            idle_settings = IdleSettings()
-        self.idle_settings = idle_settings
+            idle_settings = default(IdleSettings)
+        self.idle_settings = intern(idle_settings)
         self.allow_start_on_demand = allow_start_on_demand
         self.enabled = enabled
         self.hidden = hidden
@@ -257,9 +506,10 @@ class Settings(Base):
     def validate(self, **kwargs):
         if self.multiple_instances_policy not in const.multiple_instances_policies:
             raise ValueError('Invalid multiple_instances_policy value.')
-        self.idle_settings.validate(**kwargs)
         if self.priority not in const.scheduled_task_priorities.values():
             raise ValueError('Invalid priority value.')
+        if kwargs.get('recurse', True):
+            self.idle_settings.validate(**kwargs)
 
     def needs_admin(self):
         return False
@@ -272,10 +522,15 @@ class SecurityOptions(Base):
     for running a task as a different user.
     """
 
+    __slots__ = (
+        'run_as_user',
+        'run_as_password',
+    )
+
     def __init__(
         self,
-        run_as_user,
-        run_as_password,
+        run_as_user = None,
+        run_as_password = None,
     ):
         """
         :param run_as_user:
@@ -286,6 +541,11 @@ class SecurityOptions(Base):
         self.run_as_user = run_as_user
         self.run_as_password = run_as_password
 
+    def __bool__(self):
+        # Falsey without a user so that the default does not trigger the
+        # change run as commands.
+        return self.run_as_user is not None
+
     def validate(self, **kwargs):
         # TODO
         pass
@@ -299,6 +559,12 @@ class Repetition(Base):
     Repetition for a trigger.
     """
 
+    __slots__ = (
+        'interval',
+        'duration',
+        'stop_at_duration_end',
+    )
+
     def __init__(
         self,
         interval,
@@ -319,7 +585,7 @@ class Repetition(Base):
         self.duration = duration
         self.stop_at_duration_end = stop_at_duration_end
 
-    def validate(self):
+    def validate(self, **kwargs):
         if not validate.iso8601_duration(self.interval):
             raise ValueError('Invalid interval value.')
         if not validate.iso8601_duration(self.duration):
@@ -334,6 +600,14 @@ class Trigger(Base):
     Event to trigger a scheduled task.
     """
 
+    __slots__ = (
+        'type_',
+        'repetition',
+        'start_boundary',
+        'enabled',
+        'schedule_by_day',
+    )
+
     def __init__(
         self,
         type_,
@@ -351,6 +625,8 @@ class Trigger(Base):
         :param schedule_by_day:
         """
         self.type_ = type_
+        if repetition is not None:
+            repetition = intern(repetition)
         self.repetition = repetition
         self.start_boundary = start_boundary
         self.enabled = enabled
@@ -359,6 +635,8 @@ class Trigger(Base):
     def validate(self, **kwargs):
         if self.type_ not in const.trigger_types:
             raise ValueError('Invalid trigger type.')
+        if self.repetition is not None and kwargs.get('recurse', True):
+            self.repetition.validate(**kwargs)
 
     def needs_admin(self):
         return False
@@ -366,6 +644,10 @@ class Trigger(Base):
 
 class LogonTrigger(Trigger):
 
+    __slots__ = (
+        'user_id',
+    )
+
     def __init__(
         self,
         user_id,
@@ -381,6 +663,8 @@ class EveryMinutes(Trigger):
     Trigger every n minutes every day.
     """
 
+    __slots__ = ()
+
     def __init__(
         self,
         start_boundary_date,
@@ -396,8 +680,10 @@ class EveryMinutes(Trigger):
         )
         start_boundary_dt = datetime.datetime.combine(
             start_boundary_date,
-            datetime.time(minute=start_boundary_offset_minutes)
+            datetime.time(),
         )
+        # Offsets can be past the first hour, for intervals longer than one.
+        start_boundary_dt += datetime.timedelta(minutes=start_boundary_offset_minutes)
         start_boundary = start_boundary_dt.isoformat(timespec='seconds')
         schedule_by_day = {
             'days_interval': '1',
@@ -408,6 +694,8 @@ class EveryMinutes(Trigger):
 
 class OnceDaily(Trigger):
 
+    __slots__ = ()
+
     def __init__(
         self,
         time,
@@ -435,6 +723,8 @@ class OnceDaily(Trigger):
 
 class BootTrigger(Trigger):
 
+    __slots__ = ()
+
     def __init__(
         self,
         **kwargs
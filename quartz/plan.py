@@ -0,0 +1,263 @@
+import collections
+import copy
+import json
+
+from lxml import etree
+
+from . import schtasks
+
+CREATE = 'create'
+OVERWRITE = 'overwrite'
+UNCHANGED = 'unchanged'
+DELETE = 'delete'
+
+actions = [CREATE, OVERWRITE, UNCHANGED, DELETE]
+
+PlanItem = collections.namedtuple(
+    'PlanItem',
+    ['action', 'task_name', 'task', 'task_xml'],
+)
+
+class EmptyPruneError(Exception):
+    """
+    Pruning was asked without any configured task, which would delete every
+    owned task.
+    """
+
+
+_schema_defaults = None
+
+def schema_defaults():
+    """
+    Dict of element local name to default value from the task schema.
+    schtasks leaves elements with default values out of the registered XML.
+    """
+    global _schema_defaults
+    if _schema_defaults is None:
+        ns = {'xs': 'http://www.w3.org/2001/XMLSchema'}
+        schema_doc = etree.parse(schtasks.schema_path)
+        _schema_defaults = {
+            element.attrib['name']: element.attrib['default']
+            for element in schema_doc.xpath('//xs:element[@default]', namespaces=ns)
+        }
+    return _schema_defaults
+
+def _normalized_text(element):
+    text = (element.text or '').strip()
+    if text in ('True', 'False'):
+        text = text.lower()
+    return text
+
+# Elements of settings only, that schtasks adds or leaves out when every
+# element in them has its default value.
+settings_containers = {'Settings', 'IdleSettings'}
+
+def is_default(element, defaults):
+    """
+    Return whether element means the same as leaving it out: an empty leaf,
+    a leaf with the schema default value, or settings all at their defaults.
+    """
+    children = [child for child in element if isinstance(child.tag, str)]
+    localname = etree.QName(element).localname
+    if children:
+        return (
+            localname in settings_containers
+            and all(is_default(child, defaults) for child in children)
+        )
+    text = _normalized_text(element)
+    return not text or defaults.get(localname) == text
+
+def xml_contains(expected, actual, defaults=None):
+    """
+    Return whether every element and text in `expected` is also in `actual`.
+    Missing elements match if they have default values, see is_default.
+    """
+    if defaults is None:
+        defaults = schema_defaults()
+    actual_children = collections.defaultdict(list)
+    for child in actual:
+        actual_children[child.tag].append(child)
+    for child in expected:
+        if not isinstance(child.tag, str):
+            # comments and processing instructions
+            continue
+        candidates = actual_children.get(child.tag)
+        if not candidates:
+            if not is_default(child, defaults):
+                return False
+            continue
+        # Consume the matched element, for repeated tags like triggers.
+        actual_child = candidates.pop(0)
+        if len(child) or len(actual_child):
+            if not xml_contains(child, actual_child, defaults):
+                return False
+        elif _normalized_text(child) != _normalized_text(actual_child):
+            return False
+    return True
+
+def xml_equivalent(expected, actual, defaults=None):
+    """
+    Return whether `expected` and `actual` have the same elements and text,
+    besides elements with default values, in both directions.
+    """
+    return (
+        xml_contains(expected, actual, defaults)
+        and xml_contains(actual, expected, defaults)
+    )
+
+def is_unchanged(task_xml, registered_root):
+    expected_root = etree.fromstring(task_xml.encode('utf-8'))
+    registered_root = copy.deepcopy(registered_root)
+    # RegistrationInfo is rewritten by schtasks on registration.
+    ignored = ['{*}RegistrationInfo']
+    if expected_root.find('{*}Principals') is None:
+        # Filled in with the registering user, see run_as for changes.
+        ignored.append('{*}Principals')
+    for root in (expected_root, registered_root):
+        for path in ignored:
+            for element in root.findall(path):
+                root.remove(element)
+    return xml_equivalent(expected_root, registered_root)
+
+def folder_of(task_name):
+    """
+    Normalized folder path of a task name.
+    """
+    folder, _ = schtasks.normalize_task_name(task_name).rsplit('\\', 1)
+    return folder or '\\'
+
+def owned_folders(config_module, configured_names):
+    """
+    Folders managed by the config. From QUARTZ_FOLDERS if present, otherwise
+    every folder that has a configured task, except the root folder, which
+    holds tasks of Windows and other programs and is only owned when listed
+    in QUARTZ_FOLDERS.
+    """
+    folders = getattr(config_module, 'QUARTZ_FOLDERS', None)
+    if folders is None:
+        folders = (
+            folder for folder in map(folder_of, configured_names)
+            if folder != '\\'
+        )
+    else:
+        folders = (schtasks.normalize_task_name(folder) for folder in folders)
+    return {folder.casefold() for folder in folders}
+
+def compute(
+    rendered,
+    listing,
+    configured_names,
+    prune = False,
+    folders = (),
+    get_xml = schtasks.get_xml,
+    allow_empty_prune = False,
+):
+    """
+    Return list of PlanItem from one listing snapshot, see plan_tasks and
+    plan_deletes.
+
+    :param rendered:
+        Iterable of (task, task_xml) pairs to apply.
+    :param listing:
+        Iterable of registered task names.
+    :param configured_names:
+        Names of all tasks in the config, not only those being applied.
+        Registered tasks with these names are never deleted.
+    :param prune:
+        Plan deleting registered tasks in `folders` that are not configured.
+    :param folders:
+        Set of casefolded folder paths owned by the config.
+    :param get_xml:
+        Callable returning the registered XML root for a task name.
+    :param allow_empty_prune:
+        Prune without configured tasks, see check_prune.
+    """
+    registered = registered_index(listing)
+    items = list(plan_tasks(rendered, registered, get_xml=get_xml))
+    if prune:
+        items.extend(plan_deletes(
+            registered,
+            configured_names,
+            folders,
+            allow_empty = allow_empty_prune,
+        ))
+    return items
+
+def registered_index(listing):
+    """
+    Dict of normalized casefolded task name to name, of registered task
+    names.
+    """
+    return {
+        schtasks.normalize_task_name(name).casefold(): name for name in listing
+    }
+
+def plan_tasks(rendered, registered, get_xml=schtasks.get_xml):
+    """
+    Generate the PlanItem of each (task, task_xml) of rendered, as they are
+    rendered.
+
+    :param registered:
+        registered_index of the listing.
+    """
+    for task, task_xml in rendered:
+        key = schtasks.normalize_task_name(task.name).casefold()
+        if key not in registered:
+            action = CREATE
+        elif is_unchanged(task_xml, get_xml(task.name)):
+            action = UNCHANGED
+        else:
+            action = OVERWRITE
+        yield PlanItem(action, task.name, task, task_xml)
+
+def check_prune(configured_names, allow_empty=False):
+    """
+    Raise EmptyPruneError if there are no configured names, unless
+    allow_empty. An empty config is more likely a broken one than a wish to
+    delete everything.
+    """
+    if not configured_names and not allow_empty:
+        raise EmptyPruneError(
+            'No configured tasks, refusing to prune every owned task.'
+            ' Use --allow-empty-prune to delete them.'
+        )
+
+def plan_deletes(registered, configured_names, folders, allow_empty=False):
+    """
+    List of delete PlanItem for registered tasks in folders that are not
+    configured. Raise EmptyPruneError without configured names, see
+    check_prune.
+    """
+    check_prune(configured_names, allow_empty)
+    configured = {
+        schtasks.normalize_task_name(name).casefold()
+        for name in configured_names
+    }
+    items = []
+    for key, name in sorted(registered.items()):
+        if key in configured:
+            continue
+        if folder_of(key) not in folders:
+            continue
+        items.append(PlanItem(DELETE, name, None, None))
+    return items
+
+def summary(items):
+    """
+    Dict of action to list of task names.
+    """
+    by_action = {action: [] for action in actions}
+    for item in items:
+        by_action[item.action].append(item.task_name)
+    return by_action
+
+def print_plan(items, format_='text', file=None):
+    by_action = summary(items)
+    if format_ == 'json':
+        print(json.dumps(by_action, indent=2), file=file)
+        return
+    for action in actions:
+        for task_name in by_action[action]:
+            print(f'{action:<10} {task_name}', file=file)
+    counts = ', '.join(f'{len(by_action[action])} {action}' for action in actions)
+    print(f'Plan: {counts}', file=file)
@@ -0,0 +1,251 @@
+"""
+Apply a whole plan from one PowerShell script, run in a single process,
+instead of schtasks commands per task. Register-ScheduledTask -Xml creates a
+task and sets the account it runs as in one call, Unregister-ScheduledTask
+deletes.
+
+Operations are in the helper's format, see helper. The script appends a
+JSON line per operation to a results file, {"id": ..., "ok": ...} with an
+"error" message for failures, which parse_results turns into result dicts
+like the helper's.
+"""
+import base64
+import json
+import re
+import subprocess
+
+from . import profiling
+from . import schtasks
+from . import utils
+
+script_header = """\
+$ErrorActionPreference = 'Stop'
+$ProgressPreference = 'SilentlyContinue'
+$Results = {results_path}
+
+function Write-Result($Id, $Err) {{
+    if ($Err) {{
+        $Result = @{{id = $Id; ok = $false; error = [string]$Err}}
+    }} else {{
+        $Result = @{{id = $Id; ok = $true}}
+    }}
+    [System.IO.File]::AppendAllText($Results, (ConvertTo-Json $Result -Compress) + "`n")
+}}
+
+function Read-Base64($Data) {{
+    [System.Text.Encoding]::UTF8.GetString([System.Convert]::FromBase64String($Data))
+}}
+
+$Session = @{{}}
+"""
+
+remote_session = """\
+$Session = @{{CimSession = New-CimSession -ComputerName {host}}}
+"""
+
+remote_session_credential = """\
+$Password = ConvertTo-SecureString {password} -AsPlainText -Force
+$Credential = New-Object System.Management.Automation.PSCredential({user}, $Password)
+$Session = @{{CimSession = New-CimSession -ComputerName {host} -Credential $Credential}}
+"""
+
+operation_block = """
+try {{
+    {command} | Out-Null
+    Write-Result {id}
+}} catch {{
+    Write-Result {id} $_.Exception.Message
+}}
+"""
+
+def quote(value):
+    """
+    PowerShell single quoted string literal of value. PowerShell also takes
+    the typographic single quotes as quotes.
+    """
+    escaped = re.sub("['\u2018\u2019\u201a\u201b]", lambda match: match.group() * 2, value)
+    return f"'{escaped}'"
+
+def split_task_name(task_name):
+    """
+    Return (task path, task name) of a full task name, like ("\\Folder\\",
+    "Task") for "\\Folder\\Task".
+    """
+    path, name = schtasks.normalize_task_name(task_name).rsplit('\\', 1)
+    return path + '\\', name
+
+def task_args(task_name):
+    path, name = split_task_name(task_name)
+    return f'-TaskPath {quote(path)} -TaskName {quote(name)}'
+
+def create_command(operation):
+    xml = base64.b64encode(operation['xml'].encode('utf-8')).decode('ascii')
+    command = (
+        f'Register-ScheduledTask @Session {task_args(operation["task_name"])}'
+        f' -Xml (Read-Base64 {quote(xml)}) -Force'
+    )
+    run_as = operation.get('run_as')
+    if run_as:
+        command += f' -User {quote(run_as["user"])}'
+        if run_as.get('password'):
+            command += f' -Password {quote(run_as["password"])}'
+    return command
+
+def delete_command(operation):
+    return (
+        f'Unregister-ScheduledTask @Session {task_args(operation["task_name"])}'
+        ' -Confirm:$false'
+    )
+
+operation_commands = {
+    'create': create_command,
+    'delete': delete_command,
+}
+
+
+class ScriptWriter:
+    """
+    Write operations to a script as they are added, holding only their
+    names.
+    """
+
+    def __init__(self, script_file, results_path, remote=None):
+        """
+        :param script_file:
+            Text file to write the script to.
+        :param results_path:
+            Path of the results file the script appends to.
+        :param remote:
+            Optional hosts.Remote to run the operations against, over a CIM
+            session.
+        """
+        self.script_file = script_file
+        self.results_path = results_path
+        # Dicts of the "id", "op" and "task_name" of the added operations.
+        self.operations = []
+        script_file.write(script_header.format(results_path=quote(results_path)))
+        if remote is not None:
+            if remote.user:
+                session = remote_session_credential.format(
+                    host = quote(remote.host),
+                    user = quote(remote.user),
+                    password = quote(remote.password or ''),
+                )
+            else:
+                session = remote_session.format(host=quote(remote.host))
+            script_file.write(session)
+
+    def add(self, operation):
+        """
+        Write an operation and return its id.
+        """
+        operation_id = len(self.operations)
+        command = operation_commands[operation['op']](operation)
+        self.script_file.write(operation_block.format(command=command, id=operation_id))
+        self.operations.append(dict(
+            id = operation_id,
+            op = operation['op'],
+            task_name = operation['task_name'],
+        ))
+        return operation_id
+
+
+def parse_results(lines, operations):
+    """
+    List of result dicts of operations, in order, from the lines of a
+    results file. Operations without a result, as when the script stopped
+    or never ran, failed.
+
+    :param operations:
+        ScriptWriter.operations.
+    """
+    by_id = {}
+    for line in lines:
+        line = line.lstrip('\ufeff').strip()
+        if not line:
+            continue
+        try:
+            result = json.loads(line)
+        except ValueError:
+            # Cut short by the script stopping.
+            continue
+        by_id[result.get('id')] = result
+    results = []
+    for operation in operations:
+        result = dict(operation, ok=False)
+        script_result = by_id.get(operation['id'])
+        if script_result is None:
+            result['error'] = 'No result, the script stopped before it'
+        else:
+            result['ok'] = bool(script_result.get('ok'))
+            if not result['ok']:
+                result['error'] = script_result.get('error') or 'Failed'
+        results.append(result)
+    return results
+
+def script_command(script_path, elevated=False):
+    """
+    Command running a script in one PowerShell process, prompting for admin
+    first if elevated.
+    """
+    powershell_args = ['-NoProfile', '-NonInteractive', '-ExecutionPolicy', 'Bypass']
+    if not elevated:
+        return ['PowerShell', *powershell_args, '-File', script_path]
+    argument_list = subprocess.list2cmdline([*powershell_args, '-File', script_path])
+    return [
+        'PowerShell',
+        '-NoProfile',
+        '-Command', 'Start-Process', 'PowerShell',
+        '-ArgumentList', quote(argument_list),
+        '-Wait',
+        '-WindowStyle', 'Hidden',
+        '-Verb', 'RunAs',
+    ]
+
+def run_script(writer, logger, elevated=False):
+    """
+    Close the script file of a ScriptWriter, run the script once and return
+    the list of result dicts of its operations, logging the failed ones.
+    """
+    writer.script_file.close()
+    command = script_command(writer.script_file.name, elevated)
+    try:
+        with profiling.span('elevated' if elevated else 'script'):
+            utils.run_with_logger(logger, command)
+    except subprocess.SubprocessError:
+        # Operations it got to still wrote their results.
+        pass
+    with open(writer.results_path, encoding='utf-8') as results_file:
+        results = parse_results(results_file, writer.operations)
+    for result in results:
+        if not result['ok']:
+            logger.error(
+                '%s %s failed: %s',
+                result['op'],
+                result['task_name'],
+                result['error'],
+            )
+    return results
+
+def delete_folder_command(folder, remote=None):
+    """
+    Command deleting an empty task folder, like "\\Folder", which schtasks
+    cannot do, with the Task Scheduler COM API.
+
+    :param remote:
+        Optional hosts.Remote of the host of the folder.
+    """
+    parent, name = split_task_name(folder.rstrip('\\'))
+    parent = parent.rstrip('\\') or '\\'
+    connect = ''
+    if remote is not None:
+        user = quote(remote.user) if remote.user else '$null'
+        password = quote(remote.password) if remote.password else '$null'
+        connect = f'{quote(remote.host)}, {user}, $null, {password}'
+    script = (
+        "$ErrorActionPreference = 'Stop';"
+        ' $Service = New-Object -ComObject Schedule.Service;'
+        f' $Service.Connect({connect});'
+        f' $Service.GetFolder({quote(parent)}).DeleteFolder({quote(name)}, 0)'
+    )
+    return ['PowerShell', '-NoProfile', '-NonInteractive', '-Command', script]
@@ -0,0 +1,116 @@
+"""
+Timing spans for the phases of a command. Spans are no-ops until `enable`
+is called, so instrumented code costs one function call when profiling is
+off.
+"""
+import contextlib
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+from collections import defaultdict
+
+from . import executor
+
+_null_span = contextlib.nullcontext()
+
+
+class NullProfiler:
+
+    enabled = False
+
+    def span(self, phase, task=None):
+        return _null_span
+
+
+class Profiler:
+    """
+    Accumulate wall time and counts per phase, and per task and phase.
+    """
+
+    enabled = True
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.phases = defaultdict(lambda: [0.0, 0])
+        self.tasks = defaultdict(lambda: defaultdict(float))
+        # Spans end on worker threads too.
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.end_time = None
+
+    def start(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self.start_time = time.perf_counter()
+
+    def stop(self):
+        self.end_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, phase, task=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                totals = self.phases[phase]
+                totals[0] += seconds
+                totals[1] += 1
+                if task is not None:
+                    self.tasks[task][phase] += seconds
+
+    def report(self, command=None):
+        """
+        Return the report as a dict.
+        """
+        end_time = self.end_time or time.perf_counter()
+        with self.lock:
+            phases = {
+                phase: dict(seconds=seconds, count=count)
+                for phase, (seconds, count) in self.phases.items()
+            }
+            tasks = {task: dict(task_phases) for task, task_phases in self.tasks.items()}
+        report = dict(
+            command = command,
+            wall_seconds = end_time - self.start_time,
+            phases = phases,
+            tasks = tasks,
+            subprocesses = executor.metrics_summary(),
+        )
+        if tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            report['peak_memory_bytes'] = peak
+        return report
+
+
+profiler = NullProfiler()
+
+def enable(trace_memory=True):
+    """
+    Start profiling spans, replacing the no-op profiler.
+    """
+    global profiler
+    profiler = Profiler(trace_memory=trace_memory)
+    profiler.start()
+    return profiler
+
+def span(phase, task=None):
+    """
+    Context manager timing a phase, optionally for a task name.
+    """
+    return profiler.span(phase, task)
+
+def write_report(report, path):
+    """
+    Write report as JSON to path, or stderr for "-".
+    """
+    if path == '-':
+        json.dump(report, sys.stderr, indent=2)
+        sys.stderr.write('\n')
+    else:
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
@@ -0,0 +1,82 @@
+import collections
+
+import markupsafe
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used item and counts hits
+    and misses.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, factory):
+        """
+        Return the cached value for key, calling factory to create it on a
+        miss.
+        """
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            value = self.data[key] = factory()
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        else:
+            self.hits += 1
+            self.data.move_to_end(key)
+        return value
+
+    def stats(self):
+        return dict(
+            hits = self.hits,
+            misses = self.misses,
+            size = len(self.data),
+            maxsize = self.maxsize,
+        )
+
+
+class TaskRenderer:
+    """
+    Render task XML, reusing the rendered fragments of structurally identical
+    triggers, actions and settings.
+    """
+
+    # Fragment name to template. The name is also the variable name given to
+    # the fragment template.
+    fragment_templates = {
+        'action': 'action.xml',
+        'settings': 'settings.xml',
+        'trigger': 'trigger.xml',
+    }
+
+    def __init__(self, jinja_env, maxsize=1024):
+        self.task_template = jinja_env.get_template('task.xml')
+        self.templates = {
+            name: jinja_env.get_template(template_name)
+            for name, template_name in self.fragment_templates.items()
+        }
+        self.cache = LRUCache(maxsize)
+
+    def fragment(self, name, obj):
+        """
+        Rendered fragment for a model object, from cache by its structural
+        hash.
+        """
+        def factory():
+            rendered = self.templates[name].render({name: obj})
+            # Already escaped by its own template.
+            return markupsafe.Markup(rendered)
+
+        key = (name, obj.structural_hash())
+        return self.cache.get(key, factory)
+
+    def render(self, task):
+        """
+        Return XML string for task.
+        """
+        return self.task_template.render(task=task, fragment=self.fragment)
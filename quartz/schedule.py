@@ -0,0 +1,228 @@
+"""
+When configured tasks run: expand triggers into run times over a window,
+count them per task and histogram them per minute.
+
+Each trigger activation with its repetition is an arithmetic progression of
+run times, so runs are counted and histogrammed from the progressions
+without listing every run. NumPy is used when it is installed.
+"""
+import collections
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import validate
+
+epoch = datetime.datetime(1970, 1, 1)
+
+day_seconds = 24 * 60 * 60
+
+# Runs start, start + step, ... count runs, in seconds since epoch.
+Progression = collections.namedtuple('Progression', ['start', 'step', 'count'])
+
+def to_seconds(dt):
+    """
+    Seconds since epoch of a naive local datetime, or an aware one converted
+    to local time.
+    """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return int((dt - epoch).total_seconds())
+
+def from_seconds(seconds):
+    return epoch + datetime.timedelta(seconds=int(seconds))
+
+def duration_seconds(duration):
+    """
+    Seconds of an ISO 8601 duration string, or None for empty, meaning
+    indefinitely.
+    """
+    if not duration:
+        return None
+    return int(validate.parse_iso8601_duration(duration).total_seconds())
+
+def clip(start, step, count, window_start, window_end):
+    """
+    Progression of the runs of start, step, count within
+    [window_start, window_end), or None if there are none.
+    """
+    first = 0
+    if start < window_start:
+        first = -(-(window_start - start) // step)
+    last = count
+    if start + (count - 1) * step >= window_end:
+        last = -(-(window_end - start) // step)
+    if last <= first:
+        return None
+    return Progression(start + first * step, step, last - first)
+
+def trigger_progressions(trigger, window_start, window_end):
+    """
+    Generate Progression of the runs of a trigger in
+    [window_start, window_end), seconds since epoch. Event triggers, like
+    logon and boot, have no scheduled runs.
+    """
+    if trigger.type_ not in ('CalendarTrigger', 'TimeTrigger') or not trigger.start_boundary:
+        return
+    start = to_seconds(datetime.datetime.fromisoformat(trigger.start_boundary))
+
+    if trigger.type_ == 'CalendarTrigger':
+        days_interval = int((trigger.schedule_by_day or {}).get('days_interval', 1))
+        activation_step = days_interval * day_seconds
+    else:
+        # One time.
+        activation_step = None
+
+    repetition = trigger.repetition
+    if repetition is not None:
+        step = duration_seconds(repetition.interval)
+        if not step:
+            raise ValueError(f'Repetition interval under a second {repetition.interval!r}.')
+        length = duration_seconds(repetition.duration)
+        if length is None:
+            # Indefinitely: until the next activation repeats it, or the
+            # end of the window.
+            length = activation_step or window_end - start
+        repeats = max(1, -(-length // step))
+    else:
+        step = 1
+        repeats = 1
+
+    if activation_step is None:
+        progression = clip(start, step, repeats, window_start, window_end)
+        if progression is not None:
+            yield progression
+        return
+
+    # Activations whose repetitions can reach the window.
+    span = (repeats - 1) * step
+    first = max(0, -(-(window_start - span - start) // activation_step))
+    activation = start + first * activation_step
+    while activation < window_end:
+        progression = clip(activation, step, repeats, window_start, window_end)
+        if progression is not None:
+            yield progression
+        activation += activation_step
+
+
+class Schedule:
+    """
+    Runs of configured tasks over a window. Progressions are computed once
+    per distinct trigger, as triggers are interned and shared by tasks.
+    """
+
+    def __init__(self, window_start, window_end, include_disabled=False):
+        """
+        :param window_start:
+            datetime of the start of the window.
+        :param window_end:
+            datetime of the end of the window, exclusive.
+        :param include_disabled:
+            Count runs of disabled triggers.
+        """
+        self.window_start = to_seconds(window_start)
+        self.window_end = to_seconds(window_end)
+        self.include_disabled = include_disabled
+        # Trigger structural hash to list of Progression.
+        self.trigger_cache = {}
+        # Task name to list of Progression.
+        self.tasks = {}
+
+    def progressions(self, trigger):
+        key = trigger.structural_hash()
+        try:
+            return self.trigger_cache[key]
+        except KeyError:
+            progressions = list(trigger_progressions(
+                trigger,
+                self.window_start,
+                self.window_end,
+            ))
+            self.trigger_cache[key] = progressions
+            return progressions
+
+    def add(self, task):
+        progressions = []
+        for trigger in task.triggers:
+            if trigger.enabled or self.include_disabled:
+                progressions.extend(self.progressions(trigger))
+        self.tasks[task.name] = progressions
+
+    def run_counts(self):
+        """
+        Dict of task name to number of runs in the window.
+        """
+        return {
+            task_name: sum(progression.count for progression in progressions)
+            for task_name, progressions in self.tasks.items()
+        }
+
+    def run_times(self, task_name):
+        """
+        Sorted list of run datetimes of a task.
+        """
+        seconds = []
+        for start, step, count in self.tasks[task_name]:
+            seconds.extend(range(start, start + step * count, step))
+        return [from_seconds(run) for run in sorted(seconds)]
+
+    def histogram(self, bin_seconds=60):
+        """
+        List of the number of runs of all tasks in each bin_seconds bin of
+        the window.
+        """
+        nbins = -(-(self.window_end - self.window_start) // bin_seconds)
+        # Progressions per trigger weighted by the tasks sharing it.
+        weights = collections.Counter()
+        for progressions in self.tasks.values():
+            for progression in progressions:
+                weights[progression] += 1
+
+        # Bins of a progression whose step is a whole number of bins are an
+        # arithmetic progression too. Mark where they start and stop in a
+        # difference array per step and sum with that stride.
+        differences = collections.defaultdict(lambda: [0] * nbins)
+        irregular = []
+        for (start, step, count), weight in weights.items():
+            if count == 1:
+                bin_step = 1
+            elif step % bin_seconds:
+                irregular.append((start, step, count, weight))
+                continue
+            else:
+                bin_step = step // bin_seconds
+            first = (start - self.window_start) // bin_seconds
+            difference = differences[bin_step]
+            difference[first] += weight
+            stop = first + count * bin_step
+            if stop < nbins:
+                difference[stop] -= weight
+
+        if numpy is not None:
+            return self._numpy_histogram(nbins, bin_seconds, differences, irregular)
+
+        histogram = [0] * nbins
+        for bin_step, difference in differences.items():
+            for index in range(bin_step, nbins):
+                difference[index] += difference[index - bin_step]
+            histogram = [total + value for total, value in zip(histogram, difference)]
+        for start, step, count, weight in irregular:
+            for run in range(start, start + step * count, step):
+                histogram[(run - self.window_start) // bin_seconds] += weight
+        return histogram
+
+    def _numpy_histogram(self, nbins, bin_seconds, differences, irregular):
+        histogram = numpy.zeros(nbins, dtype=numpy.int64)
+        for bin_step, difference in differences.items():
+            padded = numpy.zeros(-(-nbins // bin_step) * bin_step, dtype=numpy.int64)
+            padded[:nbins] = difference
+            # Each column is one residue modulo bin_step.
+            histogram += padded.reshape(-1, bin_step).cumsum(axis=0).ravel()[:nbins]
+        for start, step, count, weight in irregular:
+            runs = numpy.arange(start, start + step * count, step)
+            indexes = (runs - self.window_start) // bin_seconds
+            histogram += numpy.bincount(indexes, minlength=nbins) * weight
+        return histogram.tolist()
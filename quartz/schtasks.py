@@ -1,10 +1,18 @@
+import collections.abc
 import csv
-import io
+import datetime
+import os
 import subprocess
+import sys
 import xml.etree.ElementTree as ET
 
+from collections import defaultdict
+
 from lxml import etree
 
+from . import executor
+from . import hosts
+
 # The fields output by schtasks for CSV.
 csv_fields = [
     'TaskName',
@@ -12,6 +20,8 @@ csv_fields = [
     'Status',
 ]
 
+schema_path = os.path.join(os.path.dirname(__file__), 'scheduled_task.xsd')
+
 schtasks_schema = None
 
 class SchemaValidationError(Exception):
@@ -20,16 +30,29 @@ class SchemaValidationError(Exception):
 def ensure_schtasks_schema():
     global schtasks_schema
     if schtasks_schema is None:
-        schtasks_schema = etree.XMLSchema(file='quartz/task_scheduler.xsd')
-        #with open('quartz/task_scheduler.xsd') as schema_file:
-        #    schtasks_schema = etree.XMLSchema(file=schema_file)
+        schtasks_schema = etree.XMLSchema(file=schema_path)
     return schtasks_schema
 
+def normalize_task_name(task_name):
+    """
+    Task name as listed by schtasks, with the leading backslash.
+    """
+    if not task_name.startswith('\\'):
+        task_name = '\\' + task_name
+    return task_name
+
+def schtasks_command(verb, *args):
+    """
+    Return command list for a schtasks verb, like "/query", targeting the
+    host of hosts.target if there is one.
+    """
+    return ['schtasks', verb, *hosts.remote_args(), *args]
+
 def create_from_xml_command(task_name, xml_path, force=False):
     """
     Return command list to create scheduled task from xml file.
     """
-    command = ['schtasks', '/create', '/tn', task_name]
+    command = schtasks_command('/create', '/tn', task_name)
     if force:
         command.append('/f')
     # Note: other code expects the path at the end, specifically setting the
@@ -37,29 +60,29 @@ def create_from_xml_command(task_name, xml_path, force=False):
     command.extend(['/xml', xml_path])
     return command
 
-def delete(task_name, confirm=False):
+def delete_command(task_name, confirm=False):
     """
-    Delete a scheduled task by name.
+    Return command list to delete a scheduled task by name.
     """
-    command = ['schtasks', '/delete', '/tn', task_name]
+    command = schtasks_command('/delete', '/tn', task_name)
     if not confirm:
         command.append('/f')
-    result = subprocess.run(
-        command,
-        check = True,
-        stdout = subprocess.PIPE,
-        stderr = subprocess.PIPE,
-    )
+    return command
+
+def delete(task_name, confirm=False):
+    """
+    Delete a scheduled task by name.
+    """
+    command = delete_command(task_name, confirm)
+    result = executor.run(command)
     return result
 
+def exists_command(task_name):
+    return schtasks_command('/query', '/tn', task_name)
+
 def exists(task_name):
     try:
-        subprocess.run(
-            ['schtasks', '/query', '/tn', task_name],
-            check = True,
-            stdout = subprocess.PIPE,
-            stderr = subprocess.PIPE,
-        )
+        executor.run(exists_command(task_name))
     except subprocess.CalledProcessError:
         return False
     else:
@@ -67,47 +90,251 @@ def exists(task_name):
 
 def task_create_from_xml(task_name, xml_path, force=False):
     command = create_from_xml_command(task_name, xml_path, force)
-    result = subprocess.run(
-        command,
-        check = True,
-        stdout = subprocess.PIPE,
-        stderr = subprocess.PIPE,
-    )
+    result = executor.run(command)
     return result
 
+# Formats of Next Run Time and Last Run Time values, in the user's short
+# date format.
+run_time_formats = [
+    '%m/%d/%Y %I:%M:%S %p',
+    '%m/%d/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M:%S',
+    '%d.%m.%Y %H:%M:%S',
+    '%d-%m-%Y %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y/%m/%d %H:%M:%S',
+]
+
+# Run time values that are not times, to skip parsing.
+not_run_times = {'', 'N/A', 'Never', 'Disabled', 'Running'}
+
+# Last Run Time of a task that never ran.
+never_run_time = datetime.datetime(1999, 11, 30)
+
+def day_first():
+    """
+    Whether the user's short date format puts the day before the month,
+    from the Windows setting schtasks formats dates with, or else the
+    current locale's %x.
+    """
+    try:
+        # Only on Windows.
+        import winreg
+    except ImportError:
+        short_date = datetime.date(2001, 2, 3).strftime('%x')
+        return short_date.find('03') < short_date.find('02')
+    try:
+        with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r'Control Panel\International') as key:
+            short_date, _ = winreg.QueryValueEx(key, 'sShortDate')
+    except OSError:
+        return False
+    return short_date.lower().find('d') < short_date.lower().find('m')
+
+def locale_run_time_formats():
+    """
+    run_time_formats with those matching the user's day and month order
+    first, which decides values valid either way, like 02/03/2001.
+    """
+    if not day_first():
+        return list(run_time_formats)
+    return sorted(run_time_formats, key=lambda format_: format_.find('%d') > format_.find('%m'))
+
+
+class RunTimeParser:
+    """
+    Parse the run time values of one listing. They share one date format,
+    detected once from the values, and repeat a lot, so each distinct value
+    is parsed once.
+    """
+
+    def __init__(self, formats=None):
+        if formats is None:
+            formats = locale_run_time_formats()
+        self.formats = formats
+        self.format = None
+        self.detected = False
+        # Value to datetime or None.
+        self.cache = {}
+
+    def detect(self, values):
+        """
+        Use the first format that parses all of values. Return it, or None
+        if none does.
+        """
+        values = {value for value in values if value not in not_run_times}
+        for format_ in self.formats:
+            try:
+                for value in values:
+                    datetime.datetime.strptime(value, format_)
+            except ValueError:
+                continue
+            if format_ != self.format:
+                self.format = format_
+                self.cache.clear()
+            self.detected = True
+            return format_
+
+    def _parse(self, value):
+        if value in not_run_times:
+            return None
+        if self.format is None:
+            # Parsed before a batch was detected, like a single row.
+            self.detect([value])
+        formats = [self.format] if self.format else []
+        formats.extend(format_ for format_ in self.formats if format_ != self.format)
+        for format_ in formats:
+            try:
+                parsed = datetime.datetime.strptime(value, format_)
+            except ValueError:
+                continue
+            if parsed == never_run_time:
+                return None
+            return parsed
+
+    def parse(self, value):
+        """
+        Datetime of a run time value, or None for values like "N/A",
+        "Disabled" or the time of a task that never ran.
+        """
+        try:
+            return self.cache[value]
+        except KeyError:
+            parsed = self.cache[value] = self._parse(value)
+            return parsed
+
+    def parse_all(self, values):
+        """
+        List of parse of values, detecting the format from all of them
+        first.
+        """
+        values = list(values)
+        if not self.detected:
+            self.detect(values)
+        return [self.parse(value) for value in values]
+
+
+def parse_run_times(rows, key='Next Run Time'):
+    """
+    List of the parsed key run times of TaskRow of one listing, in one
+    batch.
+    """
+    if not rows:
+        return []
+    return rows[0].run_times.parse_all(row.get(key, '') for row in rows)
+
+class TaskRow(collections.abc.Mapping):
+    """
+    Read-only mapping of a CSV listing row. Rows of a listing share the
+    header's index, and only keep their list of values.
+    """
+
+    __slots__ = (
+        '_index',
+        '_values',
+        'run_times',
+    )
+
+    def __init__(self, index, values, run_times=None):
+        self._index = index
+        self._values = values
+        # RunTimeParser shared by the rows of the listing.
+        if run_times is None:
+            run_times = RunTimeParser()
+        self.run_times = run_times
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+    @property
+    def next_run_time(self):
+        return self.run_times.parse(self.get('Next Run Time', ''))
+
+    @property
+    def last_run_time(self):
+        return self.run_times.parse(self.get('Last Run Time', ''))
+
+    @property
+    def last_result(self):
+        """
+        Last Result of a verbose listing as an int, or None.
+        """
+        value = self.get('Last Result', '').strip()
+        try:
+            return int(value, 0)
+        except ValueError:
+            return None
+
+
+class CsvListingParser:
+    """
+    Turn the rows of `schtasks /query /fo CSV` output, split into values,
+    into TaskRow one at a time, skipping the header rows that /v repeats.
+    """
+
+    def __init__(self):
+        self.header = None
+        self.index = None
+        self.run_times = RunTimeParser()
+
+    def add(self, row):
+        """
+        Return TaskRow for a list of values, or None for a header or empty
+        row.
+        """
+        if self.header is None:
+            self.header = [sys.intern(key) for key in row]
+            self.index = {key: position for position, key in enumerate(self.header)}
+            return None
+        # Task names start with a backslash, so only a header row can start
+        # with the first header key.
+        if not row or (row[0] == self.header[0] and row == self.header):
+            return None
+        return TaskRow(self.index, row, self.run_times)
+
+
+def parse_csv_listing(lines):
+    """
+    Generate TaskRow from lines of `schtasks /query /fo CSV` output.
+    """
+    parser = CsvListingParser()
+    for row in csv.reader(lines):
+        task_row = parser.add(row)
+        if task_row is not None:
+            yield task_row
+
+def get_tasks_command(verbose=False):
+    command = schtasks_command('/query', '/fo', 'CSV')
+    if verbose:
+        command.append('/v')
+    return command
+
 def get_tasks(verbose=False):
     """
-    Get a list of data about scheduled tasks.
+    Generate data about scheduled tasks as TaskRow mappings, while schtasks
+    is still running.
     """
     # This is probably the fastest way to get a list of names.
     # XXX
     # - CSV format does not have the schedule data.
     # - Probably other data too.
     # /v gives more fields but produces duplicate headers
-    command = ['schtasks', '/query', '/fo', 'CSV']
-    if verbose:
-        command.append('/v')
-    result = subprocess.run(
-        command,
-        capture_output = True,
-        check = True,
-        text = True,
-    )
-    csv_data = io.StringIO(result.stdout)
-    reader = csv.reader(csv_data)
-    header = next(reader)
-    tasks = []
-    for row in reader:
-        if row == header:
-            continue
-        tasks.append(dict(zip(header, row)))
-    return tasks
+    with executor.stream(get_tasks_command(verbose)) as process:
+        yield from parse_csv_listing(process.stdout)
 
 def get_tasks_list(verbose=False):
-    command = ['schtasks', '/query', '/fo', 'LIST']
+    command = schtasks_command('/query', '/fo', 'LIST')
     if verbose:
         command.append('/v')
-    result = subprocess.run(command, capture_output=True, text=True)
+    result = executor.run(command, check=False, text=True)
     tasks = []
     lines = result.stdout.splitlines()
     for line in lines:
@@ -117,10 +344,10 @@ def get_tasks_list(verbose=False):
     return tasks
 
 def get_tasks_folders(verbose=False):
-    command = ['schtasks', '/query', '/fo', 'LIST']
+    command = schtasks_command('/query', '/fo', 'LIST')
     if verbose:
         command.append('/v')
-    result = subprocess.run(command, capture_output=True, text=True)
+    result = executor.run(command, check=False, text=True)
 
     lines = result.stdout.splitlines()
     tasks = defaultdict(list)
@@ -140,13 +367,8 @@ def get_tasks_xml():
     # XXX
     # - schtasks.exe does not give proper xml for a complete dump of all tasks.
     # - but does for specific tasks.
-    command = ['schtasks', '/query', '/xml']
-    result = subprocess.run(
-        command,
-        capture_output = True,
-        check = True,
-        text = True,
-    )
+    command = schtasks_command('/query', '/xml')
+    result = executor.run(command, text=True)
     root = ET.fromstring(result.stdout)
     for task_node in root.findall('task'):
         yield task_node
@@ -159,26 +381,30 @@ def run_as_command(task_name, user, password, for_batch=False):
         # Escape percent for batch files.
         password = password.replace('%', '%%')
         password = f'"{password}"'
-    command = [
-        'schtasks', '/change',
+    command = schtasks_command(
+        '/change',
         '/tn', task_name,
         '/ru', user,
         '/rp', password,
-    ]
+    )
     return command
 
+def enable_command(task_name, enabled=True):
+    """
+    Return the command to enable or disable a scheduled task.
+    """
+    return schtasks_command('/change', '/tn', task_name, '/enable' if enabled else '/disable')
+
+def task_enable(task_name, enabled=True):
+    return executor.run(enable_command(task_name, enabled))
+
 def schtasks_get_data(task_name):
     """
     Nearly complete task data as xml object. Data is not complete because
     schtasks does not dump everything.
     """
-    command = ['schtasks', '/query', '/xml', '/tn', task_name]
-    result = subprocess.run(
-        command,
-        capture_output = True,
-        check = True,
-        text = True,
-    )
+    command = schtasks_command('/query', '/xml', '/tn', task_name)
+    result = executor.run(command, text=True)
     root = ET.fromstring(result.stdout)
     return root
 
@@ -197,28 +423,27 @@ def schtasks_list_tasks():
 
 def task_run_as(task_name, user, password):
     command = run_as_command(task_name, user, password)
-    result = subprocess.run(
-        command,
-        check = True,
-        stderr = subprocess.PIPE,
-        stdout = subprocess.PIPE,
-    )
+    result = executor.run(command)
     return result
 
+def get_xml_command(task_name):
+    return schtasks_command('/query', '/xml', '/tn', task_name)
+
+def parse_xml(data):
+    """
+    Root element of a task's XML from schtasks output bytes.
+    """
+    # the xml doc says utf-16 but it's usually really utf-8
+    encoding = executor.xml_encoding(data)
+    xml_parser = etree.XMLParser(encoding=encoding)
+    return etree.fromstring(data, xml_parser)
+
 def get_xml(task_name, as_string=False):
-    command = ['schtasks', '/query', '/xml', '/tn', task_name]
-    result = subprocess.run(
-        command,
-        capture_output = True,
-        check = True,
-    )
+    result = executor.run(get_xml_command(task_name))
     if as_string:
         return result.stdout
     else:
-        # the xml doc says utf-16 but it's really utf-8
-        xml_parser = etree.XMLParser(encoding='utf-8')
-        root = etree.fromstring(result.stdout, xml_parser)
-        return root
+        return parse_xml(result.stdout)
 
 def raise_for_validation(root):
     schema = ensure_schtasks_schema()
@@ -0,0 +1,299 @@
+"""
+Local JSON API over a warm inventory.
+
+GET  /health                  inventory age and size
+GET  /tasks?match=GLOB&KEY=V  listing rows, filtered by name globs and fields
+GET  /task?name=NAME          one task's row and parsed XML
+GET  /lsconf/check            configured tasks missing from the scheduler
+POST /apply                   {"tasks": [...], "prune": false, "plan": false}
+
+Any GET takes fresh=1 to refresh the inventory first. Concurrent identical
+requests share one refresh, and one result for check and apply.
+
+/apply is only served when enabled with a token. It takes an application/json
+body and an "Authorization: Bearer TOKEN" header. Requests with an Origin
+header, sent by browsers for other sites, are refused.
+"""
+import fnmatch
+import hmac
+import http.server
+import json
+import os
+import re
+import secrets
+import socketserver
+import threading
+import urllib.parse
+
+from . import const
+from . import inventory
+from . import schtasks
+
+def default_token_path():
+    return os.path.join(os.path.expanduser('~'), '.' + const.APPNAME, 'serve.token')
+
+def load_token(path=None, create=False):
+    """
+    Read the token required by /apply, optionally creating it readable only
+    by the user.
+    """
+    if path is None:
+        path = default_token_path()
+    if create and not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as token_file:
+            token_file.write(secrets.token_urlsafe(32))
+    with open(path) as token_file:
+        return token_file.read().strip()
+
+class ApiError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Api:
+    """
+    Request handling independent of HTTP, for the handler and for tests.
+    """
+
+    def __init__(self, task_inventory, load_config, apply=None, token=None):
+        """
+        :param task_inventory:
+            inventory.Inventory.
+        :param load_config:
+            Callable returning the config module, called per request.
+        :param apply:
+            Callable taking task_names, prune, plan_only and listing, and
+            returning a result dict. None disables /apply.
+        :param token:
+            Token /apply requests must carry, required with apply.
+        """
+        if apply is not None and not token:
+            raise ValueError('apply requires a token')
+        self.inventory = task_inventory
+        self.load_config = load_config
+        self.apply_callable = apply
+        self.token = token
+        self.coalescer = inventory.Coalescer()
+
+    def check_headers(self, headers, post=False):
+        """
+        Raise ApiError for a request from a browser page, and for a POST
+        that is not JSON or lacks the token.
+
+        :param headers:
+            Mapping of the request headers.
+        """
+        if headers.get('Origin') is not None:
+            raise ApiError(403, 'Cross-origin requests are refused')
+        if not post:
+            return
+        content_type = (headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            raise ApiError(415, 'Content-Type must be application/json')
+        if self.token is None:
+            raise ApiError(403, 'apply is disabled')
+        authorization = (headers.get('Authorization') or '').encode('utf-8')
+        if not hmac.compare_digest(authorization, f'Bearer {self.token}'.encode('utf-8')):
+            raise ApiError(401, 'Missing or wrong token')
+
+    def max_age(self, query):
+        if query.get('fresh', ['0'])[-1] not in ('', '0', 'false'):
+            return 0
+        return None
+
+    def health(self, query):
+        return dict(
+            tasks = len(self.inventory.tasks),
+            age_seconds = self.inventory.age(),
+            refreshes = self.inventory.refreshes,
+        )
+
+    def list_tasks(self, query):
+        tasks = self.inventory.snapshot(self.max_age(query))
+        patterns = [
+            re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+            for pattern in query.get('match', [])
+        ]
+        fields = {
+            key: values[-1] for key, values in query.items()
+            if key not in ('match', 'fresh')
+        }
+        rows = []
+        for entry in tasks.values():
+            row = entry['row']
+            if patterns and not any(regex.match(row['TaskName']) for regex in patterns):
+                continue
+            if any(row.get(key) != value for key, value in fields.items()):
+                continue
+            rows.append(row)
+        rows.sort(key=lambda row: row['TaskName'])
+        return dict(tasks=rows)
+
+    def get_task(self, query):
+        try:
+            task_name = query['name'][-1]
+        except KeyError:
+            raise ApiError(400, 'name is required')
+        entry = self.inventory.get(task_name, self.max_age(query))
+        if entry is None:
+            raise ApiError(404, f'No task {task_name}')
+        return dict(entry['row'], xml=entry['xml'])
+
+    def check(self, query):
+        def check_config():
+            config_module = self.load_config()
+            tasks = self.inventory.snapshot(self.max_age(query))
+            configured = [task.name for task in config_module.QUARTZ_TASKS]
+            missing = [
+                name for name in configured
+                if schtasks.normalize_task_name(name).casefold() not in tasks
+            ]
+            return dict(configured=len(configured), missing=sorted(missing))
+        return self.coalescer.run(('check', self.max_age(query)), check_config)
+
+    def apply(self, body):
+        if self.apply_callable is None:
+            raise ApiError(403, 'apply is disabled')
+        task_names = body.get('tasks') or None
+        prune = bool(body.get('prune'))
+        plan_only = bool(body.get('plan'))
+
+        def apply_config():
+            listing = [
+                entry['row']['TaskName']
+                for entry in self.inventory.refresh().values()
+            ]
+            result = self.apply_callable(
+                task_names = task_names,
+                prune = prune,
+                plan_only = plan_only,
+                listing = listing,
+            )
+            if not plan_only:
+                self.inventory.invalidate(task_names or listing)
+            return result
+
+        key = ('apply', tuple(sorted(task_names or ())), prune, plan_only)
+        return self.coalescer.run(key, apply_config)
+
+    get_routes = {
+        '/health': health,
+        '/tasks': list_tasks,
+        '/task': get_task,
+        '/lsconf/check': check,
+    }
+
+    post_routes = {
+        '/apply': apply,
+    }
+
+
+def make_handler(api):
+    """
+    Return a request handler class serving api.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def address_string(self):
+            # UNIX socket clients have no address.
+            if isinstance(self.client_address, tuple):
+                return self.client_address[0]
+            return 'local'
+
+        def send_json(self, status, data):
+            body = json.dumps(data, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def dispatch(self, routes, *args):
+            url = urllib.parse.urlsplit(self.path)
+            try:
+                route = routes[url.path]
+            except KeyError:
+                self.send_json(404, dict(error=f'No route {url.path}'))
+                return
+            if args:
+                call_args = args
+            else:
+                call_args = (urllib.parse.parse_qs(url.query, keep_blank_values=True), )
+            try:
+                data = route(api, *call_args)
+            except ApiError as e:
+                self.send_json(e.status, dict(error=str(e)))
+            except Exception as e:
+                self.log_error('%s', e)
+                self.send_json(500, dict(error=f'{type(e).__name__}: {e}'))
+            else:
+                self.send_json(200, data)
+
+        def do_GET(self):
+            try:
+                api.check_headers(self.headers)
+            except ApiError as e:
+                self.send_json(e.status, dict(error=str(e)))
+                return
+            self.dispatch(api.get_routes)
+
+        def do_POST(self):
+            try:
+                api.check_headers(self.headers, post=True)
+            except ApiError as e:
+                self.send_json(e.status, dict(error=str(e)))
+                return
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self.send_json(400, dict(error='Body is not JSON'))
+                return
+            self.dispatch(api.post_routes, body)
+
+    return Handler
+
+
+class ThreadingHTTPServer(http.server.ThreadingHTTPServer):
+
+    daemon_threads = True
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+
+    class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+        daemon_threads = True
+
+
+def make_server(api, host='127.0.0.1', port=8765, socket_path=None):
+    """
+    HTTP server for api on host and port, or on a UNIX socket path.
+    """
+    handler = make_handler(api)
+    if socket_path:
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+def serve(api, refresh_interval=30, **kwargs):
+    """
+    Refresh the inventory in the background and serve until interrupted.
+    """
+    stop_event = threading.Event()
+    refresher = threading.Thread(
+        target = api.inventory.refresh_forever,
+        args = (refresh_interval, stop_event),
+        daemon = True,
+    )
+    refresher.start()
+    server = make_server(api, **kwargs)
+    try:
+        server.serve_forever()
+    finally:
+        stop_event.set()
+        server.server_close()
@@ -0,0 +1,197 @@
+"""
+Spread the start minutes of EveryMinutes tasks, so that fewer tasks launch
+on the same minute.
+
+Launches are profiled per minute of the day. Tasks are placed one at a time,
+those launching most often first, at the offset within their interval whose
+launch minutes have the lowest peak so far. Ties go to the lowest total,
+then to an offset from a hash of the task name, so the result only depends
+on the configuration.
+"""
+import datetime
+import fnmatch
+import functools
+import json
+import zlib
+
+from . import models
+from . import schedule
+
+day_minutes = 24 * 60
+
+@functools.lru_cache(maxsize=None)
+def interval_seconds(interval):
+    return schedule.duration_seconds(interval)
+
+def interval_minutes(trigger):
+    """
+    Repetition interval of an EveryMinutes trigger in whole minutes, or None
+    for other triggers.
+    """
+    if not isinstance(trigger, models.EveryMinutes):
+        return None
+    seconds = interval_seconds(trigger.repetition.interval)
+    if seconds % 60:
+        return None
+    return seconds // 60
+
+def with_offset(trigger, offset):
+    """
+    Interned copy of a trigger starting offset minutes after midnight of its
+    start boundary date.
+    """
+    start = datetime.datetime.fromisoformat(trigger.start_boundary)
+    midnight = datetime.datetime.combine(start.date(), datetime.time())
+    start_boundary = midnight + datetime.timedelta(minutes=offset)
+    return models.intern(trigger.replace(
+        start_boundary = start_boundary.isoformat(timespec='seconds'),
+    ))
+
+def movable_interval(task):
+    """
+    Interval in minutes of a task whose only schedule is one enabled
+    EveryMinutes trigger, else None.
+    """
+    intervals = [
+        interval_minutes(trigger) for trigger in task.triggers if trigger.enabled
+    ]
+    if len(intervals) == 1 and intervals[0] and intervals[0] <= day_minutes:
+        return intervals[0]
+
+def is_pinned(task, pinned):
+    return any(fnmatch.fnmatchcase(task.name, pattern) for pattern in pinned)
+
+def reference_date(tasks):
+    """
+    The day after the latest start boundary, when every trigger has started,
+    so profiles do not depend on the day they are computed.
+    """
+    dates = [
+        datetime.datetime.fromisoformat(trigger.start_boundary).date()
+        for task in tasks
+        for trigger in task.triggers
+        if trigger.start_boundary
+    ]
+    if not dates:
+        return datetime.date.today()
+    return max(dates) + datetime.timedelta(days=1)
+
+def fixed_profile(tasks, date):
+    """
+    Launches per minute of date of tasks that are not moved.
+    """
+    window_start = datetime.datetime.combine(date, datetime.time())
+    task_schedule = schedule.Schedule(
+        window_start,
+        window_start + datetime.timedelta(days=1),
+    )
+    for task in tasks:
+        task_schedule.add(task)
+    return task_schedule.histogram(60)
+
+def launch_profile(tasks, date, offsets):
+    """
+    Launches per minute of date of all tasks, with the tasks in offsets
+    starting at their offset.
+    """
+    fixed = []
+    moved = []
+    for task in tasks:
+        interval = movable_interval(task)
+        if interval is not None and task.name in offsets:
+            moved.append((interval, offsets[task.name]))
+        else:
+            fixed.append(task)
+    profile = fixed_profile(fixed, date)
+    for interval, offset in moved:
+        for minute in range(offset, day_minutes, interval):
+            profile[minute] += 1
+    return profile
+
+def plan_offsets(tasks, pinned=(), date=None):
+    """
+    Return dict of task name to offset in minutes for the movable tasks, see
+    movable_interval, that are not pinned by a name or wildcard in pinned.
+
+    :param date:
+        Day to profile the fixed tasks on. Default reference_date.
+    """
+    if date is None:
+        date = reference_date(tasks)
+    movable = []
+    fixed = []
+    for task in tasks:
+        interval = movable_interval(task)
+        if interval is None or is_pinned(task, pinned):
+            fixed.append(task)
+        else:
+            movable.append((interval, task.name))
+    profile = fixed_profile(fixed, date)
+
+    offsets = {}
+    # Every minute, nothing to choose.
+    every_minute = [task_name for interval, task_name in movable if interval == 1]
+    if every_minute:
+        profile = [count + len(every_minute) for count in profile]
+        offsets.update(dict.fromkeys(every_minute, 0))
+    # Most frequent launches first, they constrain the most minutes.
+    for interval, task_name in sorted(movable):
+        if interval == 1:
+            continue
+        preferred = zlib.crc32(task_name.encode('utf-8')) % interval
+        best = None
+        for offset in range(interval):
+            minutes = profile[offset::interval]
+            key = (max(minutes), sum(minutes), (offset - preferred) % interval)
+            if best is None or key < best[0]:
+                best = (key, offset)
+        offset = best[1]
+        profile[offset::interval] = [count + 1 for count in profile[offset::interval]]
+        offsets[task_name] = offset
+    return offsets
+
+def apply_offset(task, offsets):
+    """
+    Replace the EveryMinutes trigger of task, if it is named in offsets,
+    with one starting at its offset. Done before the task is rendered or
+    hashed.
+    """
+    offset = offsets.get(task.name)
+    if offset is None:
+        return
+    task.triggers = [
+        with_offset(trigger, offset) if interval_minutes(trigger) else trigger
+        for trigger in task.triggers
+    ]
+
+def apply_offsets(tasks, offsets):
+    for task in tasks:
+        apply_offset(task, offsets)
+
+def configured_offsets(config_module, tasks=None):
+    """
+    Offsets to apply at render time: from the QUARTZ_OFFSETS_FILE JSON file,
+    or planned when QUARTZ_SPREAD is true, with QUARTZ_PINNED names or
+    wildcards left alone. None if neither is set.
+
+    :param tasks:
+        The configured tasks, if not QUARTZ_TASKS.
+    """
+    if tasks is None:
+        tasks = config_module.QUARTZ_TASKS
+    path = getattr(config_module, 'QUARTZ_OFFSETS_FILE', None)
+    if path:
+        return load_offsets(path)
+    if getattr(config_module, 'QUARTZ_SPREAD', False):
+        return plan_offsets(
+            tasks,
+            pinned = getattr(config_module, 'QUARTZ_PINNED', ()),
+        )
+
+def load_offsets(path):
+    with open(path) as offsets_file:
+        return json.load(offsets_file)
+
+def write_offsets(offsets, file):
+    json.dump(offsets, file, indent=2, sort_keys=True)
+    file.write('\n')
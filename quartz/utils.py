@@ -1,3 +1,4 @@
+import fnmatch
 import importlib
 import logging
 import os
@@ -12,11 +13,11 @@ from operator import itemgetter
 from pprint import pprint
 
 import jinja2
-import win32security
 
 from lxml import etree
 
 from . import const
+from . import executor
 
 def basename_without_extension(path):
     """
@@ -57,7 +58,18 @@ def get_config_module(raise_=True):
             raise
     else:
         config_module = importlib.import_module(config_path)
-        return config_module
+        return materialize_tasks(config_module)
+
+def materialize_tasks(config_module):
+    """
+    Replace the config module's QUARTZ_TASKS, which may be any iterable like
+    a generator, with a tuple of its tasks, that every reader can iterate
+    again. Return the module.
+    """
+    tasks = config_module.QUARTZ_TASKS
+    if not isinstance(tasks, tuple):
+        config_module.QUARTZ_TASKS = tuple(tasks)
+    return config_module
 
 def get_jinja_env():
     """
@@ -91,6 +103,22 @@ def managed_tempfiles(class_=tempfile.NamedTemporaryFile, **base_kwargs):
             except OSError:
                 pass
 
+@contextmanager
+def removed_tempfile(**kwargs):
+    """
+    Context manager for a NamedTemporaryFile that other processes can open
+    once it is closed, and that is removed on exit.
+    """
+    file = tempfile.NamedTemporaryFile(delete=False, **kwargs)
+    try:
+        yield file
+    finally:
+        file.close()
+        try:
+            os.remove(file.name)
+        except OSError:
+            pass
+
 def set_file_permissions(file_path, user, permission_level):
     """
     Sets permissions on a file for a specified user using icacls.
@@ -114,10 +142,8 @@ def set_file_permissions(file_path, user, permission_level):
 
     # Run the icacls command to set permissions
     grant_option = f"{user}:{permission_level}"
-    result = subprocess.run(
+    result = executor.run(
         ["icacls", file_path, "/grant", grant_option],
-        capture_output = True,
-        check = True,
         text = True,
     )
     return result
@@ -128,16 +154,38 @@ def shell_pattern_regex(pattern):
     """
     return re.compile(fnmatch.translate(pattern))
 
+def name_matcher(patterns):
+    """
+    Return a callable testing if a name is one of patterns or matches one of
+    the wildcard patterns. Plain names are looked up in a set and wildcards
+    are compiled into one regex.
+    """
+    names = set()
+    wildcards = []
+    for pattern in patterns:
+        if any(char in pattern for char in '*?['):
+            wildcards.append(pattern)
+        else:
+            names.add(pattern)
+    regex = None
+    if wildcards:
+        regex = re.compile('|'.join(map(fnmatch.translate, wildcards)))
+
+    def matches(name):
+        return name in names or (regex is not None and regex.match(name) is not None)
+
+    return matches
+
+def isoformat_or_none(value):
+    if value is not None:
+        return value.isoformat()
+
 def run_with_logger(logger, command, capture_with_pipe=True):
     """
     Context manager to run a subprocess command and log if exited with error.
     """
-    kwargs = dict(check=True)
-    if capture_with_pipe:
-        kwargs['stdout'] = subprocess.PIPE
-        kwargs['stderr'] = subprocess.PIPE
     try:
-        result = subprocess.run(command, **kwargs)
+        result = executor.run(command, capture=capture_with_pipe)
     except subprocess.CalledProcessError as e:
         logger.exception('An exception occurred.')
         if e.stdout:
@@ -145,6 +193,9 @@ def run_with_logger(logger, command, capture_with_pipe=True):
         if e.stderr:
             logger.error('stderr: %s', e.stderr)
         raise
+    except subprocess.TimeoutExpired as e:
+        logger.error('Killed after %s seconds: %s', e.timeout, e.cmd)
+        raise
     else:
         return result
 
@@ -236,6 +287,9 @@ def account_info(string_sid):
     """
     Return dict of account info for a SID.
     """
+    # pywin32 is only needed, and installable, on Windows.
+    import win32security
+
     sid = win32security.ConvertStringSidToSid(string_sid)
     name, domain, type_ = win32security.LookupAccountSid(None, sid)
     account_type = account_type_map.get(type_, 'Unknown')
@@ -246,6 +300,6 @@ def get_user_sid(username):
     Return SID from username.
     """
     command = f'wmic useraccount where name="{username}" get sid'
-    result = subprocess.run(command, capture_output=True, text=True, shell=True)
+    result = executor.run(command, check=False, text=True, shell=True)
     _, sid = result.stdout.split()
     return sid
@@ -1,8 +1,89 @@
+import datetime
+import os
 import re
+import stat
 
 iso8601_duration_re = re.compile(
-    r'^P(?:(\d+D)?(T(?:(\d+H)?(\d+M)?(\d+S)?)))?$')
+    r'^P(?!$)'
+    r'(?:(?P<years>\d+(?:[.,]\d+)?)Y)?'
+    r'(?:(?P<months>\d+(?:[.,]\d+)?)M)?'
+    r'(?:(?P<weeks>\d+(?:[.,]\d+)?)W)?'
+    r'(?:(?P<days>\d+(?:[.,]\d+)?)D)?'
+    r'(?:T(?!$)'
+    r'(?:(?P<hours>\d+(?:[.,]\d+)?)H)?'
+    r'(?:(?P<minutes>\d+(?:[.,]\d+)?)M)?'
+    r'(?:(?P<seconds>\d+(?:[.,]\d+)?)S)?'
+    r')?$'
+)
+
+# Seconds in each fixed length unit.
+duration_unit_seconds = {
+    'weeks': 7 * 24 * 60 * 60,
+    'days': 24 * 60 * 60,
+    'hours': 60 * 60,
+    'minutes': 60,
+    'seconds': 1,
+}
+
+def parse_iso8601_duration(duration):
+    """
+    Parse an ISO 8601 duration, like "PT5M" or "P1DT12H", into a
+    datetime.timedelta. Only the smallest unit given may have a fraction.
+    Years and months have no fixed length and raise ValueError unless zero.
+    """
+    match = iso8601_duration_re.match(duration)
+    if match is None:
+        raise ValueError(f'Invalid ISO 8601 duration {duration!r}.')
+    values = {
+        unit: float(value.replace(',', '.'))
+        for unit, value in match.groupdict().items()
+        if value is not None
+    }
+    fractional = [
+        unit for unit, value in match.groupdict().items()
+        if value is not None and not value.isdigit()
+    ]
+    if fractional and fractional[-1] != list(values)[-1]:
+        raise ValueError(f'Only the smallest unit may have a fraction {duration!r}.')
+    if values.pop('years', 0) or values.pop('months', 0):
+        raise ValueError(f'Years and months are not a fixed length {duration!r}.')
+    return datetime.timedelta(seconds=sum(
+        value * duration_unit_seconds[unit] for unit, value in values.items()
+    ))
 
 def iso8601_duration(duration):
     match = iso8601_duration_re.match(duration)
     return bool(match)
+
+
+class StatCache:
+    """
+    Memoized os.stat for checking paths shared by many actions, like a
+    working directory and its venv's pythonw.exe.
+    """
+
+    def __init__(self):
+        # Path to stat result, or None if it does not exist.
+        self.stats = {}
+
+    def stat(self, path):
+        try:
+            return self.stats[path]
+        except KeyError:
+            try:
+                result = os.stat(path)
+            except (OSError, TypeError, ValueError):
+                result = None
+            self.stats[path] = result
+            return result
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def isdir(self, path):
+        result = self.stat(path)
+        return result is not None and stat.S_ISDIR(result.st_mode)
+
+    def isfile(self, path):
+        result = self.stat(path)
+        return result is not None and stat.S_ISREG(result.st_mode)
@@ -0,0 +1,322 @@
+"""
+Apply configuration changes as they are saved.
+"""
+import importlib
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+from . import check
+from . import models
+from . import plan
+from . import profiling
+from . import render
+from . import schtasks
+from . import spread
+from . import utils
+
+def config_root(config_module):
+    """
+    Directory of the config module, or of its package.
+    """
+    return os.path.dirname(os.path.abspath(config_module.__file__))
+
+def spec_root(config_name):
+    """
+    Directory the config module would be imported from, without running it.
+    """
+    try:
+        spec = importlib.util.find_spec(config_name)
+    except Exception:
+        spec = None
+    if spec is None or not spec.origin:
+        return os.getcwd()
+    return os.path.dirname(os.path.abspath(spec.origin))
+
+# Never reloaded or watched, even when the config is next to it.
+package_directory = os.path.dirname(os.path.abspath(__file__))
+
+def module_files(directories):
+    """
+    Dict of module name to file, for imported modules under directories.
+    """
+    directories = tuple(os.path.join(os.path.abspath(path), '') for path in directories)
+    package_prefix = os.path.join(package_directory, '')
+    files = {}
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None)
+        if not path:
+            continue
+        path = os.path.abspath(path)
+        if path.startswith(directories) and not path.startswith(package_prefix):
+            files[name] = path
+    return files
+
+def source_files(directories):
+    """
+    Python files under directories, so that new modules are noticed too.
+    """
+    files = set()
+    for directory in directories:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [
+                name for name in dirnames
+                if name != '__pycache__'
+                and os.path.join(dirpath, name) != package_directory
+            ]
+            for filename in filenames:
+                if filename.endswith('.py'):
+                    files.add(os.path.join(dirpath, filename))
+    return files
+
+def stat_snapshot(paths):
+    """
+    Dict of path to (mtime_ns, size), None for paths that do not exist.
+    """
+    snapshot = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            snapshot[path] = None
+        else:
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def reload_config(config_name, module_names=()):
+    """
+    Import the config module afresh, after dropping it and module_names, the
+    modules imported from its directories, from sys.modules. Return the
+    module, with QUARTZ_TASKS made a tuple, see utils.materialize_tasks.
+    """
+    for name in module_names:
+        sys.modules.pop(name, None)
+    sys.modules.pop(config_name, None)
+    importlib.invalidate_caches()
+    # Objects from the previous config are no longer shared.
+    models.clear_interned()
+    with profiling.span('config import'):
+        return utils.materialize_tasks(importlib.import_module(config_name))
+
+
+class ConfigCache:
+    """
+    The config module for a long running process, imported afresh only when
+    the files of its directories changed since, checked on each get.
+    """
+
+    def __init__(self, config_name, directories=()):
+        """
+        :param directories:
+            Extra directories to check besides the config module's.
+        """
+        self.config_name = config_name
+        self.directories = list(directories)
+        self.lock = threading.Lock()
+        self.config_module = None
+        self.snapshot = None
+        self.module_names = set()
+
+    def watched_directories(self, config_module):
+        return [config_root(config_module)] + self.directories
+
+    def get(self):
+        """
+        Return the config module, reloaded if its files changed. Import
+        errors are raised, the next get tries again.
+        """
+        with self.lock:
+            if self.config_module is not None:
+                directories = self.watched_directories(self.config_module)
+                # Before importing, changes made meanwhile reload next time.
+                snapshot = stat_snapshot(source_files(directories))
+                if snapshot == self.snapshot:
+                    return self.config_module
+            config_module = reload_config(self.config_name, self.module_names)
+            directories = self.watched_directories(config_module)
+            if self.config_module is None:
+                snapshot = stat_snapshot(source_files(directories))
+            self.module_names = set(module_files(directories))
+            self.config_module = config_module
+            self.snapshot = snapshot
+            return config_module
+
+
+class Watcher:
+    """
+    Reload the config module when its files change and apply the tasks whose
+    rendered XML changed.
+    """
+
+    def __init__(
+        self,
+        config_name,
+        apply,
+        logger,
+        directories = (),
+        interval = 1.0,
+        debounce = 0.5,
+        prune = False,
+        validate_file_exists = False,
+        allow_empty_prune = False,
+    ):
+        """
+        :param config_name:
+            Importable name of the config module.
+        :param apply:
+            Callable taking a list of plan.PlanItem and applying them.
+        :param directories:
+            Extra directories to watch besides the config module's.
+        :param interval:
+            Seconds between polls of the files.
+        :param debounce:
+            Seconds the files must be unchanged before reloading.
+        :param prune:
+            Delete tasks removed from the config, in folders it owns.
+        :param allow_empty_prune:
+            Prune even when the config has no tasks, see plan.check_prune.
+        """
+        self.config_name = config_name
+        self.apply = apply
+        self.logger = logger
+        self.directories = list(directories)
+        self.interval = interval
+        self.debounce = debounce
+        self.prune = prune
+        self.validate_file_exists = validate_file_exists
+        self.allow_empty_prune = allow_empty_prune
+        # Reused across reloads.
+        self.renderer = render.TaskRenderer(utils.get_jinja_env())
+        # Casefolded task name to the XML last applied, starting from the
+        # registered tasks' state on the first apply.
+        self.applied = None
+        self.configured_names = []
+        self.folders = set()
+        self.module_names = set()
+
+    def watched_directories(self, config_module):
+        return [config_root(config_module)] + self.directories
+
+    def load(self):
+        """
+        Import the config module afresh, with the modules imported from its
+        directories. Return the module or None if it failed to import.
+        """
+        try:
+            config_module = reload_config(self.config_name, self.module_names)
+        except Exception:
+            self.logger.exception('Failed to load %s', self.config_name)
+            return None
+        directories = self.watched_directories(config_module)
+        self.module_names = set(module_files(directories))
+        return config_module
+
+    def render_all(self, config_module):
+        check.raise_for_errors(
+            config_module.QUARTZ_TASKS,
+            file_exists = self.validate_file_exists,
+        )
+        offsets = spread.configured_offsets(config_module)
+        if offsets:
+            spread.apply_offsets(config_module.QUARTZ_TASKS, offsets)
+        rendered = []
+        configured_names = []
+        for task in config_module.QUARTZ_TASKS:
+            configured_names.append(task.name)
+            rendered.append((task, self.renderer.render(task)))
+        return rendered, configured_names
+
+    def changed_items(self, rendered, configured_names, config_module):
+        """
+        Plan items for what changed since the last apply.
+        """
+        folders = plan.owned_folders(config_module, configured_names)
+        if self.applied is None:
+            # First run, plan against the registered tasks.
+            with profiling.span('listing'):
+                listing = [row['TaskName'] for row in schtasks.get_tasks()]
+            return plan.compute(
+                rendered,
+                listing,
+                configured_names,
+                prune = self.prune,
+                folders = folders,
+                allow_empty_prune = self.allow_empty_prune,
+            )
+        items = []
+        for task, task_xml in rendered:
+            key = schtasks.normalize_task_name(task.name).casefold()
+            previous = self.applied.get(key)
+            if previous == task_xml:
+                continue
+            action = plan.CREATE if previous is None else plan.OVERWRITE
+            items.append(plan.PlanItem(action, task.name, task, task_xml))
+        if self.prune:
+            plan.check_prune(configured_names, self.allow_empty_prune)
+            configured = {
+                schtasks.normalize_task_name(name).casefold()
+                for name in configured_names
+            }
+            for name in self.configured_names:
+                key = schtasks.normalize_task_name(name).casefold()
+                if key not in configured and plan.folder_of(name).casefold() in folders:
+                    items.append(plan.PlanItem(plan.DELETE, name, None, None))
+        return items
+
+    def apply_config(self, config_module):
+        """
+        Apply the changes of a loaded config. Errors are logged, leaving the
+        last applied state to compare against.
+        """
+        try:
+            rendered, configured_names = self.render_all(config_module)
+            items = self.changed_items(rendered, configured_names, config_module)
+            changes = [item for item in items if item.action != plan.UNCHANGED]
+            if changes:
+                self.apply(changes)
+        except Exception:
+            self.logger.exception('Failed to apply %s', self.config_name)
+            return
+        for item in changes:
+            self.logger.info('%s %s', item.action, item.task_name)
+        self.applied = {
+            schtasks.normalize_task_name(task.name).casefold(): task_xml
+            for task, task_xml in rendered
+        }
+        self.configured_names = configured_names
+
+    def watch(self, iterations=None):
+        """
+        Poll the config files, reloading and applying after changes. Runs
+        forever unless iterations, of polls, is given.
+        """
+        config_module = self.load()
+        if config_module is not None:
+            self.apply_config(config_module)
+            directories = self.watched_directories(config_module)
+        else:
+            # Nothing imported, watch where the module would be found.
+            directories = [spec_root(self.config_name)] + self.directories
+        snapshot = stat_snapshot(source_files(directories))
+        changed_at = None
+        while iterations is None or iterations > 0:
+            if iterations is not None:
+                iterations -= 1
+            time.sleep(self.interval)
+            current = stat_snapshot(source_files(directories))
+            if current != snapshot:
+                snapshot = current
+                changed_at = time.monotonic()
+                continue
+            if changed_at is None or time.monotonic() - changed_at < self.debounce:
+                continue
+            changed_at = None
+            self.logger.info('Reloading %s', self.config_name)
+            config_module = self.load()
+            if config_module is not None:
+                self.apply_config(config_module)
+                directories = self.watched_directories(config_module)
+                snapshot = stat_snapshot(source_files(directories))
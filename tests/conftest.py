@@ -0,0 +1,41 @@
+import os
+import sys
+import textwrap
+
+import pytest
+
+from quartz import const
+from quartz import executor
+
+@pytest.fixture
+def use_runner(monkeypatch):
+    """
+    Function setting the default executor to one running commands with a
+    runner, like fake.FakeFleet, for the test.
+    """
+    def use(runner, **kwargs):
+        default_executor = executor.Executor(runner=runner, **kwargs)
+        monkeypatch.setattr(executor, 'default_executor', default_executor)
+        return default_executor
+    return use
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    """
+    Function writing a config module from source, importable by the
+    returned name and named by the config environment variable.
+    """
+    names = []
+
+    def write(source, name='quartz_test_config'):
+        (tmp_path / f'{name}.py').write_text(textwrap.dedent(source))
+        names.append(name)
+        monkeypatch.setenv(const.CONFIGVAR, name)
+        return name
+
+    monkeypatch.syspath_prepend(str(tmp_path))
+    # Templates are found from the working directory.
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    yield write
+    for name in names:
+        sys.modules.pop(name, None)
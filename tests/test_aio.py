@@ -0,0 +1,84 @@
+import asyncio
+import subprocess
+import sys
+
+import pytest
+
+from quartz import aio
+from quartz import fake
+from quartz import schtasks
+
+task_xml = '<Task xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task"/>'
+
+listing = (
+    '"TaskName","Next Run Time","Status"\r\n'
+    '"\\One","N/A","Ready"\r\n'
+    '"\\Two","N/A","Status\r\non two lines, with ""quotes"""\r\n'
+    '\r\n'
+    '"TaskName","Next Run Time","Status"\r\n'
+    '"\\Three","N/A","Ready"\r\n'
+)
+
+@pytest.fixture
+def use_async_runner(monkeypatch):
+    def use(runner):
+        monkeypatch.setattr(aio, 'default_executor', aio.AsyncExecutor(runner=runner))
+        return aio.default_executor
+    return use
+
+async def collect(async_iterable):
+    return [item async for item in async_iterable]
+
+def test_get_tasks_multi_line_fields(use_async_runner):
+    def runner(command, timeout=None, **kwargs):
+        return subprocess.CompletedProcess(command, 0, listing.encode(), b'')
+
+    use_async_runner(runner)
+    rows = asyncio.run(collect(aio.get_tasks()))
+    assert [row['TaskName'] for row in rows] == ['\\One', '\\Two', '\\Three']
+    assert rows[1]['Status'] == 'Status\r\non two lines, with "quotes"'
+    assert rows[2]['Status'] == 'Ready'
+
+def test_operations_on_fake_fleet(use_async_runner, tmp_path):
+    fleet = fake.FakeFleet()
+    use_async_runner(fleet)
+    xml_path = tmp_path / 'task.xml'
+    xml_path.write_text(task_xml, encoding='utf-8')
+
+    async def main():
+        await aio.task_create_from_xml('\\Async\\Task', str(xml_path), force=True)
+        created = await aio.exists('\\Async\\Task')
+        rows = await collect(aio.get_tasks())
+        await aio.delete('\\Async\\Task')
+        return created, rows, await aio.exists('\\Async\\Task')
+
+    created, rows, exists_after = asyncio.run(main())
+    assert created
+    assert [row['TaskName'] for row in rows] == ['\\Async\\Task']
+    assert not exists_after
+    assert fleet.scheduler().task_names() == []
+
+def test_failed_command_hides_password(use_async_runner):
+    use_async_runner(fake.FakeFleet())
+    with pytest.raises(subprocess.CalledProcessError) as info:
+        asyncio.run(aio.task_run_as('\\Missing', 'user', 'swordfish'))
+    assert 'swordfish' not in str(info.value)
+
+def test_stream_subprocess_lines():
+    command = [sys.executable, '-c', 'import sys; print("a"); print("b"); sys.stderr.write("x" * 200000)']
+    async_executor = aio.AsyncExecutor()
+    lines = asyncio.run(collect(async_executor.stream(command, kind='python')))
+    assert [line.strip() for line in lines] == ['a', 'b']
+
+def test_stream_subprocess_timeout():
+    command = [sys.executable, '-c', 'import time; print("a", flush=True); time.sleep(30)']
+    async_executor = aio.AsyncExecutor(timeouts={'python': 0.5})
+    with pytest.raises(subprocess.TimeoutExpired):
+        asyncio.run(collect(async_executor.stream(command, kind='python')))
+    assert async_executor.metrics_summary()['python']['timeouts'] == 1
+
+def test_run_subprocess_failure():
+    command = [sys.executable, '-c', 'import sys; sys.exit(3)']
+    with pytest.raises(subprocess.CalledProcessError) as info:
+        asyncio.run(aio.AsyncExecutor().run(command, kind='python'))
+    assert info.value.returncode == 3
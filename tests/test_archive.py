@@ -0,0 +1,88 @@
+import io
+import json
+import tarfile
+
+import pytest
+
+from quartz import archive
+
+def document(command):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Task xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task">\n'
+        f'    <Actions><Exec><Command>{command}</Command></Exec></Actions>\n'
+        '</Task>\n'
+    ).encode('utf-8')
+
+tasks = {
+    '\\A': document('a.exe'),
+    '\\B': document('b.exe'),
+    # Same content as A, stored once.
+    '\\C': document('a.exe'),
+}
+
+@pytest.mark.parametrize('suffix', ['.zip', '.tar.gz'])
+def test_archive_round_trip(tmp_path, suffix):
+    path = str(tmp_path / ('dump' + suffix))
+    with archive.open_archive_writer(path) as writer:
+        new = [writer.add(task_name, data) for task_name, data in tasks.items()]
+    assert new == [True, True, False]
+    entries = {entry.task_name: entry for entry in archive.read_dump(path)}
+    assert sorted(entries) == sorted(tasks)
+    for task_name, data in tasks.items():
+        assert entries[task_name].canonical == archive.canonical_xml(data)
+        assert entries[task_name].error is None
+
+def write_tar(path, members):
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+def test_tar_streamed(tmp_path):
+    path = str(tmp_path / 'dump.tar.gz')
+    with archive.open_archive_writer(path) as writer:
+        for task_name, data in tasks.items():
+            if writer.add(task_name, data):
+                # Written as it is added.
+                digest = writer.tasks[task_name]
+                assert writer.archive.getmembers()[-1].name == archive.object_name(digest)
+    with tarfile.open(path, 'r:gz') as tar:
+        names = tar.getnames()
+    assert names[-1] == archive.manifest_name
+    assert len(names) == 3
+
+def test_tar_manifest_first(tmp_path):
+    # As written when the manifest came first.
+    path = str(tmp_path / 'dump.tar.gz')
+    canonical = archive.canonical_xml(tasks['\\A'])
+    digest = archive.content_hash(canonical)
+    manifest = json.dumps(archive.manifest_dict({'\\A': digest})).encode('utf-8')
+    write_tar(path, [(archive.manifest_name, manifest), (archive.object_name(digest), canonical)])
+    assert list(archive.read_dump(path)) == [('\\A', canonical, None)]
+
+def test_tar_without_manifest(tmp_path):
+    path = str(tmp_path / 'dump.tar.gz')
+    write_tar(path, [(archive.object_name('0' * 64), b'<Task/>')])
+    with pytest.raises(ValueError):
+        list(archive.read_dump(path))
+
+def test_damaged_directory_document(tmp_path):
+    (tmp_path / 'Good.xml').write_bytes(tasks['\\A'])
+    (tmp_path / 'Damaged.xml').write_bytes(b'<Task><Actions>')
+    entries = list(archive.read_dump(str(tmp_path)))
+    damaged, good = entries
+    assert damaged.task_name == '\\Damaged'
+    assert damaged.canonical is None
+    assert damaged.error is not None
+    assert good == ('\\Good', archive.canonical_xml(tasks['\\A']), None)
+
+def test_tar_manifest_last(tmp_path):
+    path = str(tmp_path / 'dump.tar.gz')
+    canonical = archive.canonical_xml(tasks['\\A'])
+    digest = archive.content_hash(canonical)
+    manifest = json.dumps(archive.manifest_dict({'\\A': digest, '\\C': digest})).encode('utf-8')
+    write_tar(path, [(archive.object_name(digest), canonical), (archive.manifest_name, manifest)])
+    entries = list(archive.read_dump(path))
+    assert sorted(entries) == [('\\A', canonical, None), ('\\C', canonical, None)]
@@ -0,0 +1,78 @@
+import pytest
+
+from quartz import bench
+from quartz import fake
+
+class RecordingRunner:
+    """
+    Runner recording commands, raising fail_with on the first command of
+    fail_on kind.
+    """
+
+    def __init__(self, runner, fail_on=None, fail_with=RuntimeError):
+        self.runner = runner
+        self.fail_on = fail_on
+        self.fail_with = fail_with
+        self.commands = []
+
+    def __call__(self, command, timeout=None, **kwargs):
+        self.commands.append(command)
+        if self.fail_on is not None and command[1:2] == [self.fail_on]:
+            self.fail_on = None
+            raise self.fail_with('interrupted')
+        return self.runner(command, timeout=timeout, **kwargs)
+
+    def folder_deleted(self, folder):
+        _, name = folder.rsplit('\\', 1)
+        return any(
+            command[0] == 'PowerShell' and f"DeleteFolder('{name}'" in command[-1]
+            for command in self.commands
+        )
+
+@pytest.fixture
+def fleet():
+    return fake.FakeFleet()
+
+def make_runner(fleet, **kwargs):
+    saturated = fake.SaturatedRunner(fleet, capacity=2, latency=0.001, error_rate=0.0)
+    return RecordingRunner(saturated, **kwargs)
+
+def test_bench_cleans_up(fleet, use_runner):
+    runner = make_runner(fleet)
+    use_runner(runner, max_concurrency=4)
+    result = bench.Bench([1, 2, 4], count=5).run()
+    assert [level['level'] for level in result['levels']] == [1, 2, 4]
+    assert all(level['errors'] == 0 for level in result['levels'])
+    assert result['recommended'] in (1, 2, 4)
+    assert result['left'] == []
+    assert fleet.scheduler().task_names() == []
+    assert runner.folder_deleted(bench.default_folder)
+
+def test_bench_cleans_up_after_exception(fleet, use_runner):
+    runner = make_runner(fleet, fail_on='/change')
+    use_runner(runner, max_concurrency=4)
+    with pytest.raises(RuntimeError):
+        bench.Bench([2], count=5).run()
+    # Interrupted after the tasks of the level were created.
+    assert 'create' in fleet.scheduler().calls
+    assert fleet.scheduler().task_names() == []
+    assert runner.folder_deleted(bench.default_folder)
+
+def test_bench_refuses_shared_folder(fleet, use_runner, tmp_path):
+    xml_path = tmp_path / 'task.xml'
+    xml_path.write_text(bench.task_xml, encoding='utf-8')
+    fleet.scheduler().create(bench.default_folder + '\\Mine', str(xml_path))
+    use_runner(make_runner(fleet))
+    with pytest.raises(bench.ScratchFolderError):
+        bench.Bench([1], count=1).run()
+    assert fleet.scheduler().task_names() == [bench.default_folder + '\\Mine']
+
+def test_recommend_within_error_rate():
+    levels = [
+        dict(level=1, count=100, errors=0, ops_per_second=10.0, operations={}),
+        dict(level=2, count=100, errors=1, ops_per_second=19.0, operations={}),
+        dict(level=4, count=100, errors=2, ops_per_second=40.0, operations={}),
+    ]
+    for level in levels:
+        level['operations'] = {'create': {}}
+    assert bench.recommend(levels) == 2
@@ -0,0 +1,77 @@
+import pytest
+
+from quartz import check
+from quartz import models
+
+def test_wrong_type_reported(tmp_path):
+    action = models.Action('Exec', 5, None, str(tmp_path))
+    tasks = [
+        models.Task('\\Bad', actions=[action]),
+        models.Task('\\Good', actions=[models.Action('Exec', 'cmd.exe', None, str(tmp_path))]),
+    ]
+    errors = check.check_tasks(tasks, file_exists=True)
+    assert [(error.task_name, error.path) for error in errors] == [('\\Bad', 'actions[0]')]
+
+def bad_trigger():
+    return models.Trigger(
+        'CalendarTrigger',
+        repetition = models.Repetition('five minutes', 'P1D', False),
+    )
+
+def test_errors_of_every_task_reported(tmp_path):
+    tasks = [
+        models.Task('\\A', actions=[models.Action('Exec', 5, None, str(tmp_path))]),
+        models.Task('\\B', triggers=[models.Trigger('Bogus')]),
+        models.Task('', triggers=[bad_trigger()]),
+    ]
+    errors = check.check_tasks(tasks, file_exists=True)
+    assert [(error.task_name, error.path) for error in errors] == [
+        ('\\A', 'actions[0]'),
+        ('\\B', 'triggers[0]'),
+        ('', ''),
+        ('', 'triggers[0].repetition'),
+    ]
+    assert errors[1].message == 'Invalid trigger type.'
+    assert errors[3].message == 'Invalid interval value.'
+    with pytest.raises(check.ConfigValidationError) as excinfo:
+        check.raise_for_errors(tasks, file_exists=True)
+    assert excinfo.value.errors == errors
+    assert str(excinfo.value).startswith('4 validation errors\n')
+
+def test_duplicate_names_differ_in_case():
+    tasks = [
+        models.Task('\\Jobs\\Backup'),
+        models.Task('\\Jobs\\Other'),
+        models.Task('\\jobs\\BACKUP'),
+        models.Task('Jobs\\backup'),
+    ]
+    errors = check.check_tasks(tasks)
+    assert errors == [
+        check.ValidationError('\\jobs\\BACKUP', '', 'Duplicate task name of \\Jobs\\Backup, task 0.'),
+        check.ValidationError('Jobs\\backup', '', 'Duplicate task name of \\Jobs\\Backup, task 0.'),
+    ]
+
+def test_shared_error_reported_for_each_task():
+    tasks = [
+        models.Task(f'\\T{index}', triggers=[models.Trigger('Daily'), bad_trigger()])
+        for index in range(3)
+    ]
+    # Interned, every task holds the same trigger objects.
+    assert tasks[0].triggers[1] is tasks[2].triggers[1]
+    errors = check.check_tasks(tasks)
+    assert [(error.task_name, error.path) for error in errors] == [
+        (f'\\T{index}', path)
+        for index in range(3)
+        for path in ('triggers[0]', 'triggers[1].repetition')
+    ]
+
+def test_select_finds_duplicates_of_unselected():
+    tasks = [
+        models.Task('\\Skipped', triggers=[models.Trigger('Bogus')]),
+        models.Task('\\Selected'),
+        models.Task('\\skipped'),
+    ]
+    errors = check.check_tasks(tasks, select=lambda name: name == '\\Selected')
+    assert errors == [
+        check.ValidationError('\\skipped', '', 'Duplicate task name of \\Skipped, task 0.'),
+    ]
@@ -0,0 +1,145 @@
+import datetime
+
+import pytest
+
+from quartz import client
+from quartz import fake
+from quartz import hosts
+from quartz import plan
+from quartz import schtasks
+
+task_xml = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<Task version="1.2" xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task">
+    <Actions Context="Author">
+        <Exec>
+            <Command>cmd.exe</Command>
+        </Exec>
+    </Actions>
+</Task>
+"""
+
+generator_config = """
+    import datetime
+
+    from quartz import models
+
+    def tasks():
+        for index in range(3):
+            yield models.Task(
+                f'\\\\Jobs\\\\t{index}',
+                actions = [models.Action('Exec', 'cmd.exe', '', '')],
+                triggers = [models.EveryMinutes(datetime.date(2024, 1, 1), 15, enabled=True)],
+            )
+
+    QUARTZ_TASKS = tasks()
+"""
+
+task_names = ['\\Jobs\\t0', '\\Jobs\\t1', '\\Jobs\\t2']
+
+@pytest.fixture
+def fleet(use_runner):
+    fleet = fake.FakeFleet(hosts=('alpha', 'beta', 'gamma'))
+    for host in ('alpha', 'beta', 'gamma'):
+        scheduler = fleet.scheduler(host)
+        for task_name in task_names + ['\\Jobs\\old']:
+            scheduler._register(task_name, task_xml)
+    use_runner(fleet)
+    return fleet
+
+def test_fan_out_shares_configured_tasks(fleet, config_file):
+    config_file(generator_config)
+    session = client.Client()
+    remotes = [hosts.Remote(host) for host in ('alpha', 'beta', 'gamma')]
+    results = hosts.fan_out(lambda: session.update(prune=True), remotes, workers=3)
+    for result in results:
+        assert result.error is None
+        assert result.result['deleted'] == 1
+        assert sorted(fleet.scheduler(result.remote.host).task_names()) == task_names
+    # A second call of the same session plans the same tasks.
+    with hosts.targeting(hosts.Remote('alpha')):
+        counts = session.update(prune=True)
+    assert counts['deleted'] == 0
+    assert sorted(fleet.scheduler('alpha').task_names()) == task_names
+
+def test_empty_config_not_pruned(fleet, config_file):
+    config_file("""
+        QUARTZ_FOLDERS = ['\\\\Jobs']
+        QUARTZ_TASKS = []
+    """)
+    session = client.Client()
+    with hosts.targeting(hosts.Remote('alpha')):
+        with pytest.raises(plan.EmptyPruneError):
+            session.update(prune=True)
+        assert len(fleet.scheduler('alpha').task_names()) == 4
+        counts = session.update(prune=True, allow_empty_prune=True)
+    assert counts['deleted'] == 4
+    assert fleet.scheduler('alpha').task_names() == []
+
+def test_rows_streamed_without_snapshot(fleet):
+    session = client.Client()
+    scheduler = fleet.scheduler('alpha')
+    with hosts.targeting(hosts.Remote('alpha')):
+        rows = session.iter_rows(['\\Jobs\\t*'])
+        assert next(rows)['TaskName'] in task_names
+        assert session.listings == {}
+        assert len(list(rows)) == 2
+        assert session.listings == {}
+        # A snapshot is taken for callers reading the rows more than once.
+        assert sorted(session.task_names()) == ['\\Jobs\\old'] + task_names
+        queries = scheduler.calls.count('query')
+        assert len(session.list_rows(sort='name')) == 4
+        assert scheduler.calls.count('query') == queries
+
+@pytest.fixture
+def timed_fleet(fleet, monkeypatch):
+    monkeypatch.setattr(schtasks, 'day_first', lambda: False)
+    scheduler = fleet.scheduler('alpha')
+    scheduler.set_run_times('\\Jobs\\t0', '02/03/2024 10:00:00', '02/02/2024 10:00:00')
+    scheduler.set_run_times('\\Jobs\\t1', '02/01/2024 09:00:00', '11/30/1999 12:00:00 AM')
+    scheduler.set_run_times('\\Jobs\\t2', 'N/A', '02/03/2024 08:00:00')
+    scheduler.set_run_times('\\Jobs\\old', 'Disabled')
+    return fleet
+
+def listed_names(rows):
+    return [row['TaskName'] for row in rows]
+
+def test_list_sorted_by_run_times(timed_fleet):
+    session = client.Client()
+    with hosts.targeting(hosts.Remote('alpha')):
+        # Tasks without a time sort last, by name.
+        assert listed_names(session.list_rows(sort='next-run')) == [
+            '\\Jobs\\t1', '\\Jobs\\t0', '\\Jobs\\old', '\\Jobs\\t2',
+        ]
+        assert listed_names(session.list_rows(sort='last-run')) == [
+            '\\Jobs\\t2', '\\Jobs\\t0', '\\Jobs\\old', '\\Jobs\\t1',
+        ]
+        assert listed_names(session.list_rows(sort='name')) == [
+            '\\Jobs\\old', '\\Jobs\\t0', '\\Jobs\\t1', '\\Jobs\\t2',
+        ]
+
+def test_list_due_within(timed_fleet):
+    session = client.Client()
+    now = datetime.datetime(2024, 2, 1, 12)
+    with hosts.targeting(hosts.Remote('alpha')):
+        # A next run already past is due.
+        assert listed_names(session.list_rows(
+            due_within = datetime.timedelta(days=1),
+            now = now,
+        )) == ['\\Jobs\\t1']
+        assert listed_names(session.list_rows(
+            due_within = datetime.timedelta(days=3),
+            sort = 'next-run',
+            now = now - datetime.timedelta(days=1),
+        )) == ['\\Jobs\\t1', '\\Jobs\\t0']
+
+def test_list_due_within_day_first(timed_fleet, monkeypatch):
+    monkeypatch.setattr(schtasks, 'day_first', lambda: True)
+    session = client.Client()
+    # Day first, 02/01/2024 is the 2nd of January and 02/03/2024 of March.
+    with hosts.targeting(hosts.Remote('alpha')):
+        rows = session.list_rows(
+            due_within = datetime.timedelta(days=1),
+            now = datetime.datetime(2024, 1, 1, 12),
+        )
+    assert listed_names(rows) == ['\\Jobs\\t1']
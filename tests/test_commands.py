@@ -0,0 +1,93 @@
+import collections
+import logging
+import os
+import subprocess
+import types
+
+import pytest
+
+from quartz import check
+from quartz import commands
+from quartz import models
+from quartz import plan
+
+def test_admin_operations_run_before_validation_error(monkeypatch):
+    batches = []
+
+    def run_admin_batch(operations, tempfile_creator, logger, pause_debug=False):
+        batches.append([operation['task_name'] for operation in operations])
+
+    monkeypatch.setattr(commands, 'run_admin_batch', run_admin_batch)
+    task = models.Task(
+        '\\Admin',
+        actions = [models.Action('Exec', 'cmd.exe', '', '')],
+        triggers = [models.BootTrigger()],
+    )
+    error = check.ConfigValidationError([check.ValidationError('\\Bad', '', 'invalid')])
+
+    def items():
+        yield plan.PlanItem(plan.CREATE, task.name, task, '<Task/>')
+        raise error
+
+    with pytest.raises(check.ConfigValidationError) as info:
+        commands.apply_plan(items(), logging.getLogger(__name__))
+    assert info.value is error
+    assert batches == [['\\Admin']]
+
+def test_failed_admin_batch_counts_failures(use_runner):
+    commands_run = []
+
+    def runner(command, timeout=None, **kwargs):
+        commands_run.append(command)
+        # The elevated batch exited with the code of its failed command.
+        return subprocess.CompletedProcess(command, 5, b'', b'')
+
+    use_runner(runner)
+    task = models.Task(
+        '\\Admin',
+        actions = [models.Action('Exec', 'cmd.exe', '', '')],
+        triggers = [models.BootTrigger()],
+    )
+    items = [plan.PlanItem(plan.CREATE, task.name, task, '<Task/>')]
+    task_counts = collections.Counter()
+    with pytest.raises(subprocess.CalledProcessError):
+        commands.apply_plan(items, logging.getLogger(__name__), task_counts=task_counts)
+    assert task_counts == {'failed': 1}
+    [command] = commands_run
+    assert 'exit $Process.ExitCode' in command[-1]
+
+def test_coalescing_key_has_every_apply_option(monkeypatch):
+    applied = []
+
+    class Client:
+        def update(self, **kwargs):
+            applied.append(kwargs)
+
+    class Coalescer:
+        def __init__(self, host_lock):
+            pass
+
+        def apply(self, key, task_names, apply):
+            applied.append(key)
+            apply(task_names)
+            return dict(pid=os.getpid(), requests=1, task_names=task_names)
+
+    monkeypatch.setattr(commands.lock, 'Coalescer', Coalescer)
+    monkeypatch.setattr(commands, 'host_lock', lambda args: None)
+    args = types.SimpleNamespace(
+        client = Client(),
+        tasks = None,
+        no_lock = False,
+        prune = False,
+        validate_file_exists = False,
+        elevation = 'batch',
+        pause_debug = True,
+        bulk = True,
+        allow_empty_prune = False,
+    )
+    commands.apply_update(args, collections.Counter())
+    key, update = applied
+    update.pop('task_names')
+    update.pop('task_counts')
+    assert set(update) <= set(key)
+    assert key['bulk'] and key['pause_debug']
@@ -0,0 +1,69 @@
+import logging
+
+from quartz import client
+from quartz import serve
+from quartz import spread
+from quartz import utils
+from quartz import watch
+
+generator_config = """
+    import datetime
+
+    from quartz import models
+
+    QUARTZ_SPREAD = True
+
+    def tasks():
+        for index in range(3):
+            yield models.Task(
+                f'\\\\Jobs\\\\t{index}',
+                actions = [models.Action('Exec', 'cmd.exe', '', '')],
+                triggers = [models.EveryMinutes(datetime.date(2024, 1, 1), 15, enabled=True)],
+            )
+
+    QUARTZ_TASKS = tasks()
+"""
+
+task_names = ['\\Jobs\\t0', '\\Jobs\\t1', '\\Jobs\\t2']
+
+def test_generator_materialized_on_import(config_file):
+    config_file(generator_config)
+    config_module = utils.get_config_module()
+    assert [task.name for task in config_module.QUARTZ_TASKS] == task_names
+    assert [task.name for task in config_module.QUARTZ_TASKS] == task_names
+
+def test_generator_watch(config_file):
+    name = config_file(generator_config)
+    watcher = watch.Watcher(name, lambda items: None, logging.getLogger(__name__))
+    config_module = watcher.load()
+    # Validated, spread and rendered, each reading every task.
+    rendered, configured_names = watcher.render_all(config_module)
+    assert configured_names == task_names
+    assert len(rendered) == 3
+
+def test_generator_serve_check(config_file):
+    name = config_file(generator_config)
+
+    class Inventory:
+        def snapshot(self, max_age):
+            return {}
+
+    api = serve.Api(Inventory(), lambda: watch.reload_config(name))
+    for max_age in (None, 0):
+        result = api.check({} if max_age is None else {'max_age': [str(max_age)]})
+        assert result == dict(configured=3, missing=task_names)
+
+def test_generator_spread(config_file):
+    name = config_file(generator_config)
+    config_module = watch.reload_config(name)
+    offsets = spread.configured_offsets(config_module)
+    assert sorted(offsets) == task_names
+    assert sorted(client.Client(config_module).spread()['offsets']) == task_names
+
+def test_generator_client(config_file):
+    config_file(generator_config)
+    session = client.Client()
+    assert session.validate() == []
+    assert [task.name for task in session.configured()] == task_names
+    assert [item.task_name for item in session.plan(with_listing=False)] == task_names
+    assert [item.task_name for item in session.plan(with_listing=False)] == task_names
@@ -0,0 +1,141 @@
+import concurrent.futures
+import subprocess
+import sys
+import time
+
+import pytest
+
+from quartz import executor
+from quartz import fake
+from quartz import hosts
+from quartz import schtasks
+
+def saturated_executor(capacity=4, error_rate=0.0, **kwargs):
+    runner = fake.SaturatedRunner(
+        fake.FakeFleet(hosts=('localhost', 'alpha', 'beta')),
+        capacity = capacity,
+        latency = 0.005,
+        slowdown = 0.5,
+        error_rate = error_rate,
+    )
+    return runner, executor.Executor(adaptive=True, runner=runner, **kwargs)
+
+def run_queries(query_executor, count, workers=32, remote=None):
+    def query(_):
+        with hosts.targeting(remote):
+            return query_executor.run(schtasks.get_tasks_command(), check=False)
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(query, range(count)))
+
+def test_limit_converges_near_capacity():
+    runner, query_executor = saturated_executor(max_concurrency=32, retries=0)
+    run_queries(query_executor, 400)
+    summary = query_executor.concurrency_summary()
+    assert summary['backoffs'] > 0
+    # Latency doubles at twice the capacity.
+    assert summary['average'] <= 12
+    assert runner.peak < 32
+
+def test_backoff_on_transient_errors():
+    limit = executor.AdaptiveLimit(16, min_limit=1)
+    for _ in range(8):
+        with limit.permit('query') as permit:
+            permit.complete(0.01)
+    assert limit.limit == 9
+    with limit.permit('query') as permit:
+        permit.complete(0.01, overloaded=True)
+    assert limit.limit == pytest.approx(9 * limit.backoff)
+    assert limit.summary()['backoffs'] == 1
+
+def test_backoff_once_per_generation():
+    limit = executor.AdaptiveLimit(16, min_limit=8)
+    with limit.permit('query') as first, limit.permit('query') as second:
+        first.complete(0.01, overloaded=True)
+        # Started under the limit just lowered.
+        second.complete(0.01, overloaded=True)
+    assert limit.summary()['backoffs'] == 1
+
+def test_slow_command_backs_off():
+    limit = executor.AdaptiveLimit(16, min_limit=4)
+    with limit.permit('query') as permit:
+        permit.complete(0.01)
+    with limit.permit('query') as permit:
+        permit.complete(0.01 * limit.latency_tolerance * 2)
+    assert limit.summary()['backoffs'] == 1
+
+def test_baselines_by_host():
+    limit = executor.AdaptiveLimit(16, min_limit=4)
+    with limit.permit('query', 'alpha') as permit:
+        permit.complete(0.01)
+    # A host answering at its own, slower, pace.
+    with limit.permit('query', 'beta') as permit:
+        permit.complete(0.1)
+    assert limit.summary()['backoffs'] == 0
+    assert set(limit.baselines) == {('alpha', 'query'), ('beta', 'query')}
+
+def test_timeouts_back_off():
+    runner, query_executor = saturated_executor(
+        capacity = 0,
+        max_concurrency = 8,
+        min_concurrency = 4,
+        timeouts = {'query': 0.001},
+        retries = 0,
+    )
+    with pytest.raises(subprocess.TimeoutExpired):
+        query_executor.run(schtasks.get_tasks_command())
+    assert query_executor.concurrency_summary()['backoffs'] == 1
+    assert query_executor.metrics_summary()['query']['timeouts'] == 1
+
+def test_transient_failures_retried_with_jitter(monkeypatch):
+    delays = []
+    retry_delay = executor.retry_delay
+
+    def recorded_delay(attempt):
+        delays.append(retry_delay(attempt))
+        return delays[-1]
+
+    monkeypatch.setattr(executor, 'retry_delay', recorded_delay)
+    runner, query_executor = saturated_executor(capacity=0, error_rate=1.0, retries=2)
+    result = query_executor.run(schtasks.get_tasks_command(), check=False)
+    assert result.returncode == 1
+    assert executor.is_transient(result.stderr)
+    metrics = query_executor.metrics_summary()['query']
+    assert (metrics['count'], metrics['retries']) == (3, 2)
+    assert len(delays) == 2
+    for attempt, delay in enumerate(delays):
+        assert 0 <= delay <= executor.retry_base_delay * 2 ** attempt
+
+def test_not_idempotent_not_retried():
+    runner, query_executor = saturated_executor(capacity=0, error_rate=1.0, retries=2)
+    command = schtasks.create_from_xml_command('\\Task', 'task.xml', force=False)
+    query_executor.run(command, check=False)
+    assert query_executor.metrics_summary()['create']['retries'] == 0
+
+def test_retry_delay_bounded():
+    for attempt in range(10):
+        delay = executor.retry_delay(attempt)
+        assert 0 <= delay <= min(executor.retry_max_delay, executor.retry_base_delay * 2 ** attempt)
+
+def test_stream_drains_stderr():
+    # More stderr than a pipe holds, before any stdout.
+    script = 'import sys; sys.stderr.write("x" * 1000000); sys.stderr.flush(); print("done"); sys.exit(1)'
+    stream_executor = executor.Executor(timeouts={'python': 30})
+    with pytest.raises(subprocess.CalledProcessError) as info:
+        with stream_executor.stream([sys.executable, '-c', script], kind='python') as process:
+            lines = list(process.stdout)
+    assert [line.strip() for line in lines] == ['done']
+    assert len(info.value.stderr) == 1000000
+    assert stream_executor.metrics_summary()['python']['timeouts'] == 0
+
+def test_stream_stopped_early():
+    script = 'import sys, time; print("a", flush=True); sys.stderr.write("x" * 1000000); time.sleep(30)'
+    stream_executor = executor.Executor(timeouts={'python': 30})
+    start = time.monotonic()
+    with pytest.raises(KeyError):
+        with stream_executor.stream([sys.executable, '-c', script], kind='python') as process:
+            assert process.stdout.readline().strip() == 'a'
+            raise KeyError('reader failed')
+    # Killed rather than waited for.
+    assert time.monotonic() - start < 10
+    assert process.returncode != 0
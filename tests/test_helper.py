@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+
+import pytest
+
+from quartz import fake
+from quartz import helper
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='UNIX socket address')
+
+task_xml = '<Task xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task"/>'
+
+@pytest.fixture
+def scheduler():
+    return fake.FakeScheduler(latency=0.001)
+
+@pytest.fixture
+def address(tmp_path, scheduler):
+    address = str(tmp_path / 'helper.sock')
+    authkey = helper.load_authkey(str(tmp_path / 'helper.key'), create=True)
+    server = helper.Helper(address, authkey, backend=scheduler, workers=4, idle_timeout=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    assert server.ready.wait(5)
+    yield address, authkey
+    server.stop()
+    thread.join(5)
+
+def create_operations(count):
+    return [
+        dict(op='create', task_name=f'\\Helper\\Task{index}', xml=task_xml)
+        for index in range(count)
+    ]
+
+def test_every_result_before_end(address, scheduler):
+    with helper.HelperClient(*address) as client:
+        for _ in range(20):
+            results = list(client.run(create_operations(8)))
+            assert sorted(result['id'] for result in results) == list(range(8))
+            assert all(result['ok'] for result in results)
+    assert len(scheduler.task_names()) == 8
+
+def test_failed_operation_result(address):
+    operations = [
+        dict(op='delete', task_name='\\Missing'),
+        dict(op='unknown', task_name='\\Task'),
+    ]
+    with helper.HelperClient(*address) as client:
+        results = sorted(client.run(operations), key=lambda result: result['id'])
+    assert [result['ok'] for result in results] == [False, False]
+    assert results[0]['returncode'] == 1
+    assert results[1]['error'] == "KeyError: 'unknown'"
+
+def test_load_authkey_private(tmp_path):
+    path = str(tmp_path / 'key')
+    key = helper.load_authkey(path, create=True)
+    assert helper.load_authkey(path) == key
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+def test_once_stops_after_connection(tmp_path, scheduler):
+    address = str(tmp_path / 'once.sock')
+    authkey = helper.new_authkey(str(tmp_path / 'helper.key'))
+    server = helper.Helper(address, authkey, backend=scheduler, idle_timeout=0, once=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    assert server.ready.wait(5)
+    with helper.HelperClient(address, authkey) as client:
+        assert all(result['ok'] for result in client.run(create_operations(3)))
+    thread.join(5)
+    assert not thread.is_alive()
+
+def test_connect_launches_with_new_key(tmp_path, scheduler, monkeypatch):
+    address = str(tmp_path / 'launched.sock')
+    authkey_path = str(tmp_path / 'helper.key')
+    old_key = helper.load_authkey(authkey_path, create=True)
+    launched = []
+
+    def launch_elevated(address, authkey_path, workers):
+        server = helper.Helper(
+            address,
+            helper.load_authkey(authkey_path),
+            backend = scheduler,
+            idle_timeout = 0,
+            once = True,
+        )
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        launched.append(thread)
+
+    monkeypatch.setattr(helper, 'launch_elevated', launch_elevated)
+    with helper.connect(address, authkey_path, timeout=5) as client:
+        assert all(result['ok'] for result in client.run(create_operations(2)))
+    assert helper.load_authkey(authkey_path) != old_key
+    launched[0].join(5)
+    assert not launched[0].is_alive()
+
+def test_launch_elevated_quotes_paths(monkeypatch):
+    commands = []
+    monkeypatch.setattr(helper.executor, 'run', lambda command, **kwargs: commands.append(command))
+    monkeypatch.setattr(helper.sys, 'executable', "C:\\Users\\O'Brien\\python.exe")
+    helper.launch_elevated(r'\\.\pipe\quartz-helper', "C:\\Users\\O'Brien\\.quartz\\helper.key")
+    command = commands[0]
+    file_path = command[command.index('-FilePath') + 1]
+    argument_list = command[command.index('-ArgumentList') + 1]
+    assert file_path == "'C:\\Users\\O''Brien\\python.exe'"
+    assert argument_list.startswith("'") and argument_list.endswith("'")
+    assert "O''Brien\\.quartz\\helper.key" in argument_list
+    assert "O'Brien" not in argument_list
+    assert argument_list.endswith("--once'")
@@ -0,0 +1,54 @@
+from quartz import history
+
+def event(event_id, time, instance_id='{1}', record=None, **data):
+    data.update(TaskName='\\Job', InstanceId=instance_id)
+    return dict(id=event_id, record=record, computer='host', time=time, data=data)
+
+def test_failure_after_completion_is_counted():
+    task_history = history.History()
+    task_history.ingest([
+        event(history.TASK_STARTED, 100.0),
+        event(history.TASK_COMPLETED, 130.0),
+        event(history.ACTION_COMPLETED, 130.0, ResultCode='0x1'),
+        event(history.TASK_TERMINATED, 130.0),
+    ])
+    stats = task_history.tasks['\\Job']
+    assert stats.runs == 1
+    assert stats.failures == 1
+    assert stats.terminated == 1
+    assert task_history.open == {}
+
+def test_failure_after_completion_in_later_ingest(tmp_path):
+    path = str(tmp_path / 'history.json')
+    task_history = history.History()
+    task_history.ingest([
+        event(history.TASK_STARTED, 100.0, record=1),
+        event(history.TASK_COMPLETED, 130.0, record=2),
+    ])
+    task_history.save(path)
+    task_history = history.load(path)
+    task_history.ingest([event(history.ACTION_COMPLETED, 130.0, record=3, ResultCode='2')])
+    stats = task_history.tasks['\\Job']
+    assert (stats.runs, stats.failures) == (1, 1)
+    assert task_history.open == {}
+
+def test_closed_instances_are_bounded(monkeypatch):
+    monkeypatch.setattr(history, 'max_closed_instances', 2)
+    task_history = history.History()
+    for index in range(3):
+        task_history.add(event(history.TASK_STARTED, 100.0, instance_id=str(index)))
+        task_history.add(event(history.TASK_COMPLETED, 110.0, instance_id=str(index)))
+    assert list(task_history.closed) == ['1', '2']
+
+def test_open_instances_expire_by_ingest_time(monkeypatch):
+    task_history = history.History(max_open_seconds=60)
+    now = 1000.0
+    monkeypatch.setattr(history.time, 'time', lambda: now)
+    # A failure without start or completion, and a run without completion.
+    task_history.add(event(history.ACTION_START_FAILED, 0.0, instance_id='a'))
+    task_history.add(event(history.TASK_STARTED, 500.0, instance_id='b'))
+    assert task_history.drop_stale() == 0
+    now += 61
+    task_history.add(event(history.TASK_STARTED, 0.0, instance_id='c'))
+    assert task_history.drop_stale() == 2
+    assert list(task_history.open) == ['c']
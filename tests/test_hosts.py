@@ -0,0 +1,89 @@
+import io
+import subprocess
+
+import pytest
+
+from quartz import fake
+from quartz import hosts
+from quartz import schtasks
+
+task_xml = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<Task version="1.2" xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task">
+    <Actions Context="Author">
+        <Exec>
+            <Command>cmd.exe</Command>
+        </Exec>
+    </Actions>
+</Task>
+"""
+
+@pytest.fixture
+def fleet(use_runner):
+    fleet = fake.FakeFleet(hosts=('alpha', 'beta', 'gamma'))
+    use_runner(fleet)
+    return fleet
+
+@pytest.fixture
+def xml_path(tmp_path):
+    path = tmp_path / 'task.xml'
+    path.write_text(task_xml, encoding='utf-8')
+    return str(path)
+
+def test_fan_out_targets_each_host(fleet, xml_path):
+    remotes = [hosts.Remote(host) for host in ('alpha', 'beta', 'gamma')]
+
+    def create():
+        host = hosts.current_host()
+        schtasks.task_create_from_xml(f'\\Fan\\{host}', xml_path, force=True)
+        print(f'created on {host}')
+        return host
+
+    results = hosts.fan_out(create, remotes, workers=3)
+    assert sorted(result.result for result in results) == ['alpha', 'beta', 'gamma']
+    for result in results:
+        host = result.remote.host
+        assert result.error is None
+        assert result.output == f'created on {host}\n'
+        assert fleet.scheduler(host).task_names() == [f'\\Fan\\{host}']
+
+def test_fan_out_failure_is_per_host(fleet):
+    remotes = [hosts.Remote('alpha'), hosts.Remote('unreachable')]
+    on_result = []
+
+    def list_tasks():
+        return list(schtasks.get_tasks())
+
+    results = hosts.fan_out(list_tasks, remotes, on_result=on_result.append)
+    assert on_result == results
+    by_host = {result.remote.host: result for result in results}
+    assert by_host['alpha'].error is None
+    assert isinstance(by_host['unreachable'].error, subprocess.CalledProcessError)
+
+def test_redact_password_options():
+    command = ['schtasks', '/change', '/s', 'alpha', '/u', 'admin', '/P', 'hunter2', '/rp', 'swordfish']
+    assert hosts.redact(command) == [
+        'schtasks', '/change', '/s', 'alpha', '/u', 'admin',
+        '/P', hosts.redacted_password, '/rp', hosts.redacted_password,
+    ]
+
+def test_redact_targeted_password():
+    with hosts.targeting(hosts.Remote('alpha', 'admin', 'hunter2')):
+        assert hosts.redact('Connect(alpha, admin, $null, hunter2)') == (
+            f'Connect(alpha, admin, $null, {hosts.redacted_password})'
+        )
+
+def test_failed_host_output_hides_passwords(fleet):
+    remote = hosts.Remote('unreachable', 'admin', 'hunter2')
+
+    def run_as():
+        schtasks.task_run_as('\\Task', 'user', 'swordfish')
+
+    [result] = hosts.fan_out(run_as, [remote])
+    assert 'hunter2' not in str(result.error)
+    assert 'swordfish' not in str(result.error)
+    output = io.StringIO()
+    hosts.print_host_result(result, file=output)
+    assert 'failed: CalledProcessError' in output.getvalue()
+    assert 'hunter2' not in output.getvalue()
+    assert 'swordfish' not in output.getvalue()
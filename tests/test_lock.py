@@ -0,0 +1,203 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from quartz import lock
+
+package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+hold_script = """
+import sys, time
+from quartz import lock
+with lock.HostLock('host', directory=sys.argv[1]):
+    print('locked', flush=True)
+    sys.stdin.readline()
+"""
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+def write_owner(host_lock, pid):
+    os.makedirs(host_lock.directory, exist_ok=True)
+    with open(host_lock.path, 'w', encoding='utf-8') as lock_file:
+        json.dump(dict(pid=pid, machine=socket.gethostname(), token='theirs'), lock_file)
+
+def test_contention_between_processes(tmp_path):
+    env = dict(os.environ, PYTHONPATH=package_root)
+    holder = subprocess.Popen(
+        [sys.executable, '-c', hold_script, str(tmp_path)],
+        stdin = subprocess.PIPE,
+        stdout = subprocess.PIPE,
+        text = True,
+        env = env,
+    )
+    try:
+        assert holder.stdout.readline() == 'locked\n'
+        host_lock = lock.HostLock('host', directory=str(tmp_path), timeout=0.3, poll_interval=0.05)
+        with pytest.raises(lock.LockTimeout):
+            host_lock.acquire()
+        assert host_lock.owner()['pid'] == holder.pid
+        holder.stdin.write('\n')
+        holder.stdin.flush()
+        assert holder.wait(10) == 0
+        host_lock.timeout = 10
+        with host_lock:
+            assert host_lock.owner()['pid'] == os.getpid()
+        assert host_lock.owner() is None
+    finally:
+        holder.kill()
+        holder.wait()
+
+def test_stale_lock_broken(tmp_path):
+    host_lock = lock.HostLock('host', directory=str(tmp_path))
+    write_owner(host_lock, dead_pid())
+    assert host_lock.try_acquire()
+    assert host_lock.owner()['token'] == host_lock.token
+    assert sorted(os.listdir(tmp_path)) == ['host.lock']
+
+def test_live_lock_not_broken(tmp_path):
+    host_lock = lock.HostLock('host', directory=str(tmp_path))
+    write_owner(host_lock, os.getpid())
+    assert not host_lock.try_acquire()
+    assert host_lock.owner()['token'] == 'theirs'
+
+def test_unwritten_lock_broken_when_old(tmp_path, monkeypatch):
+    host_lock = lock.HostLock('host', directory=str(tmp_path))
+    open(host_lock.path, 'w').close()
+    assert not host_lock.try_acquire()
+    monkeypatch.setattr(lock, 'unwritten_stale_seconds', 0)
+    assert host_lock.try_acquire()
+
+def test_stale_lock_broken_once(tmp_path):
+    for _ in range(20):
+        directory = tmp_path / str(_)
+        locks = [lock.HostLock('host', directory=str(directory)) for _ in range(8)]
+        write_owner(locks[0], dead_pid())
+        barrier = threading.Barrier(len(locks))
+        acquired = []
+
+        def acquire(host_lock):
+            barrier.wait()
+            if host_lock.try_acquire():
+                acquired.append(host_lock)
+
+        threads = [threading.Thread(target=acquire, args=(host_lock, )) for host_lock in locks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(acquired) == 1
+        assert acquired[0].owner()['token'] == acquired[0].token
+
+def test_lock_taken_after_stale_read_kept(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    first = lock.HostLock('host', directory=directory)
+    late = lock.HostLock('host', directory=directory)
+    third = lock.HostLock('host', directory=directory)
+    write_owner(first, dead_pid())
+    stale_owner = late.owner()
+    assert first.try_acquire()
+    # late read the stale owner before first broke and took the lock.
+    owners = [stale_owner]
+    monkeypatch.setattr(late, 'owner', lambda: owners.pop() if owners else lock.read_json(late.path))
+    read_json = lock.read_json
+
+    def read_moved(path):
+        if path.endswith('.stale'):
+            # Another process takes the lock while it is moved away.
+            third.try_acquire()
+        return read_json(path)
+
+    monkeypatch.setattr(lock, 'read_json', read_moved)
+    assert not late.try_acquire()
+    assert not third.token
+    assert first.owner()['token'] == first.token
+
+def queue_request(coalescer, stem, key, task_names, extension='.json', pid=None):
+    os.makedirs(coalescer.queue_directory, exist_ok=True)
+    request = dict(pid=pid or os.getpid(), key=key, task_names=task_names)
+    path = os.path.join(coalescer.queue_directory, stem + extension)
+    lock.write_json(path, request)
+    return path
+
+def test_coalescer_applies_queued_requests(tmp_path):
+    coalescer = lock.Coalescer(lock.HostLock('host', directory=str(tmp_path)))
+    key = dict(prune=False)
+    queue = coalescer.queue_directory
+    queue_request(coalescer, f'{os.getpid()}-a', key, ['\\b'])
+    # Claimed by a holder that failed before writing results.
+    queue_request(coalescer, f'{os.getpid()}-c', key, ['\\c', '\\a'], extension='.claimed')
+    other = queue_request(coalescer, f'{os.getpid()}-d', dict(prune=True), ['\\d'])
+    gone = queue_request(coalescer, 'x', key, ['\\e'], pid=dead_pid())
+    # Results nobody waits for anymore.
+    lock.write_json(os.path.join(queue, f'{dead_pid()}-f.done'), {})
+    applied = []
+
+    def apply(task_names):
+        applied.append(task_names)
+        return {'created': len(task_names)}
+
+    result = coalescer.apply(key, ['\\a'], apply)
+    assert applied == [['\\a', '\\b', '\\c']]
+    assert result['requests'] == 3
+    assert result['counts'] == {'created': 3}
+    assert sorted(os.listdir(queue)) == sorted([
+        f'{os.getpid()}-a.done',
+        f'{os.getpid()}-c.done',
+        os.path.basename(other),
+    ])
+    assert not os.path.exists(gone)
+    done = lock.read_json(os.path.join(queue, f'{os.getpid()}-a.done'))
+    assert done['ok'] and done['task_names'] == ['\\a', '\\b', '\\c']
+
+def test_coalescer_waiters_applied_once(tmp_path):
+    directory = str(tmp_path)
+    holder = lock.HostLock('host', directory=directory)
+    assert holder.try_acquire()
+    applied = []
+    results = []
+
+    def apply(task_names):
+        applied.append(task_names)
+        return {}
+
+    def wait(task_name):
+        coalescer = lock.Coalescer(lock.HostLock('host', directory=directory, poll_interval=0.01))
+        results.append(coalescer.apply({}, [task_name], apply))
+
+    threads = [threading.Thread(target=wait, args=(name, )) for name in ('\\a', '\\b')]
+    for thread in threads:
+        thread.start()
+    queue = holder.path + '.queue'
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if os.path.isdir(queue) and len(os.listdir(queue)) == 2:
+            break
+        time.sleep(0.01)
+    holder.release()
+    for thread in threads:
+        thread.join()
+    assert applied == [['\\a', '\\b']]
+    assert [result['requests'] for result in results] == [2, 2]
+    assert os.listdir(queue) == []
+
+def test_failed_apply_raised_by_waiters(tmp_path):
+    coalescer = lock.Coalescer(lock.HostLock('host', directory=str(tmp_path)))
+    queue_request(coalescer, f'{os.getpid()}-a', {}, ['\\b'])
+
+    def apply(task_names):
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        coalescer.apply({}, ['\\a'], apply)
+    done = lock.read_json(os.path.join(coalescer.queue_directory, f'{os.getpid()}-a.done'))
+    assert not done['ok']
+    assert done['error'] == 'RuntimeError: boom'
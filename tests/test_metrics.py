@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from quartz import metrics
+
+subprocesses = {
+    'query': dict(
+        count = 3,
+        failures = 1,
+        timeouts = 0,
+        retries = 1,
+        total_seconds = 0.5,
+        buckets = {'0.1': 2, '1.0': 1, '+Inf': 0},
+    ),
+}
+
+def write(path, success=True, config='config', host=None):
+    metrics.write_textfile(
+        str(path),
+        config = config,
+        command = 'update',
+        task_counts = {'configured': 2, 'failed': 0},
+        phases = {'render': 0.25},
+        success = success,
+        duration = 1.5,
+        subprocesses = subprocesses,
+        concurrency = None,
+        host = host,
+    )
+    return path.read_text(encoding='utf-8').splitlines()
+
+def test_exposition_format(tmp_path):
+    lines = write(tmp_path / 'quartz.prom', host='alpha')
+    labels = 'config="config",command="update",host="alpha"'
+    assert lines[:4] == [
+        '# HELP quartz_tasks Number of tasks by state in the last run.',
+        '# TYPE quartz_tasks gauge',
+        f'quartz_tasks{{{labels},state="configured"}} 2',
+        f'quartz_tasks{{{labels},state="failed"}} 0',
+    ]
+    assert '# TYPE quartz_subprocess_duration_seconds histogram' in lines
+    assert f'quartz_subprocess_duration_seconds_bucket{{{labels},kind="query",le="1.0"}} 3' in lines
+    assert f'quartz_subprocess_duration_seconds_count{{{labels},kind="query"}} 3' in lines
+    # Each family's samples follow its HELP and TYPE lines, once.
+    families = [line.split()[2] for line in lines if line.startswith('# TYPE')]
+    assert len(families) == len(set(families))
+    family = None
+    for line in lines:
+        if line.startswith('# TYPE'):
+            family = line.split()[2]
+        elif not line.startswith('#'):
+            assert line.startswith(family)
+
+def test_label_escaping(tmp_path):
+    lines = write(tmp_path / 'quartz.prom', config='a\\b"c\nd')
+    assert 'quartz_run_duration_seconds{config="a\\\\b\\"c\\nd",command="update",host="localhost"} 1.500000' in lines
+
+def test_failed_run_keeps_last_success(tmp_path):
+    path = tmp_path / 'quartz.prom'
+    lines = write(path, config='a"b')
+    [success] = [line for line in lines if line.startswith('quartz_last_success')]
+    lines = write(path, success=False, config='a"b')
+    assert 'quartz_last_run_success{config="a\\"b",command="update",host="localhost"} 0' in lines
+    assert success in lines
+
+def test_write_atomic(tmp_path, monkeypatch):
+    path = tmp_path / 'quartz.prom'
+    metrics.write_atomic(str(path), 'old\n')
+    assert os.listdir(tmp_path) == ['quartz.prom']
+
+    def fail(source, destination):
+        assert open(source).read() == 'new\n'
+        raise OSError('replace failed')
+
+    monkeypatch.setattr(metrics.os, 'replace', fail)
+    with pytest.raises(OSError):
+        metrics.write_atomic(str(path), 'new\n')
+    assert path.read_text() == 'old\n'
+    assert os.listdir(tmp_path) == ['quartz.prom']
+
+def test_host_path():
+    assert metrics.host_path('m/quartz.prom', None) == 'm/quartz.prom'
+    assert metrics.host_path('m/quartz.prom', 'alpha') == 'm/quartz.alpha.prom'
+    assert metrics.host_path('m/quartz.prom', 'fe80::1') == 'm/quartz.fe80__1.prom'
+    assert metrics.host_path('m/{host}.prom', 'alpha') == 'm/alpha.prom'
+    assert metrics.host_path('m/{host}.prom', None) == 'm/localhost.prom'
@@ -0,0 +1,36 @@
+import datetime
+
+import pytest
+
+from quartz import models
+
+def daily_trigger(schedule_by_day):
+    return models.Trigger(
+        'CalendarTrigger',
+        start_boundary = '2024-01-01T00:00:00',
+        enabled = True,
+        schedule_by_day = schedule_by_day,
+    )
+
+def test_interned_schedule_by_day_read_only():
+    schedule_by_day = {'days_interval': '2'}
+    shared = models.intern(daily_trigger(schedule_by_day))
+    with pytest.raises(TypeError):
+        shared.schedule_by_day['days_interval'] = '3'
+    # The shared trigger has a copy of the caller's dict.
+    schedule_by_day['days_interval'] = '3'
+    assert shared.schedule_by_day['days_interval'] == '2'
+    assert models.intern(daily_trigger({'days_interval': '2'})) is shared
+    assert models.intern(daily_trigger(schedule_by_day)) is not shared
+
+def test_frozen_schedule_by_day_plain_dict():
+    shared = models.intern(models.EveryMinutes(datetime.date(2024, 1, 1), 15))
+    assert shared.to_dict()['schedule_by_day'] == {'days_interval': '1'}
+    assert type(shared.to_dict()['schedule_by_day']) is dict
+    assert shared.structural_key() == shared.replace().structural_key()
+
+def test_replace_interned_schedule_by_day():
+    shared = models.intern(daily_trigger({'days_interval': '2'}))
+    changed = shared.replace(schedule_by_day={'days_interval': '4'})
+    assert changed.structural_hash() != shared.structural_hash()
+    assert models.intern(changed).schedule_by_day == {'days_interval': '4'}
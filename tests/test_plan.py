@@ -0,0 +1,56 @@
+import types
+
+from lxml import etree
+
+from quartz import plan
+
+def task(body, registration=''):
+    return (
+        '<Task xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task" version="1.3">'
+        f'<RegistrationInfo>{registration}</RegistrationInfo>{body}</Task>'
+    )
+
+exec_action = '<Actions Context="Author"><Exec><Command>cmd.exe</Command></Exec></Actions>'
+
+boot_trigger = '<Triggers><BootTrigger><Enabled>true</Enabled></BootTrigger></Triggers>'
+
+def is_unchanged(expected, registered):
+    return plan.is_unchanged(expected, etree.fromstring(registered.encode('utf-8')))
+
+def test_unchanged_ignores_registration_info_and_defaults():
+    expected = task(exec_action + '<Settings><Priority>7</Priority></Settings>')
+    registered = task(
+        exec_action
+        + '<Settings><Enabled>true</Enabled><IdleSettings><StopOnIdleEnd>true</StopOnIdleEnd>'
+        '</IdleSettings></Settings>'
+        '<Principals><Principal id="Author"><UserId>S-1-5-18</UserId></Principal></Principals>',
+        registration='<Author>someone</Author>',
+    )
+    assert is_unchanged(expected, registered)
+
+def test_extra_registered_trigger_is_a_change():
+    assert not is_unchanged(task(exec_action), task(boot_trigger + exec_action))
+
+def test_missing_registered_trigger_is_a_change():
+    assert not is_unchanged(task(boot_trigger + exec_action), task(exec_action))
+
+def test_different_exec_is_a_change():
+    registered = task(
+        '<Actions Context="Author"><Exec><Command>cmd.exe</Command>'
+        '<Arguments>/c del *</Arguments></Exec></Actions>'
+    )
+    assert not is_unchanged(task(exec_action), registered)
+
+def test_root_folder_owned_only_when_listed():
+    names = ['\\Top', '\\Jobs\\Nightly']
+    assert plan.owned_folders(types.SimpleNamespace(), names) == {'\\jobs'}
+    config_module = types.SimpleNamespace(QUARTZ_FOLDERS=['\\', '\\Jobs'])
+    assert plan.owned_folders(config_module, names) == {'\\', '\\jobs'}
+
+def test_prune_spares_root_folder_tasks():
+    config_module = types.SimpleNamespace()
+    configured = ['\\Top', '\\Jobs\\Nightly']
+    folders = plan.owned_folders(config_module, configured)
+    registered = plan.registered_index(['\\Top', '\\Other', '\\Jobs\\Nightly', '\\Jobs\\Old'])
+    items = plan.plan_deletes(registered, configured, folders)
+    assert [item.task_name for item in items] == ['\\Jobs\\Old']
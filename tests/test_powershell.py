@@ -0,0 +1,142 @@
+import base64
+import collections
+import io
+import logging
+
+from quartz import commands
+from quartz import fake
+from quartz import hosts
+from quartz import models
+from quartz import plan
+from quartz import powershell
+
+task_xml = '<Task xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task"/>'
+
+def test_quote():
+    assert powershell.quote('plain') == "'plain'"
+    assert powershell.quote("O'Brien") == "'O''Brien'"
+    assert powershell.quote('\u2018a\u2019') == "'\u2018\u2018a\u2019\u2019'"
+    assert powershell.quote('$env:PATH "x"') == "'$env:PATH \"x\"'"
+
+def test_task_args():
+    assert powershell.split_task_name('Task') == ('\\', 'Task')
+    assert powershell.task_args("\\Jobs\\O'Brien") == "-TaskPath '\\Jobs\\' -TaskName 'O''Brien'"
+
+def write_script(operations, remote=None):
+    script_file = io.StringIO()
+    writer = powershell.ScriptWriter(script_file, "C:\\Temp\\it's.jsonl", remote=remote)
+    ids = [writer.add(operation) for operation in operations]
+    return writer, script_file.getvalue(), ids
+
+def test_script_create_and_delete():
+    writer, script, ids = write_script([
+        dict(op='create', task_name='\\Jobs\\a', xml=task_xml),
+        dict(
+            op = 'create',
+            task_name = '\\Jobs\\b',
+            xml = task_xml,
+            run_as = dict(user='svc', password="pa'ss"),
+        ),
+        dict(op='delete', task_name='\\Jobs\\c'),
+    ])
+    assert ids == [0, 1, 2]
+    assert [operation['op'] for operation in writer.operations] == ['create', 'create', 'delete']
+    assert "$Results = 'C:\\Temp\\it''s.jsonl'" in script
+    assert 'New-CimSession' not in script
+    encoded = base64.b64encode(task_xml.encode('utf-8')).decode('ascii')
+    assert (
+        "Register-ScheduledTask @Session -TaskPath '\\Jobs\\' -TaskName 'a'"
+        f" -Xml (Read-Base64 '{encoded}') -Force | Out-Null\n    Write-Result 0\n"
+    ) in script
+    assert "-TaskName 'b' " in script
+    assert "-Force -User 'svc' -Password 'pa''ss' | Out-Null" in script
+    assert (
+        "Unregister-ScheduledTask @Session -TaskPath '\\Jobs\\' -TaskName 'c'"
+        ' -Confirm:$false | Out-Null\n    Write-Result 2\n'
+    ) in script
+    assert script.count('Write-Result 2 $_.Exception.Message') == 1
+
+def test_script_remote_session():
+    _, script, _ = write_script([], remote=hosts.Remote('alpha'))
+    assert "New-CimSession -ComputerName 'alpha'}" in script
+    _, script, _ = write_script([], remote=hosts.Remote('alpha', 'admin', "it's"))
+    assert "ConvertTo-SecureString 'it''s' -AsPlainText" in script
+    assert "PSCredential('admin', $Password)" in script
+    assert "-ComputerName 'alpha' -Credential $Credential" in script
+
+def test_delete_folder_command():
+    command = powershell.delete_folder_command("\\Jobs\\O'Brien")
+    assert command[:4] == ['PowerShell', '-NoProfile', '-NonInteractive', '-Command']
+    assert "$Service.Connect();" in command[-1]
+    assert "GetFolder('\\Jobs').DeleteFolder('O''Brien', 0)" in command[-1]
+    command = powershell.delete_folder_command('\\Jobs', hosts.Remote('alpha', 'admin', 'secret'))
+    assert "$Service.Connect('alpha', 'admin', $null, 'secret');" in command[-1]
+    assert "GetFolder('\\').DeleteFolder('Jobs', 0)" in command[-1]
+
+def test_script_command():
+    assert powershell.script_command('C:\\x.ps1') == [
+        'PowerShell', '-NoProfile', '-NonInteractive', '-ExecutionPolicy', 'Bypass',
+        '-File', 'C:\\x.ps1',
+    ]
+    command = powershell.script_command('C:\\my dir\\x.ps1', elevated=True)
+    assert command[command.index('-ArgumentList') + 1] == (
+        "'-NoProfile -NonInteractive -ExecutionPolicy Bypass -File \"C:\\my dir\\x.ps1\"'"
+    )
+    assert command[-2:] == ['-Verb', 'RunAs']
+
+operations = [
+    dict(id=0, op='create', task_name='\\a'),
+    dict(id=1, op='delete', task_name='\\b'),
+    dict(id=2, op='create', task_name='\\c'),
+]
+
+def test_parse_results_success():
+    lines = ['\ufeff{"id": 0, "ok": true}\n', '{"id":1,"ok":true}\n', '\n', '{"id":2,"ok":true}\n']
+    results = powershell.parse_results(lines, operations)
+    assert [result['ok'] for result in results] == [True, True, True]
+    assert results[1] == dict(id=1, op='delete', task_name='\\b', ok=True)
+
+def test_parse_results_partial_failure():
+    lines = [
+        '{"id":0,"ok":true}\n',
+        '{"id":1,"ok":false,"error":"Access is denied."}\n',
+        '{"id":2,"ok":false}\n',
+    ]
+    results = powershell.parse_results(lines, operations)
+    assert [result['ok'] for result in results] == [True, False, False]
+    assert results[1]['error'] == 'Access is denied.'
+    assert results[2]['error'] == 'Failed'
+
+def test_parse_results_truncated():
+    # The script stopped while writing the second result.
+    lines = ['{"id":0,"ok":true}\n', '{"id":1,"o']
+    results = powershell.parse_results(lines, operations)
+    assert [result['ok'] for result in results] == [True, False, False]
+    assert results[2]['error'] == 'No result, the script stopped before it'
+    assert [result['ok'] for result in powershell.parse_results([], operations)] == [False] * 3
+
+def test_bulk_apply_through_fake_fleet(use_runner):
+    fleet = fake.FakeFleet(hosts=('alpha', ))
+    use_runner(fleet)
+    scheduler = fleet.scheduler('alpha')
+    scheduler._register('\\Jobs\\old', task_xml)
+    task = models.Task(
+        "\\Jobs\\O'Brien",
+        actions = [models.Action('Exec', 'cmd.exe', '', '')],
+    )
+    items = [
+        plan.PlanItem(plan.CREATE, task.name, task, task_xml),
+        plan.PlanItem(plan.DELETE, '\\Jobs\\old', None, None),
+        plan.PlanItem(plan.DELETE, '\\Jobs\\gone', None, None),
+    ]
+    task_counts = collections.Counter()
+    with hosts.targeting(hosts.Remote('alpha')):
+        commands.apply_plan(
+            items,
+            logging.getLogger(__name__),
+            task_counts = task_counts,
+            bulk = True,
+        )
+    assert scheduler.task_names() == ["\\Jobs\\O'Brien"]
+    assert scheduler.get_xml("\\Jobs\\O'Brien", as_string=True).decode('utf-8') == task_xml
+    assert task_counts == {'created': 1, 'deleted': 1, 'failed': 1}
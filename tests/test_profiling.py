@@ -0,0 +1,18 @@
+import concurrent.futures
+
+from quartz import profiling
+
+def test_spans_from_threads():
+    profiler = profiling.Profiler(trace_memory=False)
+    profiler.start()
+
+    def work(index):
+        for _ in range(1000):
+            with profiler.span('work', f'task{index % 4}'):
+                pass
+
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        list(pool.map(work, range(8)))
+    report = profiler.report()
+    assert report['phases']['work']['count'] == 8000
+    assert sorted(report['tasks']) == ['task0', 'task1', 'task2', 'task3']
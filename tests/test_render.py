@@ -0,0 +1,71 @@
+import datetime
+import os
+
+import pytest
+
+from quartz import models
+from quartz import render
+from quartz import utils
+
+@pytest.fixture
+def jinja_env(monkeypatch):
+    # Templates are found from the working directory.
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return utils.get_jinja_env()
+
+@pytest.fixture
+def renderer(jinja_env):
+    return render.TaskRenderer(jinja_env)
+
+def every_fifteen_minutes():
+    return models.EveryMinutes(datetime.date(2024, 1, 1), 15, enabled=True)
+
+def make_task(name, trigger=None):
+    if trigger is None:
+        trigger = every_fifteen_minutes()
+    return models.Task(
+        name,
+        actions = [models.Action('Exec', 'cmd.exe', '/c exit', '')],
+        triggers = [trigger],
+    )
+
+def test_equal_task_reuses_fragments(renderer):
+    xml = renderer.render(make_task('\\Jobs\\first'))
+    misses = renderer.cache.misses
+    # trigger, action and settings.
+    assert misses == 3
+    # Not interned, so a distinct but structurally equal trigger.
+    trigger = every_fifteen_minutes().replace()
+    other_xml = renderer.render(make_task('\\Jobs\\second', trigger))
+    assert renderer.cache.misses == misses
+    assert renderer.cache.hits == 3
+    assert other_xml == xml.replace('\\Jobs\\first', '\\Jobs\\second')
+
+def test_changed_copy_misses(renderer):
+    renderer.render(make_task('\\Jobs\\first'))
+    misses = renderer.cache.misses
+    trigger = every_fifteen_minutes().replace()
+    trigger.enabled = False
+    xml = renderer.render(make_task('\\Jobs\\second', trigger))
+    assert renderer.cache.misses == misses + 1
+    assert '<Enabled>false</Enabled>' in xml
+
+def test_eviction_least_recently_used():
+    cache = render.LRUCache(maxsize=2)
+    cache.get('a', lambda: 1)
+    cache.get('b', lambda: 2)
+    cache.get('a', lambda: 1)
+    cache.get('c', lambda: 3)
+    assert list(cache.data) == ['a', 'c']
+    assert cache.stats() == dict(hits=1, misses=3, size=2, maxsize=2)
+    # Evicted, created again.
+    assert cache.get('b', lambda: 4) == 4
+
+def test_renderer_cache_bounded(jinja_env):
+    renderer = render.TaskRenderer(jinja_env, maxsize=4)
+    for minutes in range(1, 11):
+        trigger = models.EveryMinutes(datetime.date(2024, 1, 1), minutes)
+        xml = renderer.render(make_task(f'\\Jobs\\t{minutes}', trigger))
+        assert f'<Interval>PT{minutes}M</Interval>' in xml
+        assert len(renderer.cache.data) <= 4
+    assert renderer.cache.stats()['size'] == 4
@@ -0,0 +1,134 @@
+import datetime
+
+import pytest
+
+from quartz import models
+from quartz import schedule
+
+window_start = datetime.datetime(2024, 1, 10, 6, 0, 0)
+
+def brute_force_runs(trigger, start, end):
+    """
+    Run datetimes of a trigger in [start, end), stepping through every
+    activation and repetition.
+    """
+    first = datetime.datetime.fromisoformat(trigger.start_boundary)
+    if trigger.type_ == 'CalendarTrigger':
+        days = int((trigger.schedule_by_day or {}).get('days_interval', 1))
+        activation_step = datetime.timedelta(days=days)
+    else:
+        activation_step = None
+    if trigger.repetition is None:
+        step = length = datetime.timedelta(seconds=1)
+    else:
+        step = datetime.timedelta(seconds=schedule.duration_seconds(trigger.repetition.interval))
+        seconds = schedule.duration_seconds(trigger.repetition.duration)
+        if seconds is None:
+            length = activation_step or end - first
+        else:
+            length = datetime.timedelta(seconds=seconds)
+    runs = []
+    activation = first
+    while activation < end:
+        run = activation
+        while run == activation or run - activation < length:
+            if start <= run < end:
+                runs.append(run)
+            run += step
+        if activation_step is None:
+            break
+        activation += activation_step
+    return runs
+
+def trigger(type_='CalendarTrigger', start='2024-01-01T00:00:00', interval=None, duration='P1D', days=None):
+    repetition = None
+    if interval is not None:
+        repetition = models.Repetition(interval, duration, False)
+    schedule_by_day = None if days is None else {'days_interval': str(days)}
+    return models.Trigger(type_, repetition, start, enabled=True, schedule_by_day=schedule_by_day)
+
+triggers = {
+    'every 15 minutes': trigger(interval='PT15M'),
+    # 7 minutes do not divide a day, nor a 5 minute bin.
+    'every 7 minutes': trigger(interval='PT7M'),
+    'every 7 minutes offset': trigger(start='2024-01-01T00:03:30', interval='PT7M'),
+    'every 2 hours for 9 hours': trigger(start='2024-01-01T08:00:00', interval='PT2H', duration='PT9H'),
+    'indefinitely every 50 minutes': trigger(interval='PT50M', duration=''),
+    'every 3 days': trigger(start='2024-01-02T06:00:00', days=3),
+    'every 3 days, 45 minutes for 4 hours': trigger(start='2024-01-02T05:00:00', interval='PT45M', duration='PT4H', days=3),
+    'daily at window start': trigger(start='2024-01-01T06:00:00'),
+    'one time in window': trigger('TimeTrigger', start='2024-01-11T12:34:56'),
+    'one time repeating past window end': trigger('TimeTrigger', start='2024-01-12T05:00:00', interval='PT20M', duration='PT3H'),
+    'one time indefinitely': trigger('TimeTrigger', start='2024-01-11T00:00:00', interval='PT6H', duration=''),
+    'starts after window': trigger(start='2024-02-01T00:00:00', interval='PT5M'),
+    'one time before window': trigger('TimeTrigger', start='2024-01-09T00:00:00'),
+}
+
+# Windows of 2 days and a few minutes, edges inside and on run times.
+windows = [
+    (window_start, window_start + datetime.timedelta(days=2)),
+    (window_start + datetime.timedelta(seconds=1), window_start + datetime.timedelta(days=2, minutes=7, seconds=30)),
+    (datetime.datetime(2024, 1, 12, 5, 20), datetime.datetime(2024, 1, 12, 5, 40)),
+]
+
+@pytest.mark.parametrize('name', triggers)
+@pytest.mark.parametrize('window', windows)
+def test_progressions_match_brute_force(name, window):
+    start, end = window
+    progressions = schedule.trigger_progressions(
+        triggers[name],
+        schedule.to_seconds(start),
+        schedule.to_seconds(end),
+    )
+    runs = sorted(
+        schedule.from_seconds(run)
+        for first, step, count in progressions
+        for run in range(first, first + step * count, step)
+    )
+    assert runs == brute_force_runs(triggers[name], start, end)
+
+def brute_force_histogram(tasks, start, end, bin_seconds):
+    nbins = -(-int((end - start).total_seconds()) // bin_seconds)
+    histogram = [0] * nbins
+    for task in tasks:
+        for task_trigger in task.triggers:
+            for run in brute_force_runs(task_trigger, start, end):
+                histogram[int((run - start).total_seconds()) // bin_seconds] += 1
+    return histogram
+
+@pytest.fixture(params=['python', 'numpy'])
+def histogram_module(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(schedule, 'numpy', None)
+
+@pytest.mark.parametrize('bin_seconds', [60, 300, 3600, 7 * 60])
+@pytest.mark.parametrize('window', windows)
+def test_histogram_matches_brute_force(histogram_module, bin_seconds, window):
+    start, end = window
+    # Tasks sharing triggers weigh their progressions.
+    shared = models.intern(triggers['every 15 minutes'])
+    tasks = [
+        models.Task(f'\\{name}', triggers=[models.intern(task_trigger)])
+        for name, task_trigger in triggers.items()
+    ]
+    tasks.append(models.Task('\\shared', triggers=[shared, triggers['every 7 minutes offset']]))
+    task_schedule = schedule.Schedule(start, end)
+    for task in tasks:
+        task_schedule.add(task)
+    expected = brute_force_histogram(tasks, start, end, bin_seconds)
+    assert task_schedule.histogram(bin_seconds) == expected
+    counts = task_schedule.run_counts()
+    assert sum(counts.values()) == sum(expected)
+
+def test_disabled_triggers_skipped():
+    disabled = models.Trigger('CalendarTrigger', None, '2024-01-01T00:00:00')
+    task = models.Task('\\Off', triggers=[disabled])
+    end = window_start + datetime.timedelta(days=2)
+    task_schedule = schedule.Schedule(window_start, end)
+    task_schedule.add(task)
+    assert task_schedule.run_counts() == {'\\Off': 0}
+    task_schedule = schedule.Schedule(window_start, end, include_disabled=True)
+    task_schedule.add(task)
+    assert task_schedule.run_counts() == {'\\Off': 2}
@@ -0,0 +1,65 @@
+import datetime
+
+import pytest
+
+from quartz import schtasks
+
+@pytest.fixture(params=[False, True], ids=['month-first', 'day-first'])
+def day_first(request, monkeypatch):
+    monkeypatch.setattr(schtasks, 'day_first', lambda: request.param)
+    return request.param
+
+def test_ambiguous_date_follows_locale(day_first):
+    parsed = schtasks.RunTimeParser().parse('02/03/2001 10:30:00')
+    if day_first:
+        assert parsed == datetime.datetime(2001, 3, 2, 10, 30)
+    else:
+        assert parsed == datetime.datetime(2001, 2, 3, 10, 30)
+
+def test_unambiguous_value_decides_listing(day_first):
+    # 25 is not a month, so the listing is day first whatever the locale.
+    parser = schtasks.RunTimeParser()
+    parsed = parser.parse_all(['02/03/2001 10:30:00', '25/03/2001 10:30:00'])
+    assert parser.format == '%d/%m/%Y %H:%M:%S'
+    assert parsed == [
+        datetime.datetime(2001, 3, 2, 10, 30),
+        datetime.datetime(2001, 3, 25, 10, 30),
+    ]
+
+def test_twelve_hour_clock(day_first):
+    parsed = schtasks.RunTimeParser().parse('12/31/2001 1:05:00 PM')
+    assert parsed == datetime.datetime(2001, 12, 31, 13, 5)
+
+@pytest.mark.parametrize('value', [
+    '11/30/1999 12:00:00 AM',
+    '30/11/1999 00:00:00',
+    '1999-11-30 00:00:00',
+])
+def test_never_ran_sentinel(day_first, value):
+    assert schtasks.RunTimeParser().parse(value) is None
+
+@pytest.mark.parametrize('value', ['N/A', 'Disabled', 'Never', 'Running', ''])
+def test_not_run_times(day_first, value):
+    parser = schtasks.RunTimeParser()
+    assert parser.parse(value) is None
+    assert parser.format is None
+
+def test_not_run_times_skipped_by_detect(day_first):
+    parser = schtasks.RunTimeParser()
+    parsed = parser.parse_all(['N/A', 'Disabled', '13/02/2001 08:00:00'])
+    assert parsed == [None, None, datetime.datetime(2001, 2, 13, 8)]
+
+def test_rows_share_parser():
+    parser = schtasks.CsvListingParser()
+    parser.add(['TaskName', 'Next Run Time', 'Status'])
+    rows = [
+        parser.add(['\\A', '02/03/2001 10:30:00', 'Ready']),
+        parser.add(['\\B', '25/03/2001 10:30:00', 'Ready']),
+        parser.add(['\\C', 'N/A', 'Disabled']),
+    ]
+    assert schtasks.parse_run_times(rows) == [
+        datetime.datetime(2001, 3, 2, 10, 30),
+        datetime.datetime(2001, 3, 25, 10, 30),
+        None,
+    ]
+    assert rows[0].next_run_time == datetime.datetime(2001, 3, 2, 10, 30)
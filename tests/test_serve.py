@@ -0,0 +1,205 @@
+import json
+import os
+import sys
+import threading
+import types
+import urllib.error
+import urllib.request
+
+import pytest
+
+from quartz import fake
+from quartz import inventory
+from quartz import models
+from quartz import serve
+from quartz import watch
+
+def make_api(token='secret'):
+    return serve.Api(None, lambda: None, apply=lambda **kwargs: {}, token=token)
+
+def test_apply_requires_token():
+    with pytest.raises(ValueError):
+        serve.Api(None, lambda: None, apply=lambda **kwargs: {})
+
+def test_origin_refused():
+    api = make_api()
+    with pytest.raises(serve.ApiError) as info:
+        api.check_headers({'Origin': 'http://example.com'})
+    assert info.value.status == 403
+
+def test_post_requires_json():
+    api = make_api()
+    headers = {'Content-Type': 'text/plain', 'Authorization': 'Bearer secret'}
+    with pytest.raises(serve.ApiError) as info:
+        api.check_headers(headers, post=True)
+    assert info.value.status == 415
+
+@pytest.mark.parametrize('authorization', [None, 'Bearer wrong', 'secret'])
+def test_post_requires_token(authorization):
+    api = make_api()
+    headers = {'Content-Type': 'application/json'}
+    if authorization is not None:
+        headers['Authorization'] = authorization
+    with pytest.raises(serve.ApiError) as info:
+        api.check_headers(headers, post=True)
+    assert info.value.status == 401
+
+def test_post_accepted():
+    api = make_api()
+    headers = {
+        'Content-Type': 'application/json; charset=utf-8',
+        'Authorization': 'Bearer secret',
+    }
+    api.check_headers(headers, post=True)
+
+def test_post_disabled_without_apply():
+    api = serve.Api(None, lambda: None)
+    with pytest.raises(serve.ApiError) as info:
+        api.check_headers({'Content-Type': 'application/json'}, post=True)
+    assert info.value.status == 403
+
+def test_load_token_creates_private_file(tmp_path):
+    path = str(tmp_path / 'quartz' / 'serve.token')
+    token = serve.load_token(path, create=True)
+    assert token
+    assert serve.load_token(path) == token
+    if os.name != 'nt':
+        assert os.stat(path).st_mode & 0o777 == 0o600
+
+task_xml = """\
+<Task version="1.2" xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task">
+    <RegistrationInfo><Description>{description}</Description></RegistrationInfo>
+</Task>
+"""
+
+@pytest.fixture
+def scheduler():
+    return fake.FakeScheduler(tasks={
+        '\\Jobs\\a': task_xml.format(description='a'),
+        '\\Jobs\\b': task_xml.format(description='b'),
+        '\\Other': task_xml.format(description='other'),
+    })
+
+def test_inventory_refresh(scheduler):
+    task_inventory = inventory.Inventory(backend=scheduler, max_age=60)
+    assert task_inventory.age() is None
+    tasks = task_inventory.snapshot()
+    assert sorted(entry['row']['TaskName'] for entry in tasks.values()) == [
+        '\\Jobs\\a', '\\Jobs\\b', '\\Other',
+    ]
+    assert tasks['\\jobs\\a']['xml']['RegistrationInfo']['Description'] == 'a'
+    assert scheduler.calls.count('query') == 4
+    # Fresh enough, nothing is queried.
+    assert task_inventory.snapshot() is tasks
+    assert scheduler.calls.count('query') == 4
+    # A refresh lists again, but only fetches XML that is stale.
+    scheduler.delete('\\Other')
+    tasks = task_inventory.refresh()
+    assert sorted(tasks) == ['\\jobs\\a', '\\jobs\\b']
+    assert scheduler.calls.count('query') == 5
+    task_inventory.invalidate(['\\Jobs\\b'])
+    assert task_inventory.age() is None
+    task_inventory.snapshot()
+    assert scheduler.calls.count('query') == 7
+    assert task_inventory.refreshes == 3
+
+def test_inventory_refresh_shared(scheduler):
+    scheduler.latency = 0.05
+    task_inventory = inventory.Inventory(backend=scheduler, with_xml=False)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(task_inventory.refresh()))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert task_inventory.refreshes == 1
+    assert all(result is results[0] for result in results)
+
+def make_served_api(scheduler, apply=None):
+    task_inventory = inventory.Inventory(backend=scheduler)
+    config_module = types.SimpleNamespace(
+        QUARTZ_TASKS = (models.Task('\\Jobs\\a'), models.Task('\\Jobs\\new')),
+    )
+    return serve.Api(
+        task_inventory,
+        lambda: config_module,
+        apply = apply,
+        token = 'secret' if apply else None,
+    )
+
+def test_endpoints(scheduler):
+    api = make_served_api(scheduler)
+    assert api.health({}) == dict(tasks=0, age_seconds=None, refreshes=0)
+    names = [row['TaskName'] for row in api.list_tasks({'match': ['\\jobs\\*']})['tasks']]
+    assert names == ['\\Jobs\\a', '\\Jobs\\b']
+    assert api.list_tasks({'Status': ['Disabled']}) == dict(tasks=[])
+    task = api.get_task({'name': ['\\JOBS\\B']})
+    assert task['TaskName'] == '\\Jobs\\b'
+    assert task['xml']['RegistrationInfo']['Description'] == 'b'
+    with pytest.raises(serve.ApiError) as info:
+        api.get_task({})
+    assert info.value.status == 400
+    with pytest.raises(serve.ApiError) as info:
+        api.get_task({'name': ['\\Missing']})
+    assert info.value.status == 404
+    assert api.check({}) == dict(configured=2, missing=['\\Jobs\\new'])
+    assert api.health({})['tasks'] == 3
+    with pytest.raises(serve.ApiError) as info:
+        api.apply({})
+    assert info.value.status == 403
+
+def test_apply_invalidates(scheduler):
+    calls = []
+
+    def apply(**kwargs):
+        calls.append(kwargs)
+        scheduler._register('\\Jobs\\new', task_xml.format(description='new'))
+        return dict(counts={'created': 1})
+
+    api = make_served_api(scheduler, apply=apply)
+    assert api.apply({'tasks': ['\\Jobs\\new']}) == dict(counts={'created': 1})
+    [kwargs] = calls
+    assert kwargs['task_names'] == ['\\Jobs\\new']
+    assert not kwargs['prune'] and not kwargs['plan_only']
+    assert sorted(kwargs['listing']) == ['\\Jobs\\a', '\\Jobs\\b', '\\Other']
+    assert api.check({}) == dict(configured=2, missing=[])
+
+def test_http_server(scheduler):
+    api = make_served_api(scheduler, apply=lambda **kwargs: dict(plan=kwargs['plan_only']))
+    server = serve.make_server(api, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    # Without proxies from the environment.
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+    try:
+        with opener.open(base + '/tasks?match=*\\a') as response:
+            assert [row['TaskName'] for row in json.load(response)['tasks']] == ['\\Jobs\\a']
+        request = urllib.request.Request(
+            base + '/apply',
+            data = json.dumps(dict(plan=True)).encode('utf-8'),
+            headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer secret'},
+        )
+        with opener.open(request) as response:
+            assert json.load(response) == dict(plan=True)
+        with pytest.raises(urllib.error.HTTPError) as info:
+            opener.open(base + '/nothing')
+        assert info.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_config_reloaded_when_changed(config_file, monkeypatch):
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+    name = config_file('QUARTZ_TASKS = []\n')
+    config_cache = watch.ConfigCache(name)
+    config_module = config_cache.get()
+    assert config_cache.get() is config_module
+    config_file('from quartz import models\nQUARTZ_TASKS = [models.Task("\\\\A")]\n')
+    reloaded = config_cache.get()
+    assert reloaded is not config_module
+    assert [task.name for task in reloaded.QUARTZ_TASKS] == ['\\A']
+    assert config_cache.get() is reloaded
@@ -0,0 +1,42 @@
+import datetime
+
+import pytest
+
+from quartz import models
+from quartz import spread
+
+def every(minutes, offset=0):
+    return models.EveryMinutes(datetime.date(2024, 1, 1), minutes, offset, enabled=True)
+
+def test_with_offset_keeps_trigger_class():
+    trigger = every(15)
+    moved = spread.with_offset(trigger, 7)
+    assert isinstance(moved, models.EveryMinutes)
+    assert moved.start_boundary == '2024-01-01T00:07:00'
+    assert moved.repetition is trigger.repetition
+    assert spread.interval_minutes(moved) == 15
+    assert trigger.start_boundary == '2024-01-01T00:00:00'
+
+def test_with_offset_interned():
+    assert spread.with_offset(every(15), 7) is models.intern(every(15, 7))
+
+def test_offset_task_stays_movable():
+    task = models.Task('\\Job', triggers=[every(30)])
+    spread.apply_offset(task, {'\\Job': 12})
+    assert spread.movable_interval(task) == 30
+    spread.apply_offset(task, {'\\Job': 20})
+    assert task.triggers[0].start_boundary == '2024-01-01T00:20:00'
+
+def test_replace_unknown_attribute():
+    with pytest.raises(TypeError):
+        every(15).replace(interval=5)
+
+def test_interned_triggers_frozen():
+    trigger = models.intern(every(15))
+    with pytest.raises(AttributeError):
+        trigger.start_boundary = '2024-01-01T00:05:00'
+    assert trigger.structural_hash() == trigger.structural_hash()
+    # Tasks are not shared, their triggers are replaced.
+    task = models.Task('\\Job', triggers=[trigger])
+    task.triggers = [trigger.replace(enabled=False)]
+    assert task.triggers[0].enabled is False
@@ -0,0 +1,87 @@
+import logging
+import sys
+
+import pytest
+
+from quartz import fake
+from quartz import watch
+
+config_source = """
+    from quartz import models
+
+    QUARTZ_TASKS = [
+        models.Task(
+            '\\\\Jobs\\\\' + name,
+            actions = [models.Action('Exec', command, '', '')],
+        )
+        for name, command in {tasks!r}.items()
+    ]
+"""
+
+@pytest.fixture
+def watcher(config_file, use_runner, monkeypatch):
+    # Rewritten files can keep their size and modification time.
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+    use_runner(fake.FakeFleet())
+    applied = []
+
+    def write(tasks=None, source=None):
+        config_file(source or config_source.format(tasks=tasks))
+
+    write(dict(a='a.exe', b='b.exe'))
+    watcher = watch.Watcher(
+        'quartz_test_config',
+        lambda items: applied.append([(item.action, item.task_name) for item in items]),
+        logging.getLogger(__name__),
+        interval = 0,
+        debounce = 0,
+        prune = True,
+    )
+    watcher.write = write
+    watcher.applied_items = applied
+    return watcher
+
+def test_broken_config_keeps_last_good(watcher, caplog):
+    watcher.apply_config(watcher.load())
+    assert watcher.applied_items == [[('create', '\\Jobs\\a'), ('create', '\\Jobs\\b')]]
+    last_applied = watcher.applied
+
+    watcher.write(source='QUARTZ_TASKS = [')
+    assert watcher.load() is None
+    assert 'Failed to load' in caplog.text
+
+    # Invalid action type.
+    watcher.write(source=config_source.format(tasks=dict(a='a.exe')).replace("'Exec'", "'Nope'"))
+    watcher.apply_config(watcher.load())
+    assert 'Failed to apply' in caplog.text
+    assert watcher.applied is last_applied
+    assert len(watcher.applied_items) == 1
+
+    watcher.write(dict(a='a.exe', b='other.exe', c='c.exe'))
+    watcher.apply_config(watcher.load())
+    assert watcher.applied_items[1:] == [[('overwrite', '\\Jobs\\b'), ('create', '\\Jobs\\c')]]
+
+    watcher.write(dict(a='a.exe', c='c.exe'))
+    watcher.apply_config(watcher.load())
+    assert watcher.applied_items[2:] == [[('delete', '\\Jobs\\b')]]
+
+def test_watch_loop_applies_after_changes(watcher, monkeypatch):
+    edits = [
+        lambda: watcher.write(source='QUARTZ_TASKS = ['),
+        None,
+        lambda: watcher.write(dict(a='changed.exe', b='b.exe')),
+        None,
+    ]
+
+    def sleep(seconds):
+        edit = edits.pop(0)
+        if edit is not None:
+            edit()
+
+    monkeypatch.setattr(watch.time, 'sleep', sleep)
+    watcher.watch(iterations=4)
+    assert edits == []
+    assert watcher.applied_items == [
+        [('create', '\\Jobs\\a'), ('create', '\\Jobs\\b')],
+        [('overwrite', '\\Jobs\\a')],
+    ]